@@ -0,0 +1,70 @@
+# Author: Mattia Silvestri
+
+"""
+    Compare the throughput of the feasibility checks when a new PLSSolver is built for each query and when the
+    persistent PLSFeasibilityChecker is reused.
+"""
+
+from utility import PLSSolver, PLSFeasibilityChecker
+from datasetgenerator.latinsquare import sample_latin_squares
+import numpy as np
+import argparse
+import time
+
+########################################################################################################################
+
+
+def random_partial_squares(num, dim, fill_ratio, rng):
+    """
+    Random partial assignments, obtained by emptying cells of random Latin Squares; a random cell is then overwritten
+    with a random value so that some of the partial assignments are infeasible.
+    :param num: number of partial assignments; as integer.
+    :param dim: PLS dimension; as integer.
+    :param fill_ratio: fraction of assigned cells; as float.
+    :param rng: random generator; as numpy.random.Generator.
+    :return: numpy array of shape (num, dim**2) with decimal assigned values (0 means empty).
+    """
+    squares = sample_latin_squares(num, dim, rng).astype(np.int64)
+    squares[rng.random(squares.shape) >= fill_ratio] = 0
+    cells = rng.integers(0, dim ** 2, size=num)
+    squares[np.arange(num), cells] = rng.integers(1, dim + 1, size=num)
+    return squares
+
+########################################################################################################################
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--dim", type=int, default=10,
+                        help="Problem dimension")
+    parser.add_argument("--num-queries", type=int, default=1000,
+                        help="Number of feasibility queries")
+    parser.add_argument("--fill-ratio", type=float, default=0.5,
+                        help="Fraction of assigned cells of the partial assignments")
+    parser.add_argument("--solver-time-limit", default=30.0, type=float,
+                        help="Time limit in seconds of each query")
+    parser.add_argument("--solver-workers", default=1, type=int,
+                        help="Number of parallel search workers of the solver")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the random partial assignments")
+
+    args = parser.parse_args()
+
+    queries = random_partial_squares(args.num_queries, args.dim, args.fill_ratio, np.random.default_rng(args.seed))
+
+    start = time.time()
+    baseline = [PLSSolver(args.dim, square=square).solve() for square in queries]
+    baseline_time = time.time() - start
+
+    checker = PLSFeasibilityChecker(args.dim, args.solver_time_limit, args.solver_workers)
+    start = time.time()
+    persistent = [checker.solve(square) for square in queries]
+    persistent_time = time.time() - start
+
+    print("Queries: {} | feasible: {}".format(len(queries), sum(persistent)))
+    print("Construct per call: {:.3f} ms/query".format(1000 * baseline_time / len(queries)))
+    print("Persistent checker: {:.3f} ms/query".format(1000 * persistent_time / len(queries)))
+    print("Speedup: {:.2f}x".format(baseline_time / max(persistent_time, 1e-9)))
+    print("Disagreements: {} | Timeouts: {}".format(sum(b != p for b, p in zip(baseline, persistent)),
+                                                   checker.num_timeouts))
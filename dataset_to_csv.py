@@ -1,9 +1,92 @@
 # Author: Mattia Silvestri
 
-from utility import load_dataset, PLSInstance
+from utility import load_dataset, split_file_by_lines, PLSInstance
 import argparse
+import multiprocessing
+import os
+import shutil
 
 ########################################################################################################################
+
+
+def shard_filename(filename, shard_idx):
+    """
+    Name of the file where a shard of the output is saved to.
+    :param filename: name of the final output file; as string.
+    :param shard_idx: index of the shard; as integer.
+    :return: string; the shard filename.
+    """
+    return "{}.part{}".format(filename, shard_idx)
+
+########################################################################################################################
+
+
+def convert(filename, dim, domains_filenames, partial_sols_filename, assignments_filename, start_offset=0,
+            end_offset=None):
+    """
+    Convert (a byte range of) the txt file with the partial solutions - assignments pairs to CSV files.
+    :param filename: path of the txt file; as string.
+    :param dim: problem dimension; as integer.
+    :param domains_filenames: paths where the variables domains are saved to, one for each propagation type;
+                              as dictionary.
+    :param partial_sols_filename: path where the partial solutions are saved to; as string.
+    :param assignments_filename: path where the assignments are saved to; as string.
+    :param start_offset: byte offset of the first line to be converted; as integer.
+    :param end_offset: byte offset where the conversion stops; as integer.
+    :return:
+    """
+    load_dataset(filename=filename,
+                 problem=PLSInstance(n=dim),
+                 mode="onehot",
+                 domains_filenames=domains_filenames,
+                 save_partial_solutions=True,
+                 partial_sols_filename=partial_sols_filename,
+                 assignments_filename=assignments_filename,
+                 start_offset=start_offset,
+                 end_offset=end_offset)
+
+########################################################################################################################
+
+
+def convert_shard(shard_idx, start_offset, end_offset, args, domains_filenames):
+    """
+    Convert a single shard of the input file; the output files are suffixed with the shard index.
+    :param shard_idx: index of the shard; as integer.
+    :param start_offset: byte offset where the shard starts; as integer.
+    :param end_offset: byte offset where the shard ends; as integer.
+    :param args: command line arguments; as argparse.Namespace.
+    :param domains_filenames: paths where the variables domains are saved to, one for each propagation type;
+                              as dictionary.
+    :return:
+    """
+    convert(filename=args.filename,
+            dim=args.dim,
+            domains_filenames={t: shard_filename(f, shard_idx) for t, f in domains_filenames.items()},
+            partial_sols_filename=shard_filename(args.partial_sols_filename, shard_idx),
+            assignments_filename=shard_filename(args.assignments_filename, shard_idx),
+            start_offset=start_offset,
+            end_offset=end_offset)
+
+########################################################################################################################
+
+
+def merge_shards(filename, num_shards):
+    """
+    Concatenate the shards of an output file preserving the rows order, then remove them.
+    :param filename: name of the final output file; as string.
+    :param num_shards: number of shards; as integer.
+    :return:
+    """
+    with open(filename, "wb") as out_file:
+        for shard_idx in range(num_shards):
+            part = shard_filename(filename, shard_idx)
+            with open(part, "rb") as part_file:
+                shutil.copyfileobj(part_file, out_file)
+            os.remove(part)
+
+########################################################################################################################
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
 
@@ -11,30 +94,43 @@ if __name__ == '__main__':
                         help="Path of the txt file with the partial solutions - assignments pairs")
     parser.add_argument("--partial-sols-filename", type=str, default=None, required=True,
                         help="Path where the partial solutions are saved to")
-    parser.add_argument("--domains-filename", type=str, default=None, required=False,
-                        help="Path where the variables domains are saved to")
-    parser.add_argument("--domains-type", choices=['full', 'rows'], default=None,
-                        help="Compute variables domains with forward checking propagator and save them in a CSV file.")
+    parser.add_argument("--domains-filename", type=str, nargs='+', default=[], required=False,
+                        help="Path where the variables domains are saved to; one path for each domains type")
+    parser.add_argument("--domains-type", choices=['full', 'rows'], nargs='+', default=[],
+                        help="Compute variables domains with forward checking propagator and save them in a CSV file. "
+                             "Several propagation types can be specified to compute all of them in a single pass.")
     parser.add_argument("--assignments-filename", type=str, default=None, required=True,
                         help="Path where the assignments are saved to")
     parser.add_argument("--dim", type=int, default=None, required=True,
                         help="Problem dimension")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes; the input file is split in byte ranges at line boundaries and "
+                             "each range is converted by a different process. Rows order is preserved.")
 
     args = parser.parse_args()
 
-    leave_columns_domains = False
-    save_domains = False
-    if args.domains_type == 'rows':
-        leave_columns_domains = True
-        save_domains = True
-    elif args.domains_type == 'full':
-        save_domains = True
+    if len(args.domains_type) != len(args.domains_filename):
+        parser.error("--domains-type and --domains-filename must have the same number of values")
+    if len(set(args.domains_type)) != len(args.domains_type):
+        parser.error("Each domains type can be specified only once")
+    domains_filenames = dict(zip(args.domains_type, args.domains_filename))
 
-    load_dataset(filename=args.filename,
-                 problem=PLSInstance(n=args.dim, leave_columns_domains=leave_columns_domains),
-                 mode="onehot",
-                 save_domains=save_domains,
-                 domains_filename=args.domains_filename,
-                 save_partial_solutions=True,
-                 partial_sols_filename=args.partial_sols_filename,
-                 assignments_filename=args.assignments_filename)
\ No newline at end of file
+    if args.workers <= 1:
+        convert(filename=args.filename,
+                dim=args.dim,
+                domains_filenames=domains_filenames,
+                partial_sols_filename=args.partial_sols_filename,
+                assignments_filename=args.assignments_filename)
+    else:
+        shards = split_file_by_lines(args.filename, args.workers)
+        print("Converting {} shards with {} processes".format(len(shards), args.workers))
+
+        with multiprocessing.Pool(args.workers) as pool:
+            pool.starmap(convert_shard,
+                         [(shard_idx, start, end, args, domains_filenames)
+                          for shard_idx, (start, end) in enumerate(shards)])
+
+        # Concatenate the shards in the same order of the input file
+        output_filenames = [args.partial_sols_filename, args.assignments_filename] + list(domains_filenames.values())
+        for output_filename in output_filenames:
+            merge_shards(output_filename, len(shards))
@@ -1,6 +1,11 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import gzip
+import math
+import numpy as np
+
+
 def onehot(val, N, extra=False):
     vals = [0] * N
     if extra: vals.append(0)
@@ -9,8 +14,14 @@ def onehot(val, N, extra=False):
 
 
 def format_pls(X, n, frm):
-    s = ''
     V = {(i,j):x.Value() if x.Bound() else 0 for (i,j), x in X.items()}
+    return format_values([V[i,j] for i in range(n) for j in range(n)], n, frm)
+
+
+def format_values(vals, n, frm):
+    # Format a PLS given as a list of n*n values, by rows (0 means empty)
+    s = ''
+    V = {(i,j):vals[i*n+j] for i in range(n) for j in range(n)}
     if frm == 'friendly':
         s += '\n'
         for i in range(n):
@@ -24,3 +35,116 @@ def format_pls(X, n, frm):
             s += ','.join(onehot(V[i,j], n) for j in range(n))
             if i < n-1: s += ','
     return s
+
+
+def values_to_onehot(V, n):
+    # Convert a (N, n*n) array of values (0 means empty) to a (N, n**3) one-hot array
+    V = np.asarray(V)
+    res = (V[:, :, None] == np.arange(1, n+1)).astype(np.int8)
+    return res.reshape(V.shape[0], n**3)
+
+
+def write_pls_batch(fp, V, n, frm):
+    # Write a (N, n*n) array of values (0 means empty) with a single bulk
+    # write; the output is the same as printing format_values for each row,
+    # except for the empty cells in the "bin" format: they are written as n
+    # zeros, while onehot(0, n) sets the last bit (so that they can be read
+    # back as empty by read_pls_batch). "bits" is the "bin" format without
+    # separators
+    V = np.asarray(V)
+    fp.flush()
+    out = getattr(fp, 'buffer', fp)
+    if frm in ('bin', 'bits'):
+        digits = values_to_onehot(V, n).astype(np.uint8) + ord('0')
+        if frm == 'bin':
+            res = np.full((V.shape[0], 2 * digits.shape[1]), ord(','), dtype=np.uint8)
+            res[:, 0::2] = digits
+        else:
+            res = np.empty((V.shape[0], digits.shape[1] + 1), dtype=np.uint8)
+            res[:, :-1] = digits
+        res[:, -1] = ord('\n')
+        out.write(res.tobytes())
+    elif frm == 'csv':
+        np.savetxt(out, V, fmt='%d', delimiter=',')
+    else:
+        out.write(''.join(format_values(v, n, frm) + '\n' for v in V).encode())
+    out.flush()
+
+
+def save_pls_pool(fname, V, n):
+    # Store a (N, n*n) array of values in a compact binary file: ".npz" files
+    # contain the packed one-hot encoding ("confs") and the int8 values, other
+    # files are plain ".npy" arrays of int8 values
+    V = np.asarray(V, dtype=np.int8)
+    if fname.endswith('.npz'):
+        confs = np.packbits(values_to_onehot(V, n), axis=1)
+        np.savez_compressed(fname, confs=confs, values=V, order=n)
+    else:
+        np.save(fname, V)
+
+
+def onehot_to_values(onehot, order):
+    # Convert a (N, order**3) one-hot array to a (N, order, order) int8 array
+    # of values (0 means empty)
+    onehot = onehot.reshape(onehot.shape[0], order, order, order)
+    vals = np.tensordot(onehot.astype(np.int8), np.arange(1, order+1, dtype=np.int8), axes=1)
+    return vals.astype(np.int8)
+
+
+def read_pls_batch(fp, frm, max_size=None):
+    # Bulk version of plstest.read_pls: load all the instances in a single
+    # (N, order, order) int8 matrix of values (0 means empty)
+    if frm in ('csv', 'bin'):
+        data = np.loadtxt(fp, delimiter=',', dtype=np.int8, max_rows=max_size, ndmin=2)
+    elif frm == 'bits':
+        lines = []
+        for line in fp:
+            if isinstance(line, str):
+                line = line.encode()
+            lines.append(line.strip())
+            if len(lines) == max_size:
+                break
+        if any(len(line) != len(lines[0]) for line in lines):
+            raise ValueError('Inconsistent order of the PLS instances')
+        data = np.frombuffer(b''.join(lines), dtype=np.uint8) - ord('0')
+        data = data.reshape(len(lines), -1).astype(np.int8)
+    # Detect the PLS order
+    if frm == 'csv':
+        order = int(round(math.sqrt(data.shape[1])))
+        if order**2 != data.shape[1]:
+            raise ValueError('Invalid problem order')
+        return order, data.reshape(-1, order, order)
+    order = int(round(data.shape[1]**(1./3)))
+    if order**3 != data.shape[1]:
+        raise ValueError('Invalid problem order')
+    return order, onehot_to_values(data, order)
+
+
+def load_pls_npz(fname, max_size=None):
+    # Load instances stored as packed one-hot encodings ("confs"); the order
+    # is read from the file or, for files without it, detected from the
+    # number of bytes, taking into account the padding to a multiple of 8
+    # (orders 1 and 2 cannot be told apart)
+    with np.load(fname) as fp:
+        confs = fp['confs'][:max_size]
+        order = int(fp['order']) if 'order' in fp.files else None
+    if order is None:
+        order = 1
+        while (order**3 + 7) // 8 < confs.shape[1]:
+            order += 1
+    if (order**3 + 7) // 8 != confs.shape[1]:
+        raise ValueError('Invalid problem order')
+    onehot = np.unpackbits(confs, axis=1)[:, :order**3]
+    return order, onehot_to_values(onehot, order)
+
+
+def read_pls_file(fname, frm, max_size=None):
+    # Read the instances of a (possibly gzipped) text file or of a ".npz" file
+    # with packed one-hot encodings
+    if fname.endswith('.gz'):
+        with gzip.open(fname) as fp:
+            return read_pls_batch(fp, frm, max_size)
+    elif fname.endswith('.npz'):
+        return load_pls_npz(fname, max_size)
+    with open(fname) as fp:
+        return read_pls_batch(fp, frm, max_size)
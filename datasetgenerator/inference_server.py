@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+A local DNN inference server for concurrent search processes.
+
+The server listens on a Unix socket; each client selects a model (the path
+of a Keras model, of a ".npz" file exported with rollout.py or of a model
+quantized with quantization.py) which is loaded only once, then sends the
+DNN inputs of its search states. The requests for the same model are grouped
+in micro-batches: a batch is run as soon as it reaches "max_batch" rows, it
+has a request from each client of the model (the clients send one request at
+a time) or "max_wait" seconds after its first request. InferenceClient objects
+can be used in place of the DNN by the decision builders of plstest.py (see
+"--dnn-server").
+
+Messages are a (kind, payload length) header followed by the payload; arrays
+are sent as their shape followed by the float32 data.
+'''
+
+import argparse
+import json
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import deque
+import numpy as np
+
+cwd = os.getcwd()
+# insert at 1, 0 is the script path (or '' in REPL)
+sys.path.insert(1, '{}/../'.format(cwd))
+from datasetgenerator import instrumentation
+from quantization import load_inference_model
+
+# Message kinds
+INFER, SELECT, STATS, REPLY, ERROR = range(5)
+HEADER = struct.Struct('<BI')
+
+
+def recv_exact(sock, size):
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError('Connection closed')
+        buf += chunk
+    return bytes(buf)
+
+
+def send_msg(sock, kind, payload=b''):
+    sock.sendall(HEADER.pack(kind, len(payload)) + payload)
+
+
+def recv_msg(sock):
+    kind, size = HEADER.unpack(recv_exact(sock, HEADER.size))
+    return kind, recv_exact(sock, size)
+
+
+def encode_array(arr):
+    arr = np.ascontiguousarray(arr, dtype=np.float32)
+    return struct.pack('<B%dI' % arr.ndim, arr.ndim, *arr.shape) + arr.tobytes()
+
+
+def decode_array(payload):
+    ndim = payload[0]
+    shape = struct.unpack_from('<%dI' % ndim, payload, 1)
+    return np.frombuffer(payload, dtype=np.float32, offset=1 + 4 * ndim).reshape(shape)
+
+
+class ServerStats:
+    # Per-request latency, throughput, batch sizes and queue depth
+    def __init__(self, window=100000):
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.requests = 0
+        self.rows = 0
+        self.batches = 0
+        self.latencies = deque(maxlen=window)
+        self.batch_rows = deque(maxlen=window)
+        self.queue_depths = deque(maxlen=window)
+
+    def record_batch(self, rows, depth):
+        with self.lock:
+            self.batches += 1
+            self.batch_rows.append(rows)
+            self.queue_depths.append(depth)
+
+    def record_request(self, rows, latency):
+        with self.lock:
+            self.requests += 1
+            self.rows += rows
+            self.latencies.append(latency)
+
+    def snapshot(self):
+        with self.lock:
+            elapsed = time.perf_counter() - self.start
+            res = {'requests': self.requests, 'rows': self.rows, 'batches': self.batches,
+                   'requests_per_s': self.requests / elapsed, 'rows_per_s': self.rows / elapsed}
+            if self.batches > 0:
+                res['mean_batch_rows'] = float(np.mean(self.batch_rows))
+                res['mean_queue_depth'] = float(np.mean(self.queue_depths))
+                res['max_queue_depth'] = int(np.max(self.queue_depths))
+            if self.requests > 0:
+                lat = np.asarray(self.latencies) * 1000
+                for p in instrumentation.PERCENTILES:
+                    res['latency_ms_p%d' % p] = float(np.percentile(lat, p))
+            return res
+
+
+class Request:
+    def __init__(self, x):
+        self.x = x
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class ModelWorker:
+    # Micro-batching of the requests for a single model
+    def __init__(self, path, max_batch, max_wait, stats):
+        self.model = load_inference_model(path)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.stats = stats
+        self.queue = queue.Queue()
+        # Number of connected clients which selected the model
+        self.clients = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def attach(self):
+        with self.lock:
+            self.clients += 1
+
+    def detach(self):
+        with self.lock:
+            self.clients -= 1
+
+    def infer(self, x):
+        req = Request(x)
+        self.queue.put(req)
+        req.done.wait()
+        if req.error is not None:
+            raise req.error
+        return req.result
+
+    def _run(self):
+        while True:
+            # Wait for the first request, then collect more until the batch
+            # is full, every client has a pending request or the deadline has
+            # passed
+            batch = [self.queue.get()]
+            rows = len(batch[0].x)
+            deadline = time.perf_counter() + self.max_wait
+            while rows < self.max_batch and len(batch) < self.clients:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    req = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(req)
+                rows += len(req.x)
+            self.stats.record_batch(rows, self.queue.qsize())
+
+            try:
+                out = self.model(np.concatenate([req.x for req in batch]))
+                out = np.asarray(out.numpy() if hasattr(out, 'numpy') else out, dtype=np.float32)
+                start = 0
+                for req in batch:
+                    req.result = out[start:start + len(req.x)]
+                    start += len(req.x)
+            except Exception as e:
+                for req in batch:
+                    req.error = e
+            for req in batch:
+                req.done.set()
+
+
+class InferenceServer:
+    def __init__(self, socket_path, max_batch=256, max_wait=0.002):
+        self.socket_path = socket_path
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.stats = ServerStats()
+        self.workers = {}
+        self.lock = threading.Lock()
+
+    def worker(self, path):
+        # Each model is loaded only once
+        with self.lock:
+            if path not in self.workers:
+                self.workers[path] = ModelWorker(path, self.max_batch, self.max_wait, self.stats)
+            return self.workers[path]
+
+    def handle(self, conn):
+        worker = None
+        with conn:
+            try:
+                while True:
+                    try:
+                        kind, payload = recv_msg(conn)
+                    except ConnectionError:
+                        return
+                    try:
+                        if kind == SELECT:
+                            # The selected model counts this client until it
+                            # disconnects or selects another model
+                            selected = self.worker(payload.decode())
+                            selected.attach()
+                            if worker is not None:
+                                worker.detach()
+                            worker = selected
+                            send_msg(conn, REPLY)
+                        elif kind == INFER:
+                            if worker is None:
+                                raise ValueError('No model selected')
+                            start = time.perf_counter()
+                            x = decode_array(payload)
+                            out = worker.infer(x)
+                            send_msg(conn, REPLY, encode_array(out))
+                            self.stats.record_request(len(x), time.perf_counter() - start)
+                        elif kind == STATS:
+                            send_msg(conn, REPLY, json.dumps(self.stats.snapshot()).encode())
+                        else:
+                            raise ValueError('Unknown message kind %d' % kind)
+                    except Exception as e:
+                        try:
+                            send_msg(conn, ERROR, str(e).encode())
+                        except ConnectionError:
+                            # The client has disconnected
+                            return
+            finally:
+                if worker is not None:
+                    worker.detach()
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        srv.bind(self.socket_path)
+        srv.listen()
+        try:
+            while True:
+                conn, _ = srv.accept()
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+        finally:
+            srv.close()
+            os.remove(self.socket_path)
+
+
+class InferenceClient:
+    # Callable proxy of a model served by an InferenceServer: it returns the
+    # DNN outputs (logits) of a batch of inputs as a numpy array
+    def __init__(self, socket_path, model_path=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        if model_path is not None:
+            self._request(SELECT, os.path.abspath(model_path).encode())
+
+    def _request(self, kind, payload=b''):
+        send_msg(self.sock, kind, payload)
+        kind, payload = recv_msg(self.sock)
+        if kind == ERROR:
+            raise RuntimeError('Inference server error: %s' % payload.decode())
+        return payload
+
+    def __call__(self, x):
+        return decode_array(self._request(INFER, encode_array(x)))
+
+    def stats(self):
+        return json.loads(self._request(STATS).decode())
+
+    def close(self):
+        self.sock.close()
+
+
+def benchmark(args):
+    # Concurrent clients sending single-example requests: report the client
+    # side throughput and latency, and the server statistics
+    shape = tuple(int(d) for d in args.input_shape.split(','))
+    latencies = []
+    lock = threading.Lock()
+    stop = time.perf_counter() + args.duration
+
+    def client_loop():
+        client = InferenceClient(args.socket, args.model_path)
+        x = np.zeros((1,) + shape, dtype=np.float32)
+        local = []
+        while time.perf_counter() < stop:
+            t0 = time.perf_counter()
+            client(x)
+            local.append(time.perf_counter() - t0)
+        client.close()
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client_loop) for _ in range(args.clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    lat = np.asarray(latencies) * 1000
+    print('Clients: %d | requests: %d | %.1f requests/s' % (args.clients, len(lat), len(lat) / args.duration))
+    print('Latency (ms): ' + ' | '.join('p%d %.3f' % (p, np.percentile(lat, p))
+                                        for p in instrumentation.PERCENTILES))
+    client = InferenceClient(args.socket)
+    print('Server: %s' % json.dumps(client.stats()))
+    client.close()
+
+
+if __name__ == '__main__':
+    # Build a command line parser
+    desc = 'A local DNN inference server with dynamic micro-batching.'
+    parser = argparse.ArgumentParser(description=desc)
+    # Configure the parser
+    parser.add_argument('--socket', default='/tmp/pls-inference.sock',
+            help='Path of the Unix socket')
+    parser.add_argument('--max-batch', type=int, default=256,
+            help='Maximum number of rows of a micro-batch')
+    parser.add_argument('--max-wait-ms', type=float, default=2.0,
+            help='Maximum time a request waits for the micro-batch to be filled, in milliseconds')
+    parser.add_argument('--preload', nargs='*', default=[],
+            help='Models to be loaded at startup (the others are loaded at their first request)')
+    parser.add_argument('--stats', action='store_true',
+            help='Print the statistics of a running server, then exit')
+    parser.add_argument('--benchmark', action='store_true',
+            help='Run concurrent clients against a running server, then exit')
+    parser.add_argument('--model-path', default=None,
+            help='Model used by the benchmark clients')
+    parser.add_argument('--input-shape', default='343',
+            help='Comma-separated shape of a single benchmark input (e.g. "343" for PLS-7 "fnn" models or "7,7,1" ' +
+                 'for "cnn" models)')
+    parser.add_argument('--clients', type=int, default=8,
+            help='Number of concurrent benchmark clients')
+    parser.add_argument('--duration', type=float, default=10.0,
+            help='Duration of the benchmark, in seconds')
+
+    # Parse command line options
+    args = parser.parse_args()
+
+    if args.stats:
+        client = InferenceClient(args.socket)
+        print(json.dumps(client.stats(), indent=1))
+        client.close()
+    elif args.benchmark:
+        benchmark(args)
+    else:
+        server = InferenceServer(args.socket, args.max_batch, args.max_wait_ms / 1000)
+        for path in args.preload:
+            server.worker(os.path.abspath(path))
+        server.serve_forever()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Instrumentation of the PLS search.
+
+A Profiler accumulates the time spent (and the number of calls) in the
+expensive steps of a DNN driven search, i.e. the encoding of the current
+state and the DNN inference. The counters are collected per instance by the
+SubPDecisionBuilder, together with the search statistics (fails, branches
+and time), and can be saved as CSV or JSON with a summary of the
+percentiles of each statistic.
+'''
+
+import csv
+import json
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+# Counters accumulated by the Profiler
+COUNTERS = ['nodes', 'dnn_calls', 'dnn_time', 'encoding_time']
+# Columns of the per-instance statistics
+FIELDS = ['instance', 'solved', 'fails', 'branches', 'time', 'over_cap', 'nodes', 'dnn_calls', 'dnn_time',
+          'dnn_time_per_node', 'encoding_time']
+# Percentiles reported in the summary
+PERCENTILES = [50, 90, 99]
+
+
+class Profiler:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counters = {c: 0 for c in COUNTERS}
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    @contextmanager
+    def timer(self, name):
+        # Accumulate the wall time spent in the block in the "name" counter
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.counters[name] += time.perf_counter() - start
+
+    def collect(self):
+        # Return the counters of the current instance and reset them
+        res = dict(self.counters)
+        res['dnn_time_per_node'] = res['dnn_time'] / res['nodes'] if res['nodes'] > 0 else 0.0
+        self.reset()
+        return res
+
+
+def summarize(records):
+    # Summary of the per-instance statistics: number of solved instances and
+    # mean, max and percentiles of the numeric statistics
+    res = {'instances': len(records), 'solved': sum(1 for r in records if r['solved'])}
+    for name in FIELDS:
+        if name in ('instance', 'solved', 'over_cap'):
+            continue
+        vals = np.asarray([r.get(name, 0) for r in records], dtype=np.float64)
+        if len(vals) == 0:
+            continue
+        res[name] = {'mean': float(vals.mean()), 'max': float(vals.max())}
+        for p in PERCENTILES:
+            res[name]['p%d' % p] = float(np.percentile(vals, p))
+    res['over_cap'] = sum(1 for r in records if r['over_cap'])
+    return res
+
+
+def format_summary(summary):
+    lines = ['Instances: %d | solved: %d | over cap: %d' %
+             (summary['instances'], summary['solved'], summary['over_cap'])]
+    for name in FIELDS:
+        if name in summary and isinstance(summary[name], dict):
+            stats = summary[name]
+            lines.append('%s: mean %.4g | ' % (name, stats['mean']) +
+                         ' | '.join('p%d %.4g' % (p, stats['p%d' % p]) for p in PERCENTILES) +
+                         ' | max %.4g' % stats['max'])
+    return '\n'.join(lines)
+
+
+def write_records(fname, records):
+    # Save the per-instance statistics: JSON files also contain the summary,
+    # any other extension is written as CSV
+    if fname.endswith('.json'):
+        with open(fname, 'w') as fp:
+            json.dump({'summary': summarize(records), 'instances': records}, fp, indent=1)
+    else:
+        with open(fname, 'w', newline='') as fp:
+            writer = csv.DictWriter(fp, fieldnames=FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            for rcd in records:
+                writer.writerow(rcd)
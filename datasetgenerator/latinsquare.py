@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+A pure NumPy Latin Square sampler.
+
+Latin Squares are sampled with the Markov chain by Jacobson and Matthews
+("Generating uniformly distributed random Latin squares", 1996), whose
+stationary distribution is uniform over all Latin Squares of a given order.
+A batch of chains is run in parallel on the incidence cubes of the squares
+(a 0-1 array C such that C[i,j,v] = 1 iff value v is in cell (i,j)); each
+chain starts from a random isotope (random rows, columns and symbols
+permutation) of the cyclic square, so that a short burn-in is enough to
+obtain near-uniform samples.
+'''
+
+import numpy as np
+
+
+def random_isotopes(num, n, rng):
+    # Random isotopes of the cyclic Latin Square, as (num, n, n) values in [0, n)
+    base = (np.arange(n)[:, None] + np.arange(n)[None, :]) % n
+    rows = np.argsort(rng.random((num, n)), axis=1)
+    cols = np.argsort(rng.random((num, n)), axis=1)
+    syms = np.argsort(rng.random((num, n)), axis=1)
+    squares = base[rows[:, :, None], cols[:, None, :]]
+    squares = np.take_along_axis(syms, squares.reshape(num, -1), axis=1)
+    return squares.reshape(num, n, n)
+
+
+def _pick(mask, rng):
+    # For each row of a (B, n) boolean mask, pick uniformly a True index
+    noise = np.where(mask, rng.random(mask.shape), -1)
+    return np.argmax(noise, axis=1)
+
+
+def jacobson_matthews(squares, steps, rng):
+    # Run the Jacobson-Matthews chain on each of the (B, n, n) squares (values
+    # in [0, n)) until it has visited "steps" proper configurations. NOTE: the
+    # chains must not be stopped at the first proper configuration after a
+    # fixed number of moves, since that would bias the samples towards the
+    # Latin Squares which are close to improper configurations
+    B, n = squares.shape[0], squares.shape[1]
+    cube = np.zeros((B, n, n, n), dtype=np.int8)
+    bb, ii, jj = np.meshgrid(np.arange(B), np.arange(n), np.arange(n),
+            indexing='ij')
+    cube[bb, ii, jj, squares] = 1
+    # Improper chains and coordinates of their -1 cell
+    improper = np.zeros(B, dtype=bool)
+    imp = np.zeros((B, 3), dtype=np.int64)
+    # Number of proper configurations visited by each chain
+    visits = np.zeros(B, dtype=np.int64)
+
+    while (visits < steps).any():
+        b = np.nonzero(visits < steps)[0]
+        r, c, s = imp[b, 0].copy(), imp[b, 1].copy(), imp[b, 2].copy()
+        # Proper chains start from a random cell with a 0 entry
+        todo = np.nonzero(~improper[b])[0]
+        while len(todo) > 0:
+            cand = rng.integers(0, n, size=(len(todo), 3))
+            r[todo], c[todo], s[todo] = cand[:, 0], cand[:, 1], cand[:, 2]
+            todo = todo[cube[b[todo], r[todo], c[todo], s[todo]] != 0]
+        # Cells with a 1 entry in the lines through (r, c, s); there is one
+        # such cell per line in proper chains, and two in improper chains
+        r1 = _pick(cube[b, :, c, s] == 1, rng)
+        c1 = _pick(cube[b, r, :, s] == 1, rng)
+        s1 = _pick(cube[b, r, c, :] == 1, rng)
+        # Move: the eight involved cells are distinct within each chain
+        cube[b, r, c, s] += 1
+        cube[b, r, c1, s1] += 1
+        cube[b, r1, c, s1] += 1
+        cube[b, r1, c1, s] += 1
+        cube[b, r, c, s1] -= 1
+        cube[b, r, c1, s] -= 1
+        cube[b, r1, c, s] -= 1
+        cube[b, r1, c1, s1] -= 1
+        # The chain is improper iff the opposite cell became -1
+        improper[b] = cube[b, r1, c1, s1] < 0
+        imp[b, 0], imp[b, 1], imp[b, 2] = r1, c1, s1
+        visits[b] += ~improper[b]
+
+    return np.argmax(cube, axis=3)
+
+
+def sample_latin_squares(num, n, rng, steps=None):
+    # Sample "num" near-uniform Latin Squares of order n, returned as a
+    # (num, n*n) int8 array of values in [1, n] (by rows). The default
+    # burn-in is n**3 proper configurations, a common choice for the
+    # Jacobson-Matthews chain.
+    if steps is None:
+        steps = n**3
+    squares = random_isotopes(num, n, rng)
+    if n > 2:
+        squares = jacobson_matthews(squares, steps, rng)
+    return (squares + 1).astype(np.int8).reshape(num, n*n)
@@ -14,6 +14,15 @@ this happers:
 - If the desired number of solutions has been generated, the solver stops
 - Otherwise, a restart is triggered
 
+For large solution pools, several independently seeded solvers can be run in
+parallel processes (see the "--workers" option): each solver checks novelty
+with 64-bit hashes of the solutions, then the pools are merged and the
+duplicates across processes are removed.
+
+As an alternative to CP search, the solutions can be sampled in batches by a
+pure NumPy implementation of the Jacobson-Matthews Markov chain (see the
+"latinsquare" module), whose samples are near-uniform Latin Squares.
+
 Dependencies:
 
 - The code is written for python 3
@@ -23,13 +32,22 @@ Dependencies:
 
 from ortools.constraint_solver import pywrapcp as pycp
 import argparse
+import hashlib
+import multiprocessing
+import sys
+import time
 import numpy as np
 
 import common
+import latinsquare
 
 
 #reload(common)
 
+# Number of Latin Squares of the smallest orders; no more distinct solutions
+# than these can be generated
+LATIN_SQUARES = {1: 1, 2: 2, 3: 12, 4: 576, 5: 161280, 6: 812851200}
+
 
 class StoreDecisionBuilder(pycp.PyDecisionBuilder):
     def __init__(self, X, res, num):
@@ -50,6 +68,174 @@ class StoreDecisionBuilder(pycp.PyDecisionBuilder):
         else:
             return None
 
+
+class HashStoreDecisionBuilder(pycp.PyDecisionBuilder):
+    def __init__(self, X, hashes, sols, num, max_duplicates):
+        pycp.PyDecisionBuilder.__init__(self)
+        self.hashes = hashes
+        self.sols = sols
+        self.X = X
+        self.num = num
+        self.max_duplicates = max_duplicates
+        self.duplicates = 0
+
+    def Next(self, slv):
+        # Check whether the solution is new via its hash
+        sol = np.fromiter((x.Value() for x in self.X.values()),
+                dtype=np.int8, count=len(self.X))
+        h = solution_hash(sol)
+        if h not in self.hashes:
+            self.hashes.add(h)
+            self.sols.append(sol)
+            self.duplicates = 0
+        else:
+            self.duplicates += 1
+        # Trigger a fail if the generation process is not over; give up after
+        # too many consecutive duplicates
+        if len(self.sols) < self.num and self.duplicates < self.max_duplicates:
+            slv.Fail()
+        else:
+            return None
+
+
+def solution_hash(sol):
+    # Stable (i.e. process independent) 64-bit hash of a solution
+    digest = hashlib.blake2b(sol.tobytes(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def check_pool_size(n, num):
+    # Fail if "num" exceeds the number of Latin Squares of order "n"
+    if num > LATIN_SQUARES.get(n, num):
+        raise ValueError('There are only %d Latin Squares of order %d, '
+                '%d distinct solutions cannot be generated' %
+                (LATIN_SQUARES[n], n, num))
+
+
+def build_generator(n, bias):
+    # Build a solver
+    slv = pycp.Solver('PLS Instance generator')
+    # Build the variables
+    X = {(i,j):slv.IntVar(1, n, 'x_{%d,%d}' % (i,j))
+            for i in range(n) for j in range(n)}
+    # Post the constraitns
+    for i in range(n):
+        slv.Add(slv.AllDifferent([X[i,j] for j in range(n)]))
+        slv.Add(slv.AllDifferent([X[j,i] for j in range(n)]))
+
+    # Configure search
+    allvars = [X[i,j] for i in range(n) for j in range(n)]
+
+    if bias == 'none':
+        db = slv.Phase(allvars, slv.CHOOSE_RANDOM, slv.ASSIGN_RANDOM_VALUE)
+    elif bias == 'fwd':
+        db = slv.Phase(allvars, slv.CHOOSE_FIRST_UNBOUND,
+                slv.ASSIGN_RANDOM_VALUE)
+    elif bias == 'bwd':
+        db = slv.Phase(allvars[::-1], slv.CHOOSE_FIRST_UNBOUND,
+                slv.ASSIGN_RANDOM_VALUE)
+    return slv, X, db
+
+
+def generate_pool(n, bias, seed, num, max_duplicates=100000, known=()):
+    # Generate "num" distinct solutions with a solver seeded with "seed"; the
+    # solutions are returned as a (num, n*n) array of int8 values, by rows.
+    # The solutions whose hash is in "known" are considered duplicates, and
+    # the search stops early (with fewer solutions) after "max_duplicates"
+    # consecutive duplicates
+    check_pool_size(n, num)
+    slv, X, db = build_generator(n, bias)
+    sols = []
+    storedb = HashStoreDecisionBuilder(X, set(known), sols, num, max_duplicates)
+    slv.ReSeed(seed)
+    slv.Solve(slv.Compose([db, storedb]), [slv.ConstantRestart(1)])
+    return np.asarray(sols, dtype=np.int8).reshape(-1, n*n)
+
+
+def generate_pool_parallel(n, bias, seed, num, workers, max_duplicates=100000):
+    # Run several independently seeded generators in parallel processes, then
+    # merge their pools and remove the duplicates. Further rounds (with fresh
+    # seeds, skipping the solutions already found) are run until "num"
+    # distinct solutions are available; the generation fails if a round finds
+    # no new solution
+    check_pool_size(n, num)
+    hashes, pool = set(), []
+    rnd = 0
+    with multiprocessing.Pool(workers) as procs:
+        while len(pool) < num:
+            missing = num - len(pool)
+            per_worker = -(-missing // workers)
+            seeds = [seed + rnd * workers + k for k in range(workers)]
+            res = procs.starmap(generate_pool,
+                    [(n, bias, s, per_worker, max_duplicates, hashes)
+                        for s in seeds])
+            found = len(pool)
+            for sols in res:
+                for sol in sols:
+                    h = solution_hash(sol)
+                    if h not in hashes and len(pool) < num:
+                        hashes.add(h)
+                        pool.append(sol)
+            sys.stderr.write('Round %d: %d distinct solutions\n' % (rnd, len(pool)))
+            if len(pool) == found:
+                raise ValueError('No new solutions in round %d (%d consecutive '
+                        'duplicates per worker): only %d of the %d requested '
+                        'distinct solutions were found' %
+                        (rnd, max_duplicates, len(pool), num))
+            rnd += 1
+    return np.asarray(pool, dtype=np.int8).reshape(-1, n*n)
+
+
+def generate_pool_jm(n, seed, num, steps=None, batch_size=1000,
+        max_duplicates=100000):
+    # Sample "num" distinct solutions with the Jacobson-Matthews chain, in
+    # batches of "batch_size" parallel chains; the generation fails after
+    # "max_duplicates" consecutive duplicates
+    check_pool_size(n, num)
+    rng = np.random.default_rng(seed)
+    hashes, pool = set(), []
+    duplicates = 0
+    while len(pool) < num:
+        size = min(batch_size, num - len(pool))
+        for sol in latinsquare.sample_latin_squares(size, n, rng, steps):
+            h = solution_hash(sol)
+            if h not in hashes:
+                hashes.add(h)
+                pool.append(sol)
+                duplicates = 0
+            else:
+                duplicates += 1
+        if duplicates >= max_duplicates:
+            raise ValueError('%d consecutive duplicates: only %d of the %d '
+                    'requested distinct solutions were found' %
+                    (duplicates, len(pool), num))
+    return np.asarray(pool, dtype=np.int8).reshape(-1, n*n)
+
+
+def cell_values_chi2(pool, n):
+    # Chi-square statistic of the values frequencies in each cell, summed over
+    # all cells; for uniformly distributed Latin Squares all values are
+    # equally likely in each cell, hence the statistic should be close to its
+    # n*n*(n-1) degrees of freedom
+    counts = (pool[:, :, None] == np.arange(1, n+1)).sum(axis=0)
+    expected = len(pool) / n
+    return float(((counts - expected)**2 / expected).sum()), n*n*(n-1)
+
+
+def benchmark(n, bias, seed, num, jm_steps, batch_size):
+    # Compare throughput and distribution of the CP and Jacobson-Matthews
+    # engines
+    for engine in ('cp', 'jm'):
+        start = time.time()
+        if engine == 'cp':
+            pool = generate_pool(n, bias, seed, num)
+        else:
+            pool = generate_pool_jm(n, seed, num, jm_steps, batch_size)
+        elapsed = time.time() - start
+        chi2, dof = cell_values_chi2(pool, n)
+        print('%s: %d solutions in %.3f s (%.1f solutions/s) | cell values chi2: %.1f (dof: %d)' %
+                (engine, len(pool), elapsed, len(pool) / elapsed, chi2, dof))
+
 ########################################################################################################################
 
 
@@ -76,33 +262,64 @@ if __name__ == '__main__':
             'introduce a subtle bias while still having a non-zero ' +
             'generation probability for all PLSs. Chosing "bwd" will use ' +
             'the reversed ordering')
+    parser.add_argument('-w', '--workers', type=int, default=0,
+            help='If positive, the solutions are generated by this number ' +
+            'of independently seeded solver processes; novelty is checked ' +
+            'with 64-bit hashes and the pools are merged and deduplicated')
+    parser.add_argument('--max-duplicates', type=int, default=100000,
+            help='With "--workers", each solver process gives up after ' +
+            'this number of consecutive duplicate solutions, and the ' +
+            'generation fails if no process finds a new solution; with ' +
+            '"--engine jm", the generation fails after this number of ' +
+            'consecutive duplicates')
+    parser.add_argument('-e', '--engine',
+            choices=['cp', 'jm'], default='cp',
+            help='Generation engine: "cp" will use randomized CP search with ' +
+            'restarts; "jm" will sample near-uniform Latin Squares in ' +
+            'batches with the Jacobson-Matthews Markov chain (pure NumPy)')
+    parser.add_argument('--jm-steps', type=int, default=None,
+            help='Number of proper configurations visited by each ' +
+            'Jacobson-Matthews chain (default: order**3)')
+    parser.add_argument('--batch-size', type=int, default=1000,
+            help='Number of parallel Jacobson-Matthews chains')
+    parser.add_argument('--benchmark', action='store_true',
+            help='Compare the throughput and the distribution of the ' +
+            'solutions of the "cp" and "jm" engines, then exit')
+    parser.add_argument('--outfile', default=None,
+            help='Store the solutions (only with "--workers" or "--engine ' +
+            'jm") in a compact ' +
+            'binary file rather than printing them: a ".npz" file will ' +
+            'contain the packed one-hot encoding ("confs") and the int8 ' +
+            'values, any other extension will store a ".npy" array of int8 ' +
+            'values')
 
     # Parse command line options
     args = parser.parse_args()
 
-    # Extract the most frequently used options
-    n = args.order
-    # Build a solver
-    slv = pycp.Solver('PLS Instance generator')
-    # Build the variables
-    X = {(i,j):slv.IntVar(1, n, 'x_{%d,%d}' % (i,j))
-            for i in range(n) for j in range(n)}
-    # Post the constraitns
-    for i in range(n):
-        slv.Add(slv.AllDifferent([X[i,j] for j in range(n)]))
-        slv.Add(slv.AllDifferent([X[j,i] for j in range(n)]))
+    if args.benchmark:
+        benchmark(args.order, args.bias, args.seed, args.number,
+                args.jm_steps, args.batch_size)
+        sys.exit(0)
 
-    # Configure search
-    allvars = [X[i,j] for i in range(n) for j in range(n)]
+    # Parallel generation with hashed deduplication or batched sampling
+    if args.workers > 0 or args.engine == 'jm':
+        n = args.order
+        if args.engine == 'jm':
+            pool = generate_pool_jm(n, args.seed, args.number, args.jm_steps,
+                    args.batch_size, args.max_duplicates)
+        else:
+            pool = generate_pool_parallel(n, args.bias, args.seed,
+                    args.number, args.workers, args.max_duplicates)
+        if args.outfile is not None:
+            common.save_pls_pool(args.outfile, pool, n)
+        else:
+            common.write_pls_batch(sys.stdout, pool, n, args.format)
+        sys.exit(0)
 
-    if args.bias == 'none':
-        db = slv.Phase(allvars, slv.CHOOSE_RANDOM, slv.ASSIGN_RANDOM_VALUE)
-    elif args.bias == 'fwd':
-        db = slv.Phase(allvars, slv.CHOOSE_FIRST_UNBOUND, 
-                slv.ASSIGN_RANDOM_VALUE)
-    elif args.bias == 'bwd':
-        db = slv.Phase(allvars[::-1], slv.CHOOSE_FIRST_UNBOUND,
-                slv.ASSIGN_RANDOM_VALUE)
+    # Extract the most frequently used options
+    n = args.order
+    # Build the solver, the variables and the search strategy
+    slv, X, db = build_generator(n, args.bias)
     # Use a custom decision builder to store a solution and trigger a fail
     res = set()
     storedb = StoreDecisionBuilder(X, res, args.number)
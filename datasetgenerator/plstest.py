@@ -19,7 +19,7 @@ Dependencies:
 from ortools.constraint_solver import pywrapcp as pycp
 import argparse
 import math
-import gzip
+import multiprocessing
 import numpy as np
 import tensorflow as tf
 import os
@@ -29,20 +29,42 @@ import sys
 # insert at 1, 0 is the script path (or '' in REPL)
 sys.path.insert(1, '{}/../'.format(cwd))
 from models import MyModel
-from datasetgenerator import common, search
+from datasetgenerator import common, inference_server, instrumentation, search
 from utility import from_one_hot_to_2d
+from quantization import load_inference_model
 
 ########################################################################################################################
 
 
 class PLSFormatter:
-    def __init__(self, n, frm):
+    def __init__(self, n, frm, outfile=None, chunk=1000):
         self.frm = frm
         self.n = n
+        # Solutions are buffered as rows of values and written in bulk
+        self.outfile = outfile
+        self.chunk = chunk
+        self.buffer = []
 
     def format(self, X):
         return common.format_pls(X, self.n, self.frm)
 
+    def store(self, X):
+        n = self.n
+        self.buffer.append([X[i,j].Value() if X[i,j].Bound() else 0 for i in range(n) for j in range(n)])
+        # Solutions for a binary output file are written all together, as well as when no chunk size is specified
+        if self.outfile is None and self.chunk is not None and len(self.buffer) >= self.chunk:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer) == 0:
+            return
+        V = np.asarray(self.buffer, dtype=np.int8)
+        if self.outfile is not None:
+            common.save_pls_pool(self.outfile, V, self.n)
+        else:
+            common.write_pls_batch(sys.stdout, V, self.n, self.frm)
+            self.buffer = []
+
 
 def read_pls(s, frm):
     # Split the input string and determine the order
@@ -81,34 +103,40 @@ def read_pls(s, frm):
     return order, res
 
 
+def encode_state(vals, n, model_type):
+    # Encode a PLS given as n*n values (0 means empty) as a DNN input
+    onehot = (np.asarray(vals).reshape(-1, 1) == np.arange(1, n+1)).astype(np.float32).reshape(1, n ** 3)
+    if model_type in ('cnn', 'fnn-sparse'):
+        # 2D representation with the fake channel dimension
+        return np.expand_dims(from_one_hot_to_2d(onehot), axis=-1).astype(np.float32)
+    return onehot
+
+
 class DNNDecisionBuilder(pycp.PyDecisionBuilder):
-    def __init__(self, X, dnn, model_type):
+    def __init__(self, X, dnn, model_type, profiler=None):
         pycp.PyDecisionBuilder.__init__(self)
         self.X = X
         self.dnn = dnn
         self.n = int(round(math.sqrt(len(X))))
         self.model_type = model_type
+        if profiler is None:
+            profiler = instrumentation.Profiler()
+        self.profiler = profiler
 
     def Next(self, slv):
         # If all variables are bound, the search is over
         if all(x.Bound() for x in self.X):
             return None
-        # Obtain a binary representation of the current solution
-        n, sol = self.n, []
-        for x in self.X:
-            val = [0] * n
-            if x.Bound():
-                val[x.Value()-1] = 1
-            sol.extend(val)
+        self.profiler.count('nodes')
+        n = self.n
+        with self.profiler.timer('encoding_time'):
+            # Encode the current solution according to the DNN input
+            tensor_sol = encode_state([x.Value() if x.Bound() else 0 for x in self.X], n, self.model_type)
 
         # Query the DNN to obtain var-value pair rankings
-        if self.model_type == 'cnn':
-            tensor_sol = np.asarray(sol, dtype=np.float32).reshape(-1, n ** 3)
-            tensor_sol = from_one_hot_to_2d(tensor_sol)
-        elif self.model_type == 'fnn':
-            tensor_sol = np.asarray(sol, dtype=np.float32).reshape(1, n ** 3)
-
-        scores = tf.nn.softmax(self.dnn(tensor_sol)).numpy()[0]
+        self.profiler.count('dnn_calls')
+        with self.profiler.timer('dnn_time'):
+            scores = tf.nn.softmax(self.dnn(tensor_sol)).numpy()[0]
         assert scores.shape == (n ** 3,), "Shape is {}".format(scores.shape)
 
         maxscore = None
@@ -137,27 +165,31 @@ class DNNDecisionBuilder(pycp.PyDecisionBuilder):
 
 
 class MSDNNDecisionBuilder(pycp.PyDecisionBuilder):
-    def __init__(self, X, dnn):
+    def __init__(self, X, dnn, model_type, profiler=None):
         pycp.PyDecisionBuilder.__init__(self)
         self.X = X
         self.dnn = dnn
         self.n = int(round(math.sqrt(len(X))))
+        self.model_type = model_type
+        if profiler is None:
+            profiler = instrumentation.Profiler()
+        self.profiler = profiler
 
     def Next(self, slv):
         # If all variables are bound, the search is over
         if all(x.Bound() for x in self.X):
             return None
-        # Obtain a binary representation of the current solution
-        n, sol = self.n, []
-        for x in self.X:
-            val = [0] * n
-            if x.Bound():
-                val[x.Value()-1] = 1
-            sol.extend(val)
+        self.profiler.count('nodes')
+        n = self.n
+        with self.profiler.timer('encoding_time'):
+            # Encode the current solution according to the DNN input
+            tensor_sol = encode_state([x.Value() if x.Bound() else 0 for x in self.X], n, self.model_type)
 
         # Query the DNN to obtain var-value pair rankings
-        scores = self.dnn.predict_from_saved_model(np.asarray(sol).reshape(1, 1000), apply_softmax=True)[0]
-        assert scores.shape == (1000,), "Shape is {}".format(scores.shape)
+        self.profiler.count('dnn_calls')
+        with self.profiler.timer('dnn_time'):
+            scores = tf.nn.softmax(self.dnn(tensor_sol)).numpy()[0]
+        assert scores.shape == (n ** 3,), "Shape is {}".format(scores.shape)
 
         # Choose a variable with the minimum size domain
         best, var, varidx = None, None, None
@@ -167,9 +199,6 @@ class MSDNNDecisionBuilder(pycp.PyDecisionBuilder):
                     var, varidx = x, i
                     best = x.Size()
 
-        # Choose value to be assigned among the feasible ones according to net output probability
-        var = x
-
         # Choose the best value predicted by the network
         best, val = None, None
         for v in var.DomainIterator():
@@ -180,100 +209,85 @@ class MSDNNDecisionBuilder(pycp.PyDecisionBuilder):
         # Open a choice point
         return slv.AssignVariableValue(var, val)
 
-########################################################################################################################
-
-
-if __name__ == '__main__':
-    # Build a command line parser
-    desc = 'A testing solver for the PLS problem.'
-    parser = argparse.ArgumentParser(description=desc)
-    # Configure the parser
-    parser.add_argument('infile', nargs='?', default=None,
-            help='The name of the file with the instances. If missing, the solver will read from the standard input')
-    parser.add_argument('-s', '--seed', type=int, default=100,
-            help='Seed for the Random Number Generator')
-    parser.add_argument('--input-format',
-            choices=['csv', 'bin', 'bits'], default='csv',
-            help='Format for the input instances; "csv" will use a comma-separted list of values for PLS rows' +
-            ' (a 0 means empty); "bin" will do the same, except that a one-hot encoding of the numbers will be used; ' +
-                 'in this case, all zeros will mean an empty cell' + '; "bits" will use a string of 0-1 values to ' +
-            'represent the PLS instance')
-    parser.add_argument('--output-format',
-            choices=['friendly', 'csv', 'bin'], default='friendly',
-            help='Format for the output instances; "friendly" will use a matrix of numbers (the Latin Square); "csv" ' +
-                 'will use a comma-separted list PLS rows (a 0 means empty); "bin" will do the same, except that a ' +
-                 'one-hot encoding of the numbers will be used; in this case, all zeros will mean an empty cell')
-    parser.add_argument('--search-strategy',
-            choices=['ms', 'rnd', 'snail-lex', 'snail-ms', 'snail-dnn', 'snail-msdnn'],
-            default='ms',
-            help='Search strategy to be used: "ms" will use a default min size domain heuristic (and lexicographic '
-                 'value selection); "snail-lex" will use python-built lexicographic search; "snail-ms" will use a '
-                 'python-built min size domain heuristic; "snail-dnn" will use a pyhon-built, DNN driven search')
-    parser.add_argument('--dnn-fstem',
-            default=None,
-            help='File stem for the DNN. This argument is required if the "snail-dnn" search is used')
-    parser.add_argument('--print-inst', action='store_true',
-            help='Print the instance in csv format (useful for debugging)')
-    parser.add_argument('--no-print-sol', action='store_true',
-            help='Do not print the solution')
-    parser.add_argument('--timeout', type=int, default=0,
-            help='Timeout for solving an instance')
-    parser.add_argument('--failcap', type=int, default=0,
-            help='Fail cap for solving an instance')
-    parser.add_argument('--constraint',
-                        choices=['none', 'checker', 'checker-v2'], default='none',
-                        help='Generate solutions considering the additional constraint')
-    parser.add_argument('--size',
-                        default=0,
-                        help='How many constraint rule indexes to consider')
-    parser.add_argument('--rm-rows-constraints', action='store_true',
-                        help='Remove rows constraints to the solver')
-    parser.add_argument('--rm-columns-constraints', action='store_true',
-                        help='Remove columns constraints to the solver')
-    parser.add_argument('--max-size', type=int, default=10000,
-            help='Maximum number of input solutions to be loaded')
-    parser.add_argument('--model', required=True, choices=['fnn', 'cnn'])
-
-    # Parse command line options
-    args = parser.parse_args()
-
-    # Define a function to read instance data
-    def read(data, frm):
-        orders, bmark = [], []
-        count = 0
-        for rcd in data:
-            count += 1
-            # print(count)
-            # Parse the input instances
-            n, prb = read_pls(rcd, frm)
-            orders.append(n)
-            bmark.append(prb)
 
-            if count == args.max_size:
-                break
+class DNNScoreTable:
+    # Cache of the (n*n, n) table of DNN scores of the current instance, used as value evaluator by a native phase.
+    # The DNN is queried once per instance or, if refresh is positive, again every "refresh" decisions (on the
+    # current state of the search); the decisions are notified by the decision builder (see decision()), since the
+    # evaluator is called once for each value of the chosen variable and again after each refutation. If sample is
+    # True, the costs are perturbed with Gumbel noise, so that the value with the lowest cost is sampled according to
+    # the DNN probabilities (restricted to the domain).
+    def __init__(self, X, K, dnn, model_type, refresh=0, profiler=None, sample=False, seed=None):
+        self.X = X
+        self.K = K
+        self.dnn = dnn
+        self.n = int(round(math.sqrt(len(X))))
+        self.model_type = model_type
+        self.refresh = refresh
+        self.sample = sample
+        # Own generator, so that the sampled searches are reproducible
+        self.rng = np.random.default_rng(seed)
+        if profiler is None:
+            profiler = instrumentation.Profiler()
+        self.profiler = profiler
+        self.instance = None
+        self.decisions = 0
+        self.costs = None
+
+    def update(self):
+        n = self.n
+        with self.profiler.timer('encoding_time'):
+            tensor_sol = encode_state([x.Value() if x.Bound() else 0 for x in self.X], n, self.model_type)
+        self.profiler.count('dnn_calls')
+        with self.profiler.timer('dnn_time'):
+            scores = tf.nn.softmax(self.dnn(tensor_sol)).numpy()[0]
+        assert scores.shape == (n ** 3,), "Shape is {}".format(scores.shape)
+        # The native value selector chooses the value with the lowest (integer) cost
+        self.costs = np.round(-scores.reshape(n * n, n) * 1e9).astype(np.int64)
+        self.log_probs = np.log(scores.reshape(n * n, n) + 1e-12)
+
+    def decision(self):
+        # Called by the decision builder before each decision is opened
+        self.profiler.count('nodes')
+        k = self.K.Value()
+        if k != self.instance:
+            # New instance
+            self.instance = k
+            self.decisions = 0
+            self.update()
+            return
+        self.decisions += 1
+        if self.refresh > 0 and self.decisions % self.refresh == 0:
+            self.update()
+
+    def __call__(self, var_idx, val):
+        if self.sample:
+            return int(round(-(self.log_probs[var_idx, val - 1] + self.rng.gumbel()) * 1e6))
+        return int(self.costs[var_idx, val - 1])
+
+
+class DNNPhaseDecisionBuilder(pycp.PyDecisionBuilder):
+    # Native phase driven by a DNNScoreTable: the table is notified of each decision before the phase evaluates the
+    # values of the chosen variable
+    def __init__(self, X, phase, table):
+        pycp.PyDecisionBuilder.__init__(self)
+        self.X = X
+        self.phase = phase
+        self.table = table
 
-        return orders, bmark
+    def Next(self, slv):
+        # If all variables are bound, the search is over
+        if all(x.Bound() for x in self.X):
+            return None
+        self.table.decision()
+        return self.phase.NextWrapper(slv)
 
-    # Open the input file and read the input instances
-    if args.infile is not None:
-        if args.infile.endswith('.gz'):
-            with gzip.open(args.infile) as fp:
-                orders, bmark = read(fp, args.input_format)
-        elif args.infile.endswith('.npz'):
-            with np.load(args.infile) as fp:
-                data = np.unpackbits(fp['confs'], axis=1)
-                orders, bmark = read(data, 'bits')
-        else:
-            with open(args.infile) as fp:
-                orders, bmark = read(fp, args.input_format)
-    else:
-        orders, bmark = read(sys.stdin, args.input_format)
+########################################################################################################################
 
-    # Check that all instances have the same order
-    if not all(o == orders[0] for o in orders):
-        raise ValueError('Inconsistent order of the n-queen instances')
-    n = orders[0]
 
+def solve(bmark, n, args, frmO, seed):
+    # Solve all the instances in "bmark" (a (K, n, n) matrix of values) with a single solver; the solutions are
+    # stored by the "frmO" formatter and a list with the statistics of each instance is returned
     # Build a solver
     slv = pycp.Solver('PLS problem tester')
 
@@ -295,15 +309,22 @@ if __name__ == '__main__':
                 slv.Add(slv.AllDifferent([X[j,i] for j in range(n)]))
 
     # Load a DNN, in case the "snail-dnn" search has been requested
-    if args.search_strategy in ('snail-dnn', 'snail-msdnn'):
+    if args.search_strategy in ('snail-dnn', 'snail-msdnn', 'dnn-phase', 'dnn-sample', 'dnn-lds'):
         if args.dnn_fstem is None:
             raise ValueError('Missing file stem for the DNN')
 
-        model = tf.keras.models.load_model(args.dnn_fstem)
-        dnn = model
+        if args.dnn_server is not None:
+            # The model is served (and batched with the requests of the
+            # other processes) by a running inference server
+            dnn = inference_server.InferenceClient(args.dnn_server, args.dnn_fstem)
+        else:
+            # Keras SavedModel, or a quantized model exported with quantization.py
+            dnn = load_inference_model(args.dnn_fstem)
 
     # Prepare a data structure to store global information abut search
     stats = {}
+    # Profiler of the DNN driven searches
+    profiler = instrumentation.Profiler()
     # Configure search
     flatX = [X[i,j] for i in range(n) for j in range(n)]
 
@@ -312,15 +333,38 @@ if __name__ == '__main__':
     elif args.search_strategy == 'rnd':
         db = slv.Phase(flatX, slv.CHOOSE_RANDOM, slv.ASSIGN_RANDOM_VALUE)
     elif args.search_strategy == 'snail-lex':
-        db = search.SnailLexDecisionBuilder(flatX)
+        if args.snail_impl == 'native':
+            # Same semantics of SnailLexDecisionBuilder: first unbound variable, minimum value
+            db = slv.Phase(flatX, slv.CHOOSE_FIRST_UNBOUND, slv.ASSIGN_MIN_VALUE)
+        else:
+            db = search.SnailLexDecisionBuilder(flatX)
     elif args.search_strategy == 'snail-ms':
-        db = search.SnailMinSizeDecisionBuilder(flatX)
+        if args.snail_impl == 'native':
+            # Same semantics of SnailMinSizeDecisionBuilder: ties on the domain size are broken by the variables
+            # order, then the minimum value is chosen
+            db = slv.Phase(flatX, slv.CHOOSE_MIN_SIZE, slv.ASSIGN_MIN_VALUE)
+        else:
+            db = search.SnailMinSizeDecisionBuilder(flatX)
     elif args.search_strategy == 'snail-dnn':
-        db = DNNDecisionBuilder(flatX, dnn, model_type=args.model)
+        db = DNNDecisionBuilder(flatX, dnn, model_type=args.model, profiler=profiler)
     elif args.search_strategy == 'snail-msdnn':
-        db = MSDNNDecisionBuilder(flatX, dnn)
+        db = MSDNNDecisionBuilder(flatX, dnn, model_type=args.model, profiler=profiler)
+    elif args.search_strategy == 'dnn-phase':
+        # Native min size domain variable selection, values ordered by the cached DNN scores
+        table = DNNScoreTable(flatX, K, dnn, args.model, args.dnn_refresh, profiler, seed=seed)
+        db = DNNPhaseDecisionBuilder(flatX, slv.Phase(flatX, slv.CHOOSE_MIN_SIZE, table), table)
+    elif args.search_strategy == 'dnn-sample':
+        # Native min size domain variable selection, values sampled from the cached DNN probabilities
+        table = DNNScoreTable(flatX, K, dnn, args.model, args.dnn_refresh, profiler, sample=True, seed=seed)
+        db = DNNPhaseDecisionBuilder(flatX, slv.Phase(flatX, slv.CHOOSE_MIN_SIZE, table), table)
+    elif args.search_strategy == 'dnn-lds':
+        # Limited discrepancy search ordered by the cached DNN probabilities
+        table = DNNScoreTable(flatX, K, dnn, args.model, args.dnn_refresh, profiler, seed=seed)
+        db = search.lds(slv, flatX, table, args.max_discrepancy, table.decision)
+    # Restart the search with increasing fail limits
+    if args.restarts != 'none':
+        db = search.restarts(slv, db, args.restarts, args.restart_scale, args.restart_growth, args.max_restarts)
     # Build a custom decision builder to store a solution and trigger a fail
-    frmO = PLSFormatter(n, args.output_format)
     storedb = search.StoreDecisionBuilder(X, frmO, stats,
                                           not args.no_print_sol)
     # Build a DB to control the sequence of subproblems
@@ -329,7 +373,7 @@ if __name__ == '__main__':
     frmI = None
     if args.print_inst:
         frmI = PLSFormatter(n, 'csv')
-    subpdb = search.SubPDecisionBuilder(X, K, bmark, stats, frmI, args.failcap)
+    subpdb = search.SubPDecisionBuilder(X, K, bmark, stats, frmI, args.failcap, profiler)
     # Build the overall search strategy
     inner_monitors = []
     if args.timeout > 0:
@@ -342,5 +386,180 @@ if __name__ == '__main__':
     monitors = [slv.Maximize(K, 1)]
 
     # Generate the instances
-    slv.ReSeed(args.seed)
-    slv.Solve(dball, monitors)
\ No newline at end of file
+    slv.ReSeed(seed)
+    slv.Solve(dball, monitors)
+    subpdb.close(slv)
+
+    return stats['records']
+
+
+def solve_chunk(bmark, n, args, seed):
+    # Worker process: solve a chunk of instances, keeping all the solutions in memory
+    frmO = PLSFormatter(n, args.output_format, chunk=None)
+    records = solve(bmark, n, args, frmO, seed)
+    return frmO.buffer, records
+
+
+def solve_parallel(bmark, n, args, frmO):
+    # Split the instances in contiguous chunks, each one solved by a worker process with its own solver (and DNN);
+    # solutions and statistics are merged in input order. NOTE: worker i uses seed + i.
+    chunks = [idx for idx in np.array_split(np.arange(len(bmark)), args.workers) if len(idx) > 0]
+    # Processes are spawned rather than forked, since TensorFlow is not fork-safe
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(len(chunks)) as pool:
+        res = pool.starmap(solve_chunk, [(bmark[idx], n, args, args.seed + w) for w, idx in enumerate(chunks)])
+
+    records = []
+    for idx, (sols, chunk_records) in zip(chunks, res):
+        frmO.buffer.extend(sols)
+        for rcd in chunk_records:
+            rcd['instance'] += int(idx[0])
+            records.append(rcd)
+    return records
+
+
+def benchmark(bmark, n, args, strategies):
+    # Compare the node throughput of several search strategies on the same instances; the python-built
+    # implementation of the "snail-lex" and "snail-ms" strategies is compared as well
+    runs = []
+    for strategy in strategies:
+        runs.append((strategy, 'native'))
+        if strategy in ('snail-lex', 'snail-ms'):
+            runs.append((strategy, 'python'))
+    for strategy, impl in runs:
+        run_args = argparse.Namespace(**vars(args))
+        run_args.search_strategy = strategy
+        run_args.snail_impl = impl
+        frmO = PLSFormatter(n, args.output_format, chunk=None)
+        records = solve(bmark, n, run_args, frmO, args.seed)
+        branches = sum(r['branches'] for r in records)
+        elapsed = sum(r['time'] for r in records)
+        name = strategy if strategy not in ('snail-lex', 'snail-ms') else '%s (%s)' % (strategy, impl)
+        print('%s: solved %d/%d | branches: %d | fails: %d | time: %.3f s | %.1f nodes/s' %
+              (name, sum(1 for r in records if r['solved']), len(records), branches,
+               sum(r['fails'] for r in records), elapsed, branches / elapsed if elapsed > 0 else float('inf')))
+
+########################################################################################################################
+
+
+if __name__ == '__main__':
+    # Build a command line parser
+    desc = 'A testing solver for the PLS problem.'
+    parser = argparse.ArgumentParser(description=desc)
+    # Configure the parser
+    parser.add_argument('infile', nargs='?', default=None,
+            help='The name of the file with the instances. If missing, the solver will read from the standard input')
+    parser.add_argument('-s', '--seed', type=int, default=100,
+            help='Seed for the Random Number Generator')
+    parser.add_argument('--input-format',
+            choices=['csv', 'bin', 'bits'], default='csv',
+            help='Format for the input instances; "csv" will use a comma-separted list of values for PLS rows' +
+            ' (a 0 means empty); "bin" will do the same, except that a one-hot encoding of the numbers will be used; ' +
+                 'in this case, all zeros will mean an empty cell' + '; "bits" will use a string of 0-1 values to ' +
+            'represent the PLS instance')
+    parser.add_argument('--output-format',
+            choices=['friendly', 'csv', 'bin', 'bits'], default='friendly',
+            help='Format for the output instances; "friendly" will use a matrix of numbers (the Latin Square); "csv" ' +
+                 'will use a comma-separted list PLS rows (a 0 means empty); "bin" will do the same, except that a ' +
+                 'one-hot encoding of the numbers will be used; in this case, all zeros will mean an empty cell; ' +
+                 '"bits" will use a string of 0-1 values')
+    parser.add_argument('--outfile', default=None,
+            help='Store the solutions in a compact binary file rather than printing them: a ".npz" file will contain ' +
+                 'the packed one-hot encoding ("confs") and the int8 values, any other extension will store a ".npy" ' +
+                 'array of int8 values')
+    parser.add_argument('--search-strategy',
+            choices=['ms', 'rnd', 'snail-lex', 'snail-ms', 'snail-dnn', 'snail-msdnn', 'dnn-phase', 'dnn-sample',
+                     'dnn-lds'],
+            default='ms',
+            help='Search strategy to be used: "ms" will use a default min size domain heuristic (and lexicographic '
+                 'value selection); "snail-lex" will use lexicographic search; "snail-ms" will use a min size domain '
+                 'heuristic; "snail-dnn" will use a pyhon-built, DNN driven search; "dnn-phase" will use a native '
+                 'min size domain heuristic with values ordered by DNN scores cached per instance (see '
+                 '"--dnn-refresh"); "dnn-sample" will do the same, but sampling the values according to the DNN '
+                 'probabilities (useful with "--restarts"); "dnn-lds" will use an iterative limited discrepancy '
+                 'search with values ordered by the DNN scores')
+    parser.add_argument('--restarts',
+            choices=['none', 'luby', 'geometric'], default='none',
+            help='Restart the search whenever a fail limit is reached; the limits follow the Luby sequence or a ' +
+                 'geometric progression (randomized strategies re-sample their choices at each restart)')
+    parser.add_argument('--restart-scale', type=int, default=100,
+            help='Fail limit of the first restart')
+    parser.add_argument('--restart-growth', type=float, default=1.5,
+            help='Growth factor of the fail limits for geometric restarts')
+    parser.add_argument('--max-restarts', type=int, default=32,
+            help='Number of restarts after which no fail limit is applied')
+    parser.add_argument('--max-discrepancy', type=int, default=3,
+            help='Maximum discrepancy limit for the "dnn-lds" search, before a last iteration with no limit')
+    parser.add_argument('--dnn-refresh', type=int, default=0,
+            help='With the "dnn-phase" search, query the DNN again every this number of decisions; if 0, the DNN is '
+                 'queried only once per instance')
+    parser.add_argument('--snail-impl',
+            choices=['native', 'python'], default='native',
+            help='Implementation of the "snail-lex" and "snail-ms" strategies: "native" will use the equivalent '
+                 'or-tools phases; "python" will use the python-built decision builders (much slower)')
+    parser.add_argument('--benchmark-strategies', nargs='+', default=None,
+            choices=['ms', 'rnd', 'snail-lex', 'snail-ms', 'snail-dnn', 'snail-msdnn', 'dnn-phase', 'dnn-sample',
+                     'dnn-lds'],
+            help='Compare the node throughput of the specified search strategies on the input instances, then exit')
+    parser.add_argument('--dnn-fstem',
+            default=None,
+            help='File stem for the DNN (or the ".npz" or ".tflite" file of a model quantized with quantization.py). '
+                 'This argument is required if the "snail-dnn" search is used')
+    parser.add_argument('--dnn-server', default=None,
+            help='Unix socket of a running inference server (see inference_server.py); the DNN in "--dnn-fstem" '
+                 'will be evaluated by the server rather than loaded by each process')
+    parser.add_argument('--print-inst', action='store_true',
+            help='Print the instance in csv format (useful for debugging)')
+    parser.add_argument('--no-print-sol', action='store_true',
+            help='Do not print the solution')
+    parser.add_argument('--timeout', type=int, default=0,
+            help='Timeout for solving an instance')
+    parser.add_argument('--failcap', type=int, default=0,
+            help='Fail cap for solving an instance')
+    parser.add_argument('--constraint',
+                        choices=['none', 'checker', 'checker-v2'], default='none',
+                        help='Generate solutions considering the additional constraint')
+    parser.add_argument('--size',
+                        default=0,
+                        help='How many constraint rule indexes to consider')
+    parser.add_argument('--rm-rows-constraints', action='store_true',
+                        help='Remove rows constraints to the solver')
+    parser.add_argument('--rm-columns-constraints', action='store_true',
+                        help='Remove columns constraints to the solver')
+    parser.add_argument('--max-size', type=int, default=10000,
+            help='Maximum number of input solutions to be loaded')
+    parser.add_argument('--model', required=True, choices=['fnn', 'fnn-sparse', 'cnn'])
+    parser.add_argument('--workers', type=int, default=1,
+            help='Number of worker processes; the instances are split in contiguous chunks, each one solved by a ' +
+                 'different process with its own solver (and DNN). Solutions are printed in input order')
+    parser.add_argument('--stats-file', default=None,
+            help='File where the per-instance statistics (solved, fails, branches, time, over cap, DNN calls, DNN ' +
+                 'time per node and encoding time) are saved to; ".json" files also contain a summary with ' +
+                 'percentiles, any other extension is written as CSV. The summary is also printed on stderr')
+
+    # Parse command line options
+    args = parser.parse_args()
+
+    # Open the input file and read the input instances as a (K, n, n) matrix of values
+    if args.infile is not None:
+        n, bmark = common.read_pls_file(args.infile, args.input_format, args.max_size)
+    else:
+        n, bmark = common.read_pls_batch(sys.stdin, args.input_format, args.max_size)
+
+    if args.benchmark_strategies is not None:
+        benchmark(bmark, n, args, args.benchmark_strategies)
+        sys.exit(0)
+
+    # Solve the instances, either in this process or split in contiguous chunks among several processes
+    frmO = PLSFormatter(n, args.output_format, args.outfile)
+    if args.workers <= 1:
+        records = solve(bmark, n, args, frmO, args.seed)
+    else:
+        records = solve_parallel(bmark, n, args, frmO)
+    # Write the buffered solutions
+    frmO.flush()
+
+    # Write the per-instance statistics
+    if args.stats_file is not None:
+        instrumentation.write_records(args.stats_file, records)
+        sys.stderr.write(instrumentation.format_summary(instrumentation.summarize(records)) + '\n')
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Batched DNN rollouts for the PLS problem.
+
+A batch of partial squares (empty by default) is completed with no CP
+search: at each step the DNN scores of all the rollouts are computed with a
+single batched call, the (cell, value) pairs forbidden by the row and column
+constraints are masked out and one assignment per rollout is sampled (or
+chosen greedily). A rollout reaches a dead end when an empty cell has no
+allowed value left; the completed squares are valid Latin Squares.
+
+The DNN is evaluated with NumPy, from weights exported from a trained Keras
+model, so that TensorFlow is only needed for the export.
+'''
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+cwd = os.getcwd()
+# insert at 1, 0 is the script path (or '' in REPL)
+sys.path.insert(1, '{}/../'.format(cwd))
+from datasetgenerator import common
+from numpy_models import NumpyModel
+from quantization import load_inference_model
+
+
+def encode_states(vals, n, model_type):
+    # Encode a (B, n*n) array of values (0 means empty) as DNN inputs
+    if model_type in ('cnn', 'fnn-sparse'):
+        # 2D representation with the fake channel dimension
+        return vals.reshape(-1, n, n, 1).astype(np.float32)
+    return common.values_to_onehot(vals, n).astype(np.float32)
+
+
+def allowed_assignments(vals, n):
+    # (B, n*n, n) mask of the values allowed in each empty cell by the
+    # forward checking on the row and column constraints
+    squares = vals.reshape(-1, n, n)
+    onehot = squares[..., None] == np.arange(1, n+1)
+    allowed = (squares == 0)[..., None] & ~onehot.any(axis=2)[:, :, None, :] & ~onehot.any(axis=1)[:, None, :, :]
+    return allowed.reshape(-1, n*n, n)
+
+
+def rollout(vals, dnn, n, model_type, rng, greedy=False, temperature=1.0):
+    # Complete a (B, n*n) batch of partial squares; returns the final values
+    # and a boolean array with the completed rollouts (the others reached a
+    # dead end)
+    vals = np.array(vals, dtype=np.int8).reshape(-1, n*n)
+    active = (vals == 0).any(axis=1)
+    dead = np.zeros(len(vals), dtype=bool)
+    while active.any():
+        idx = np.nonzero(active)[0]
+        cur = vals[idx]
+        allowed = allowed_assignments(cur, n)
+        # Dead ends: an empty cell with an empty domain
+        stuck = ((cur == 0) & ~allowed.any(axis=2)).any(axis=1)
+        dead[idx[stuck]] = True
+        active[idx[stuck]] = False
+        idx, cur, allowed = idx[~stuck], cur[~stuck], allowed[~stuck]
+        if len(idx) == 0:
+            break
+        # Batched inference, masked (Gumbel-max) sampling of the assignments
+        logits = dnn(encode_states(cur, n, model_type)).reshape(len(idx), -1) / temperature
+        if not greedy:
+            logits = logits + rng.gumbel(size=logits.shape)
+        choice = np.argmax(np.where(allowed.reshape(len(idx), -1), logits, -np.inf), axis=1)
+        cells, values = np.divmod(choice, n)
+        vals[idx, cells] = values + 1
+        active[idx] = (vals[idx] == 0).any(axis=1)
+    return vals, ~dead
+
+
+def run_rollouts(start, dnn, n, args, rng):
+    # Run the rollouts in batches; dead ends are restarted from their initial
+    # state up to "attempts" times. Returns the completed squares and the
+    # number of dead ends
+    solutions = []
+    dead_ends = 0
+    for bstart in range(0, len(start), args.batch_size):
+        todo = start[bstart:bstart+args.batch_size]
+        for _ in range(args.attempts):
+            vals, solved = rollout(todo, dnn, n, args.model, rng, args.greedy, args.temperature)
+            solutions.append(vals[solved])
+            dead_ends += int(np.sum(~solved))
+            todo = todo[~solved]
+            if len(todo) == 0:
+                break
+    return np.concatenate(solutions) if solutions else np.zeros((0, n*n), dtype=np.int8), dead_ends
+
+
+if __name__ == '__main__':
+    # Build a command line parser
+    desc = 'Batched DNN rollouts for the PLS problem.'
+    parser = argparse.ArgumentParser(description=desc)
+    # Configure the parser
+    parser.add_argument('infile', nargs='?', default=None,
+            help='The name of the file with the starting partial squares. If missing, the rollouts will start from ' +
+                 'empty squares (see "--num-rollouts")')
+    parser.add_argument('-n', '--order', type=int, default=None,
+            help='Order of the squares, required if there is no input file')
+    parser.add_argument('--num-rollouts', type=int, default=1000,
+            help='Number of rollouts from empty squares')
+    parser.add_argument('-s', '--seed', type=int, default=100,
+            help='Seed for the Random Number Generator')
+    parser.add_argument('--input-format',
+            choices=['csv', 'bin', 'bits'], default='bin',
+            help='Format for the input partial squares (see plstest.py)')
+    parser.add_argument('--output-format',
+            choices=['friendly', 'csv', 'bin', 'bits'], default='bin',
+            help='Format for the completed squares (see plstest.py)')
+    parser.add_argument('--outfile', default=None,
+            help='Store the completed squares in a compact binary file rather than printing them (see plstest.py)')
+    parser.add_argument('--dnn-weights', default=None,
+            help='File with the DNN weights exported with "--export-weights"')
+    parser.add_argument('--dnn-fstem', default=None,
+            help='File stem of a trained Keras model (requires TensorFlow)')
+    parser.add_argument('--export-weights', default=None,
+            help='Export the weights of the Keras model in "--dnn-fstem" to this ".npz" file, then exit')
+    parser.add_argument('--model', choices=['fnn', 'fnn-sparse', 'cnn'], default='fnn',
+            help='Architecture of the DNN, which determines the input encoding')
+    parser.add_argument('--batch-size', type=int, default=4096,
+            help='Number of rollouts run together')
+    parser.add_argument('--greedy', action='store_true',
+            help='Choose the assignment with the highest score rather than sampling it')
+    parser.add_argument('--temperature', type=float, default=1.0,
+            help='Temperature of the sampling distribution')
+    parser.add_argument('--attempts', type=int, default=1,
+            help='Number of attempts for each rollout; rollouts reaching a dead end are restarted from their ' +
+                 'initial state')
+
+    # Parse command line options
+    args = parser.parse_args()
+
+    # Load the DNN
+    if args.dnn_fstem is not None:
+        dnn = NumpyModel.from_keras(load_inference_model(args.dnn_fstem))
+        if args.export_weights is not None:
+            dnn.save(args.export_weights)
+            sys.exit(0)
+    elif args.dnn_weights is not None:
+        dnn = NumpyModel.load(args.dnn_weights)
+    else:
+        raise ValueError('Missing DNN weights or file stem')
+
+    # Starting partial squares
+    if args.infile is not None:
+        n, start = common.read_pls_file(args.infile, args.input_format)
+        start = start.reshape(len(start), -1)
+    else:
+        if args.order is None:
+            raise ValueError('Missing order of the squares')
+        n = args.order
+        start = np.zeros((args.num_rollouts, n*n), dtype=np.int8)
+
+    rng = np.random.default_rng(args.seed)
+    t0 = time.time()
+    solutions, dead_ends = run_rollouts(start, dnn, n, args, rng)
+    elapsed = time.time() - t0
+
+    if args.outfile is not None:
+        common.save_pls_pool(args.outfile, solutions, n)
+    else:
+        common.write_pls_batch(sys.stdout, solutions, n, args.output_format)
+
+    num_rollouts = len(solutions) + dead_ends
+    sys.stderr.write('Rollouts: %d | completed: %d | dead ends: %d | %.1f rollouts/s\n' %
+            (num_rollouts, len(solutions), dead_ends, num_rollouts / max(elapsed, 1e-9)))
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 from ortools.constraint_solver import pywrapcp as pycp
+import numpy as np
 import sys
 
 
@@ -48,8 +49,99 @@ class SnailMinSizeDecisionBuilder(pycp.PyDecisionBuilder):
         return slv.AssignVariableValue(var, val)
 
 
+class DiscrepancyDecision(pycp.PyDecision):
+    def __init__(self, var, val, D):
+        pycp.PyDecision.__init__(self)
+        self.var = var
+        self.val = val
+        self.D = D
+
+    def Apply(self, slv):
+        self.var.SetValue(self.val)
+
+    def Refute(self, slv):
+        # Going against the heuristic counts as a discrepancy; since D is a
+        # solver variable, the count is restored upon backtracking and the
+        # search fails when the limit (the upper bound of D) is exceeded
+        self.var.RemoveValue(self.val)
+        self.D.SetMin(self.D.Min() + 1)
+
+    def DebugString(self):
+        return 'DiscrepancyDecision(%s == %d)' % (self.var, self.val)
+
+
+class LDSDecisionBuilder(pycp.PyDecisionBuilder):
+    def __init__(self, X, cost, D, on_decision=None):
+        pycp.PyDecisionBuilder.__init__(self)
+        self.X = X
+        self.cost = cost
+        self.D = D
+        self.on_decision = on_decision
+        # Keep the decisions alive (they are owned by python)
+        self.decisions = []
+
+    def Next(self, slv):
+        # Choose a variable with the minimum size domain
+        var, varidx, score = None, None, None
+        for i, x in enumerate(self.X):
+            if not x.Bound() and (score is None or x.Size() < score):
+                var, varidx = x, i
+                score = x.Size()
+        # If all variables are bound, this DB job is done
+        if var is None:
+            self.decisions = []
+            return None
+        if self.on_decision is not None:
+            self.on_decision()
+        # Choose the value with the lowest cost
+        val = min(var.DomainIterator(), key=lambda v: self.cost(varidx, v))
+        # Open a choice point; refuting it counts as a discrepancy
+        dec = DiscrepancyDecision(var, val, self.D)
+        self.decisions.append(dec)
+        return dec
+
+
+def lds(slv, X, cost, max_discrepancy, on_decision=None):
+    # Iterative limited discrepancy search: the value ordering is given by the
+    # cost function (var_idx, val) -> cost, and the discrepancy limit grows
+    # from 0 to max_discrepancy; the last iteration has no limit. If given,
+    # on_decision() is called before the costs of each decision are computed
+    limits = list(range(max_discrepancy + 1)) + [len(X) * len(X)]
+    dbs = []
+    for d in limits:
+        D = slv.IntVar(0, d, 'discrepancies_%d' % d)
+        dbs.append(slv.SolveOnce(LDSDecisionBuilder(X, cost, D, on_decision)))
+    return slv.Try(dbs)
+
+
+def luby(i):
+    # i-th element (starting from 1) of the Luby sequence: 1 1 2 1 1 2 4 ...
+    k = 1
+    while (1 << k) - 1 < i:
+        k += 1
+    if (1 << k) - 1 == i:
+        return 1 << (k - 1)
+    return luby(i - (1 << (k - 1)) + 1)
+
+
+def restarts(slv, db, kind, scale, growth=2.0, count=32):
+    # Run db with a sequence of fail limits (a restart is triggered each time
+    # the limit is reached); randomized DBs re-sample their choices at each
+    # restart. The limits follow the Luby sequence or a geometric progression,
+    # multiplied by scale; after "count" restarts no limit is applied.
+    if kind == 'luby':
+        caps = [scale * luby(i) for i in range(1, count + 1)]
+    elif kind == 'geometric':
+        caps = [int(scale * growth ** i) for i in range(count)]
+    else:
+        raise ValueError('Unknown restart strategy %s' % kind)
+    dbs = [slv.SolveOnce(db, [slv.FailuresLimit(cap)]) for cap in caps]
+    dbs.append(slv.SolveOnce(db))
+    return slv.Try(dbs)
+
+
 class SubPDecisionBuilder(pycp.PyDecisionBuilder):
-    def __init__(self, X, K, bmark, stats, frm=None, failcap=0):
+    def __init__(self, X, K, bmark, stats, frm=None, failcap=0, profiler=None):
         pycp.PyDecisionBuilder.__init__(self)
         self.X = X
         self.bmark = bmark
@@ -59,32 +151,29 @@ class SubPDecisionBuilder(pycp.PyDecisionBuilder):
         self.over_cap = 0
         self.all_fails = 0
         self.failcap = failcap
+        self.profiler = profiler
+        # Per-instance statistics
+        self.stats['records'] = []
 
     def Next(self, slv):
         # Read the minimum value in the K variable
         k = self.K.Value()
         # View statistics about the previous attempt
         if k > 0:
-            # NOTE: The number of fails should be corrected to take into account those due to the fake optimization
-            #  process
-            fails = slv.Failures() - self.stats['base_fails'] - 1
-            self.all_fails += fails
-            if fails >= self.failcap:
-              self.over_cap += 1
-            time = (slv.WallTime() - self.stats['base_time']) / 1000.0
-            # print('Attempt: %d | fails: %d, time: %.3f | all fails: %d | over cap: %d' % (k, fails, time, self.all_fails, self.over_cap))
+            self.record(slv, k-1)
             
         # Update statistics
         self.stats['base_fails'] = slv.Failures()
         self.stats['base_time'] = slv.WallTime()
+        self.stats['base_branches'] = slv.Branches()
         self.stats['all_fails'] = self.all_fails
         self.stats['overcap'] = self.over_cap
+        self.stats['solved'] = False
 
-        # Force all assignments for the k-th instace
-        for i in self.bmark[k]:
-            x = self.X[i]
-            self.bmark[k][i] = int(self.bmark[k][i])
-            x.SetValue(self.bmark[k][i])
+        # Force all assignments for the k-th instace (bmark is a matrix of values, 0 means empty)
+        pls = self.bmark[k]
+        for i, j in zip(*np.nonzero(pls)):
+            self.X[i, j].SetValue(int(pls[i, j]))
         # Print the current instance
         if self.frm is not None:
             #sys.stdout.write(self.frm.format(self.X) + '/')
@@ -95,6 +184,33 @@ class SubPDecisionBuilder(pycp.PyDecisionBuilder):
             # sys.stdout.flush()
         return None
 
+    def record(self, slv, k):
+        # NOTE: The number of fails should be corrected to take into account those due to the fake optimization
+        #  process
+        fails = slv.Failures() - self.stats['base_fails'] - 1
+        self.all_fails += fails
+        over_cap = self.failcap > 0 and fails >= self.failcap
+        if over_cap:
+            self.over_cap += 1
+        time = (slv.WallTime() - self.stats['base_time']) / 1000.0
+        rcd = {'instance': k,
+               'solved': self.stats['solved'],
+               'fails': fails,
+               'branches': slv.Branches() - self.stats['base_branches'],
+               'time': time,
+               'over_cap': over_cap}
+        # Add the counters of the profiled search steps
+        if self.profiler is not None:
+            rcd.update(self.profiler.collect())
+        self.stats['records'].append(rcd)
+
+    def close(self, slv):
+        # Record the statistics of the last attempt, once the search is over
+        if 'base_fails' in self.stats:
+            self.record(slv, len(self.bmark)-1)
+        self.stats['all_fails'] = self.all_fails
+        self.stats['overcap'] = self.over_cap
+
 
 class StoreDecisionBuilder(pycp.PyDecisionBuilder):
     def __init__(self, X, frm, stats, verbose):
@@ -109,12 +225,9 @@ class StoreDecisionBuilder(pycp.PyDecisionBuilder):
         # Check whether the solution is new
         #sol = [x.Value() for x in self.X]
         #self.res.append(sol)
+        self.stats['solved'] = True
         if self.verbose:
-            sys.stdout.write(self.frm.format(self.X))
-            sys.stdout.write("\n")
+            self.frm.store(self.X)
         '''else:
             sys.stdout.write('T')'''
         return None
-
-
-
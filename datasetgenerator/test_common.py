@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import numpy as np
+import pytest
+
+import common
+
+
+def random_pls(num, n, rng):
+    # Random (num, n*n) values in [0, n], with some empty cells (0 values)
+    V = rng.integers(1, n+1, size=(num, n*n))
+    V[rng.random((num, n*n)) < 0.3] = 0
+    return V
+
+
+def write_batch(V, n, frm):
+    fp = io.BytesIO()
+    common.write_pls_batch(fp, V, n, frm)
+    return fp.getvalue().decode()
+
+
+@pytest.mark.parametrize('frm', ['csv', 'bin', 'bits'])
+@pytest.mark.parametrize('n', [3, 7])
+def test_write_read_pls_batch(n, frm):
+    V = random_pls(20, n, np.random.default_rng(n))
+    order, res = common.read_pls_batch(io.StringIO(write_batch(V, n, frm)),
+            frm)
+    assert order == n
+    assert res.dtype == np.int8
+    assert res.reshape(len(V), -1).tolist() == V.tolist()
+    # The first instances only
+    _, res = common.read_pls_batch(io.StringIO(write_batch(V, n, frm)), frm,
+            max_size=5)
+    assert res.reshape(5, -1).tolist() == V[:5].tolist()
+
+
+@pytest.mark.parametrize('frm', ['friendly', 'csv', 'bin'])
+def test_write_pls_batch_format_values(frm):
+    # Same output of format_values, except for the empty cells in the "bin"
+    # format (written as zeros, see write_pls_batch)
+    n = 5
+    V = random_pls(10, n, np.random.default_rng(0))
+    if frm == 'bin':
+        V[V == 0] = 1
+    expected = ''.join(common.format_values(v, n, frm) + '\n' for v in V)
+    assert write_batch(V, n, frm) == expected
+
+
+def test_write_pls_batch_empty_cells():
+    n = 3
+    V = np.zeros((1, n*n), dtype=np.int64)
+    V[0, 0] = 2
+    assert write_batch(V, n, 'bin') == '0,1,0' + ',0,0,0' * (n*n - 1) + '\n'
+    assert write_batch(V, n, 'bits') == '010' + '000' * (n*n - 1) + '\n'
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 7])
+def test_save_load_pls_npz(n, tmp_path):
+    V = random_pls(20, n, np.random.default_rng(n))
+    V[V == 0] = 1
+    fname = str(tmp_path / 'pool.npz')
+    common.save_pls_pool(fname, V, n)
+    order, res = common.read_pls_file(fname, 'bin')
+    assert order == n
+    assert res.reshape(len(V), -1).tolist() == V.tolist()
+    # Files without the order: it is detected from the number of bytes,
+    # except for order 2 (loaded as order 1)
+    with np.load(fname) as fp:
+        np.savez_compressed(fname, confs=fp['confs'])
+    order, res = common.load_pls_npz(fname, max_size=5)
+    if n != 2:
+        assert order == n
+        assert res.reshape(5, -1).tolist() == V[:5].tolist()
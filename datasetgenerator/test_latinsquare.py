@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import itertools
+import numpy as np
+import pytest
+
+import latinsquare
+
+
+def all_latin_squares(n):
+    # All the Latin Squares of order n, by exhaustive search, as tuples of
+    # n*n values in [1, n] (by rows)
+    rows = list(itertools.permutations(range(1, n+1)))
+    squares = [[]]
+    for _ in range(n):
+        squares = [sq + [row] for sq in squares for row in rows
+                if all(row[j] != prev[j] for prev in sq for j in range(n))]
+    return {sum(sq, ()) for sq in squares}
+
+
+def is_latin_square(sol, n):
+    sq = np.asarray(sol).reshape(n, n)
+    values = list(range(1, n+1))
+    return all(sorted(sq[i]) == values and sorted(sq[:, i]) == values
+            for i in range(n))
+
+
+@pytest.mark.parametrize('n', [3, 4, 5, 6])
+def test_jacobson_matthews_latin_squares(n):
+    rng = np.random.default_rng(n)
+    squares = latinsquare.jacobson_matthews(
+            latinsquare.random_isotopes(50, n, rng), n**3, rng)
+    assert squares.shape == (50, n, n)
+    assert all(is_latin_square(sq + 1, n) for sq in squares)
+
+
+def test_sample_latin_squares_uniform():
+    # All the 576 Latin Squares of order 4 are sampled, with frequencies
+    # close to the uniform ones (chi-square test, 575 degrees of freedom)
+    n, num = 4, 57600
+    expected = all_latin_squares(n)
+    assert len(expected) == 576
+    sols = latinsquare.sample_latin_squares(num, n, np.random.default_rng(0))
+    assert sols.shape == (num, n*n) and sols.dtype == np.int8
+    counts = {}
+    for sol in map(tuple, sols.tolist()):
+        counts[sol] = counts.get(sol, 0) + 1
+    assert set(counts) == expected
+    freqs = np.array(list(counts.values()))
+    chi2 = ((freqs - num / 576)**2 / (num / 576)).sum()
+    assert chi2 < 700
@@ -0,0 +1,320 @@
+# Author: Mattia Silvestri
+
+"""
+    Checkpointed state of the evaluation of a model on the test set.
+"""
+
+import argparse
+import csv
+import os
+from statistics import NormalDist
+import numpy as np
+
+########################################################################################################################
+
+# Counters grouped by number of assigned variables
+COUNTERS = ["pred", "feas", "tot", "rand_pred", "rand_feas"]
+
+########################################################################################################################
+
+
+def shard_range(num_examples, shard_index, num_shards):
+    """
+    Deterministic contiguous range of examples evaluated by a shard.
+    :param num_examples: number of test examples; as integer.
+    :param shard_index: index of the shard, in [0, num_shards); as integer.
+    :param num_shards: number of shards; as integer.
+    :return: tuple of two integers; index of the first example and index after the last example of the shard.
+    """
+    if not 0 <= shard_index < num_shards:
+        raise ValueError("Shard index must be in [0,{})".format(num_shards))
+    return num_examples * shard_index // num_shards, num_examples * (shard_index + 1) // num_shards
+
+########################################################################################################################
+
+
+def batch_rng(seed, batch_start):
+    """
+    Random generator of a batch, which only depends on the seed and on the index of the first example of the batch so
+    that resumed and sharded evaluations draw the same random assignments.
+    :param seed: seed of the evaluation; as integer.
+    :param batch_start: index of the first example of the batch; as integer.
+    :return: numpy.random.Generator.
+    """
+    return np.random.default_rng([seed, batch_start])
+
+########################################################################################################################
+
+
+class EvaluationState:
+    """
+    Counters of the evaluation grouped by number of assigned variables, plus the watermark, i.e. the index after the
+    last processed example. The state is saved atomically so that an interrupted evaluation can be resumed from the
+    last watermark.
+    """
+    def __init__(self, dim, start, end):
+        """
+        :param dim: PLS dimension; as integer.
+        :param start: index of the first example to be evaluated; as integer.
+        :param end: index after the last example to be evaluated; as integer.
+        """
+        self.dim = dim
+        self.start = start
+        self.end = end
+        self.watermark = start
+        self.acc = 0
+        self.acc_rand = 0
+        self.counters = {name: np.zeros(shape=(dim ** 2), dtype=np.int64) for name in COUNTERS}
+
+    @property
+    def count(self):
+        """
+        Number of processed examples.
+        :return: integer.
+        """
+        return self.watermark - self.start
+
+    def update(self, batch_end, num_assigned_vars, correct, feas, rand_correct=None, rand_feas=None):
+        """
+        Add the results of a batch and move the watermark to its end.
+        :param batch_end: index after the last example of the batch; as integer.
+        :param num_assigned_vars: number of assigned variables of each example; as numpy array of integers.
+        :param correct: True for the correct predictions; as numpy array of booleans.
+        :param feas: True for the feasible predictions; as numpy array of booleans.
+        :param rand_correct: True for the correct random assignments; as numpy array of booleans.
+        :param rand_feas: True for the feasible random assignments; as numpy array of booleans.
+        :return:
+        """
+        self.acc += int(np.sum(correct))
+        np.add.at(self.counters["pred"], num_assigned_vars[correct], 1)
+        np.add.at(self.counters["feas"], num_assigned_vars[feas], 1)
+        if rand_correct is not None:
+            self.acc_rand += int(np.sum(rand_correct))
+            np.add.at(self.counters["rand_pred"], num_assigned_vars[rand_correct], 1)
+            np.add.at(self.counters["rand_feas"], num_assigned_vars[rand_feas], 1)
+        np.add.at(self.counters["tot"], num_assigned_vars, 1)
+        self.watermark = batch_end
+
+    def ratio(self, name):
+        """
+        Ratio between a counter and the total number of examples, grouped by number of assigned variables.
+        :param name: name of the counter; as string.
+        :return: list of floats; the ratio for 1 to dim**2 - 1 assigned variables.
+        """
+        return list((self.counters[name] / (self.counters["tot"] + 1e-8))[1:])
+
+    def save(self, filename):
+        """
+        Save the state; the file is first written to a temporary file and then renamed, so that an interruption
+        never leaves a partially written state.
+        :param filename: path of the state file; as string.
+        :return:
+        """
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "wb") as file:
+            np.savez(file,
+                     dim=self.dim, start=self.start, end=self.end, watermark=self.watermark,
+                     acc=self.acc, acc_rand=self.acc_rand,
+                     **self.counters)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_filename, filename)
+
+    @staticmethod
+    def load(filename):
+        """
+        Load a saved state.
+        :param filename: path of the state file; as string.
+        :return: EvaluationState.
+        """
+        with np.load(filename) as data:
+            state = EvaluationState(int(data["dim"]), int(data["start"]), int(data["end"]))
+            state.watermark = int(data["watermark"])
+            state.acc = int(data["acc"])
+            state.acc_rand = int(data["acc_rand"])
+            for name in COUNTERS:
+                state.counters[name] = data[name].copy()
+        return state
+
+    @staticmethod
+    def merge(states):
+        """
+        Merge the states of the shards of an evaluation.
+        :param states: the states of the shards; as list of EvaluationState.
+        :return: EvaluationState.
+        """
+        merged = EvaluationState(states[0].dim, 0, 0)
+        merged.end = merged.watermark = sum(state.count for state in states)
+        for state in states:
+            if state.dim != merged.dim:
+                raise ValueError("States of different problem dimensions cannot be merged")
+            merged.acc += state.acc
+            merged.acc_rand += state.acc_rand
+            for name in COUNTERS:
+                merged.counters[name] += state.counters[name]
+        return merged
+
+########################################################################################################################
+
+
+def confidence_interval(successes, trials, method="wilson", confidence=0.95):
+    """
+    Confidence interval of a binomial proportion, element-wise.
+    :param successes: number of successes; as numpy array of integers.
+    :param trials: number of trials; as numpy array of integers.
+    :param method: 'wilson' (score interval) or 'clopper-pearson' (exact interval); as string.
+    :param confidence: confidence level; as float.
+    :return: tuple of two numpy arrays of floats; lower and upper bounds. With no trials the interval is [0, 1].
+    """
+    successes = np.asarray(successes, dtype=np.float64)
+    trials = np.asarray(trials, dtype=np.float64)
+    alpha = 1 - confidence
+    safe_trials = np.maximum(trials, 1)
+
+    if method == "wilson":
+        z = NormalDist().inv_cdf(1 - alpha / 2)
+        p = np.where(trials > 0, successes / safe_trials, 0.0)
+        denominator = 1 + z ** 2 / safe_trials
+        center = (p + z ** 2 / (2 * safe_trials)) / denominator
+        half_width = z * np.sqrt(p * (1 - p) / safe_trials + z ** 2 / (4 * safe_trials ** 2)) / denominator
+        lower, upper = np.clip(center - half_width, 0, 1), np.clip(center + half_width, 0, 1)
+    elif method == "clopper-pearson":
+        from scipy.stats import beta
+        with np.errstate(invalid="ignore"):
+            lower = np.where(successes > 0, beta.ppf(alpha / 2, successes, trials - successes + 1), 0.0)
+            upper = np.where(successes < trials, beta.ppf(1 - alpha / 2, successes + 1, trials - successes), 1.0)
+    else:
+        raise ValueError("Unknown confidence interval method: {}".format(method))
+
+    lower = np.where(trials > 0, lower, 0.0)
+    upper = np.where(trials > 0, upper, 1.0)
+    return lower, upper
+
+########################################################################################################################
+
+
+class AdaptiveSampler:
+    """
+    Stratified sampling of the test examples by number of assigned variables: each batch takes the same number of
+    random examples from each active bucket, and a bucket is stopped once the confidence intervals of all the
+    monitored feasibility ratios are narrower than a target width (or once all its examples have been sampled).
+    """
+    def __init__(self, num_assigned_vars, batch_size, target_width, method="wilson", confidence=0.95,
+                 min_samples=30, seed=0):
+        """
+        :param num_assigned_vars: number of assigned variables of each test example; as numpy array of integers.
+        :param batch_size: number of examples of each batch; as integer.
+        :param target_width: maximum width of the confidence intervals; as float.
+        :param method: 'wilson' or 'clopper-pearson'; as string.
+        :param confidence: confidence level; as float.
+        :param min_samples: minimum number of examples of a bucket before it can be stopped; as integer.
+        :param seed: seed of the sampling order; as integer.
+        """
+        rng = np.random.default_rng(seed)
+        self.buckets = {int(k): rng.permutation(np.nonzero(num_assigned_vars == k)[0])
+                        for k in np.unique(num_assigned_vars)}
+        self.positions = {k: 0 for k in self.buckets}
+        self.active = set(self.buckets)
+        self.batch_size = batch_size
+        self.target_width = target_width
+        self.method = method
+        self.confidence = confidence
+        self.min_samples = min_samples
+
+    def next_batch(self):
+        """
+        Indexes of the examples of the next batch.
+        :return: numpy array of integers, sorted, or None if all the buckets are stopped.
+        """
+        self.active = {k for k in self.active if self.positions[k] < len(self.buckets[k])}
+        if len(self.active) == 0:
+            return None
+
+        per_bucket = max(1, self.batch_size // len(self.active))
+        indexes = []
+        for k in sorted(self.active):
+            indexes.append(self.buckets[k][self.positions[k]:self.positions[k] + per_bucket])
+            self.positions[k] += per_bucket
+        return np.sort(np.concatenate(indexes))
+
+    def update(self, successes, trials):
+        """
+        Stop the buckets whose confidence intervals are narrow enough.
+        :param successes: feasibility counters grouped by number of assigned variables, one for each monitored ratio;
+                          as list of numpy arrays.
+        :param trials: total counters grouped by number of assigned variables; as numpy array.
+        :return:
+        """
+        widths = [np.subtract(*confidence_interval(s, trials, self.method, self.confidence)[::-1])
+                  for s in successes]
+        width = np.max(widths, axis=0)
+        for k in list(self.active):
+            if trials[k] >= self.min_samples and width[k] <= self.target_width:
+                self.active.discard(k)
+
+    @property
+    def num_sampled(self):
+        return sum(min(self.positions[k], len(self.buckets[k])) for k in self.buckets)
+
+########################################################################################################################
+
+
+def write_bands(filename, successes, trials, method="wilson", confidence=0.95):
+    """
+    Save a feasibility curve with its confidence bands as a CSV file with one row for each number of assigned
+    variables.
+    :param filename: path of the CSV file; as string.
+    :param successes: feasibility counter grouped by number of assigned variables; as numpy array.
+    :param trials: total counter grouped by number of assigned variables; as numpy array.
+    :param method: 'wilson' or 'clopper-pearson'; as string.
+    :param confidence: confidence level; as float.
+    :return:
+    """
+    lower, upper = confidence_interval(successes, trials, method, confidence)
+    ratio = successes / (trials + 1e-8)
+    with open(filename, "w") as file:
+        wr = csv.writer(file)
+        wr.writerow(["num_assigned", "samples", "feasibility", "lower", "upper"])
+        for k in range(1, len(trials)):
+            wr.writerow([k, int(trials[k]), ratio[k], lower[k], upper[k]])
+
+########################################################################################################################
+
+
+def write_ratio(filename, values):
+    """
+    Save a feasibility or accuracy curve as a single CSV row.
+    :param filename: path of the CSV file; as string.
+    :param values: the curve; as list of floats.
+    :return:
+    """
+    with open(filename, "w") as file:
+        wr = csv.writer(file)
+        wr.writerow(values)
+
+########################################################################################################################
+
+
+if __name__ == '__main__':
+    # Merge the states of a sharded evaluation and save the feasibility curves
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--states", type=str, nargs='+', required=True,
+                        help="State files of the shards")
+    parser.add_argument("--feasibility-filename", type=str, required=True,
+                        help="Path where the feasibility of the model is saved to")
+    parser.add_argument("--random-feasibility-filename", type=str, default=None,
+                        help="Path where the feasibility of the random assigner is saved to")
+    args = parser.parse_args()
+
+    states = [EvaluationState.load(filename) for filename in args.states]
+    for filename, state in zip(args.states, states):
+        if state.watermark < state.end:
+            print("Warning: {} is incomplete ({}/{} examples)".format(filename, state.count, state.end - state.start))
+
+    merged = EvaluationState.merge(states)
+    print("Examples: {} | Accuracy: {} | Random accuracy: {}".format(merged.count,
+                                                                     merged.acc / max(merged.count, 1),
+                                                                     merged.acc_rand / max(merged.count, 1)))
+    write_ratio(args.feasibility_filename, merged.ratio("feas"))
+    if args.random_feasibility_filename is not None:
+        write_ratio(args.random_feasibility_filename, merged.ratio("rand_feas"))
@@ -7,8 +7,12 @@ Main program.
 import os
 
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
-from utility import PLSInstance, PLSSolver, random_assigner, from_one_hot_to_2d, from_2d_to_one_hot
-from models import MyModel
+from utility import random_assigner_batch, feasibility_multi, feasibility_from_masks, get_feasibility_checker, \
+    TieredFeasibilityChecker, to_one_hot_squares, from_one_hot_to_2d
+from models import MyModel, SparseOneHotDense
+from evaluation import EvaluationState, AdaptiveSampler, shard_range, batch_rng, write_ratio, write_bands
+from precompute_masks import masks_filename, load_unknown_counts
+from quantization import quantized_filename, load_inference_model
 import numpy as np
 import matplotlib.pyplot as plt
 import tensorflow as tf
@@ -17,6 +21,8 @@ import csv
 import argparse
 import time
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 ########################################################################################################################
 
@@ -59,12 +65,19 @@ parser.add_argument("--leave-columns-domains", action="store_true", default=Fals
 parser.add_argument("--num-sol", type=str, default="10k",
                     help="Number of solutions from which the training set has been generated; thousands are expressed "
                          + "with k (for example 10000=10k).")
-parser.add_argument("--model", choices=["fnn", "cnn"], required=True,
-                    help="Choose the model architecture.")  # TODO: change default
+parser.add_argument("--model", choices=["fnn", "fnn-sparse", "cnn"], required=True,  # TODO: change default
+                    help="Choose the model architecture. 'fnn-sparse' is the 'fnn' architecture with the 2D "
+                         + "representation as input, whose first layer sums the kernel rows of the assigned values.")
 parser.add_argument("--model-type", default="agnostic", choices=["agnostic", "sbrinspiredloss", "negative", "binary"],
                     help="Choose the model type. 'agnostic' is the model-agnostic baseline. 'sbrinspiredloss', "
                          + "'negative' and 'binary' are relatively the mse, negative and binary-cross entropy versions"
                          + " of the SBR inspiredloss.")
+parser.add_argument("--output-head", default="dense", choices=["dense", "factorized"],
+                    help="Output layer of the model. 'factorized' computes the logits of the (cell, value) pairs from "
+                         + "cell and value embeddings, with a number of weights quadratic instead of cubic in the "
+                         + "problem dimension.")
+parser.add_argument("--head-rank", default=8, type=int,
+                    help="Rank of the factorized output layer.")
 parser.add_argument("--validation-size", type=int, default=0,
                     help="Validation set dimension. If zero no validation set is used.")
 parser.add_argument("--use-prop", action="store_true", default=False,
@@ -75,10 +88,58 @@ parser.add_argument("--lmbd", default=1.0, type=float, help="Lambda for SBR-insp
 parser.add_argument("--patience", default=10, type=int,
                     help="Specify the number of 10 epochs intervals without improvement in "
                          "feasibility after which training is stopped.")
+parser.add_argument("--seed", default=0, type=int,
+                    help="Seed of the random assigner.")
+parser.add_argument("--resume", action="store_true", default=False,
+                    help="Resume the evaluation from the last checkpoint of the counters, if any.")
+parser.add_argument("--shard-index", default=0, type=int,
+                    help="Index of the contiguous range of test examples evaluated by this run.")
+parser.add_argument("--num-shards", default=1, type=int,
+                    help="Number of contiguous ranges the test examples are split into; the counters of the shards "
+                         + "can be merged with evaluation.py.")
+parser.add_argument("--eval-models", type=str, nargs='+', default=[],
+                    help="Test identifiers of further saved models evaluated in the same pass over the test set; "
+                         + "the feasibility queries shared by several models are checked only once.")
+parser.add_argument("--use-masks", action="store_true", default=False,
+                    help="Gather the global feasibility of the assignments from the masks precomputed with "
+                         + "precompute_masks.py instead of calling the solver.")
+parser.add_argument("--mask-penalties", action="store_true", default=False,
+                    help="Use the precomputed masks of the globally feasible next assignments as exact penalties "
+                         + "instead of the forward checking domains.")
+parser.add_argument("--solver-time-limit", default=30.0, type=float,
+                    help="Time limit in seconds of each feasibility check; checks over the limit are counted as "
+                         + "infeasible.")
+parser.add_argument("--solver-workers", default=1, type=int,
+                    help="Number of parallel search workers of the solver.")
+parser.add_argument("--tiered-feasibility", action="store_true", default=False,
+                    help="Decide the feasibility with cheap necessary conditions, matching conditions and greedy "
+                         + "completions before calling the solver.")
+parser.add_argument("--greedy-attempts", default=4, type=int,
+                    help="Number of randomized greedy completions attempted before calling the solver.")
+parser.add_argument("--adaptive-width", default=None, type=float,
+                    help="Sample the test examples stratified by number of assigned variables and stop sampling a "
+                         + "number of assigned variables once the confidence intervals of all the feasibility ratios "
+                         + "are narrower than this width; the curves are saved with their confidence bands.")
+parser.add_argument("--ci-method", default="wilson", choices=["wilson", "clopper-pearson"],
+                    help="Confidence interval of the adaptive evaluation.")
+parser.add_argument("--confidence", default=0.95, type=float,
+                    help="Confidence level of the adaptive evaluation.")
+parser.add_argument("--min-samples", default=30, type=int,
+                    help="Minimum number of examples for each number of assigned variables in the adaptive "
+                         + "evaluation.")
+parser.add_argument("--quantized", default="none", choices=["none", "int8", "tflite"],
+                    help="Evaluate the quantized models exported with quantization.py instead of the float "
+                         + "SavedModels.")
+parser.add_argument("--comparison-filename", type=str, default=None,
+                    help="Path of a CSV file where the feasibility curves of all the evaluated models (and of the "
+                         + "random assigner) are saved to, one row for each model.")
 
 args = parser.parse_args()
 print(args)
 
+if args.adaptive_width is not None and (args.resume or args.num_shards > 1):
+    parser.error("--adaptive-width cannot be combined with --resume or --num-shards")
+
 # Problem dimension.
 DIM = int(args.dim)
 
@@ -147,60 +208,16 @@ except:
 
 ########################################################################################################################
 
-# Create a validation set if required
-val_indexes = None
-
-if VAL_SIZE > 0:
-    print("Loading validation set...")
-    start = time.time()
-    X_val = pd.read_csv("datasets/pls{}/partial_solutions_{}_train.csv".format(DIM, NUM_SOL),
-                        sep=',',
-                        header=None,
-                        nrows=MAX_SIZE,
-                        dtype=np.int8).values
-
-    # Create penalties for the examples
-    if MODEL_TYPE != 'agnostic':
-        P_val = pd.read_csv("datasets/pls{}/domains_train_{}.csv".format(DIM, NUM_SOL),
-                            sep=',',
-                            header=None,
-                            nrows=MAX_SIZE,
-                            dtype=np.int8).values
-    else:
-        P_val = np.zeros_like(X_val, dtype=np.int8)
-
-    end = time.time()
-    print("Elapsed {} seconds".format((end - start)))
-
-    val_indexes = np.random.choice(np.arange(0, X_val.shape[0]), size=VAL_SIZE, replace=False)
-    X_val = X_val[val_indexes]
-    P_val = P_val[val_indexes]
-
-    # NOTE: if the model architecture is convolutional then we switch from the one-hot encoding to a 2D dimensional
-    #  representation
-    if args.model == 'cnn':
-        X_val = from_one_hot_to_2d(flattened_array=X_val)
-        # We also add the fake channel dimension
-        X_val = np.expand_dims(X_val, axis=-1)
-
-    validation_set = (X_val, P_val)
-
 # Load training examples
 features_filepath = "datasets/pls{}/partial_solutions_{}_{}.csv".format(DIM, NUM_SOL, mode)
 print("Loading features from {}...".format(features_filepath))
 start = time.time()
 X = pd.read_csv(features_filepath, sep=',', header=None, nrows=MAX_SIZE, dtype=np.int8).values
 end = time.time()
+features_load_time = end - start
 print("Elapsed {} seconds, {} GB required".format((end - start), X.nbytes / 10 ** 9))
 print("Number of rows: {}".format(X.shape[0]))
 
-# NOTE: if the model architecture is convolutional then we switch from the one-hot encoding to a 2D dimensional
-#  representation
-if args.model == 'cnn':
-    X = from_one_hot_to_2d(flattened_array=X)
-    # We also add the fake channel dimension
-    X = np.expand_dims(X, axis=-1)
-
 labels_filepath = "datasets/pls{}/assignments_{}_{}.csv".format(DIM, NUM_SOL, mode)
 print("Loading labels from {}...".format(labels_filepath))
 start = time.time()
@@ -208,8 +225,26 @@ Y = pd.read_csv(labels_filepath, sep=',', header=None, nrows=MAX_SIZE, dtype=np.
 end = time.time()
 print("Elapsed {} seconds, {} GB required".format((end - start), Y.nbytes / 10 ** 9))
 
+# Precomputed masks of the globally feasible next assignments, bit-packed
+masks = None
+if args.use_masks or args.mask_penalties:
+    print("Loading masks from {}...".format(masks_filename(DIM, NUM_SOL, mode)))
+    masks = np.load(masks_filename(DIM, NUM_SOL, mode))[:len(X)]
+    if len(masks) != len(X):
+        raise Exception("The masks do not match the dataset; compute them with precompute_masks.py")
+    # The masks are used as ground truth, so none of their assignments can be of unknown feasibility
+    unknown = load_unknown_counts(masks_filename(DIM, NUM_SOL, mode), len(X))
+    if np.any(unknown > 0):
+        raise Exception("{} masks have assignments of unknown feasibility (first: {}); recompute them with "
+                        "precompute_masks.py --recompute-unknown".format(np.count_nonzero(unknown),
+                                                                         np.nonzero(unknown)[0][:10]))
+
 # Create penalties for the examples
-if MODEL_TYPE == 'agnostic' and not args.use_prop:
+penalties_load_time = 0
+if args.mask_penalties:
+    # The infeasible next assignments are exactly penalized
+    P = (1 - np.unpackbits(masks, axis=1, count=DIM ** 3)).astype(np.int8)
+elif MODEL_TYPE == 'agnostic' and not args.use_prop:
     P = np.zeros((len(X), DIM**3), dtype=np.int8)
 else:
     if not args.leave_columns_domains:
@@ -220,14 +255,62 @@ else:
     print("Loading penalties from {}...".format(penalties_filepath))
     start = time.time()
     P = pd.read_csv(penalties_filepath, sep=',', header=None, nrows=MAX_SIZE, dtype=np.int8).values
-end = time.time()
-print("Elapsed {} seconds, {} GB required".format((end - start), P.nbytes / 10 ** 9))
+    end = time.time()
+    penalties_load_time = end - start
+print("Elapsed {} seconds, {} GB required".format(penalties_load_time, P.nbytes / 10 ** 9))
+
+# Create a validation set if required: the validation examples are swapped to the tail of the loaded arrays so that
+# both the training and the validation set are views of the same data
+num_train = len(X)
+
+if VAL_SIZE > 0 and TRAIN:
+    start = time.time()
+    num_train = len(X) - VAL_SIZE
+    val_indexes = np.random.choice(np.arange(0, X.shape[0]), size=VAL_SIZE, replace=False)
+
+    # Validation examples in the head are swapped with the training examples in the tail
+    head_indexes = np.sort(val_indexes[val_indexes < num_train])
+    tail_indexes = np.setdiff1d(np.arange(num_train, len(X)), val_indexes)
+    for array in (X, Y, P):
+        array[head_indexes], array[tail_indexes] = array[tail_indexes], array[head_indexes]
+
+    # Create penalties for the validation examples; they always come from the full propagation
+    if MODEL_TYPE == 'agnostic':
+        P_val = np.zeros((VAL_SIZE, DIM ** 3), dtype=np.int8)
+    elif not args.leave_columns_domains or args.mask_penalties:
+        P_val = P[num_train:]
+    else:
+        # Rows of the files in the tail, after the swaps; only these rows are parsed
+        tail_rows = np.arange(num_train, len(X))
+        tail_rows[tail_indexes - num_train] = head_indexes
+        sorted_rows = np.sort(tail_rows)
+        val_rows = set(sorted_rows.tolist())
+        P_val = pd.read_csv("datasets/pls{}/domains_train_{}.csv".format(DIM, NUM_SOL),
+                            sep=',',
+                            header=None,
+                            skiprows=lambda row: row not in val_rows,
+                            dtype=np.int8).values
+        P_val = P_val[np.searchsorted(sorted_rows, tail_rows)]
+    end = time.time()
+
+    print("Validation set created in {} seconds; about {} seconds saved by not loading the training files "
+          "twice".format(end - start, features_load_time + penalties_load_time))
 
-# Remove validation samples from the training set
-if val_indexes is not None:
-    X = np.delete(X, val_indexes, axis=0)
-    Y = np.delete(Y, val_indexes, axis=0)
-    P = np.delete(P, val_indexes, axis=0)
+# NOTE: if the model architecture is convolutional then we switch from the one-hot encoding to a 2D dimensional
+#  representation
+if args.model in ('cnn', 'fnn-sparse'):
+    X = from_one_hot_to_2d(flattened_array=X)
+    # We also add the fake channel dimension
+    X = np.expand_dims(X, axis=-1)
+    # NOTE: the sparse model only needs the cell values
+    if args.model == 'fnn-sparse':
+        X = X.astype(np.int8)
+
+if num_train < len(X):
+    validation_set = (X[num_train:], P_val)
+    X, Y, P = X[:num_train], Y[:num_train], P[:num_train]
+else:
+    validation_set = None
 
 # Create TF datasets
 dataset = tf.data.Dataset.from_tensor_slices((X, Y, P)).shuffle(10000).batch(BATCH_SIZE)
@@ -241,6 +324,15 @@ if args.model == 'fnn':
         Dense(units=16,
               activation='relu')
     ]
+elif args.model == 'fnn-sparse':
+    layers = [
+        SparseOneHotDense(input_shape=X.shape[1:],
+                          dim=DIM,
+                          units=16,
+                          activation='relu'),
+        Dense(units=16,
+              activation='relu')
+    ]
 elif args.model == 'cnn':
     layers = [
         Conv2D(input_shape=X.shape[1:],
@@ -257,7 +349,9 @@ else:
 model = MyModel(hidden_layers=layers,
                 output_dim=DIM ** 3,
                 method=MODEL_TYPE,
-                lmbd=args.lmbd)
+                lmbd=args.lmbd,
+                output_head=args.output_head,
+                head_rank=args.head_rank)
 
 # Train model
 if TRAIN:
@@ -292,141 +386,235 @@ else:
 
 # Test the model
 
-# Make predictions
-tensor_X = X.astype(np.float32)
-predict_val = tf.nn.softmax(model.model(tensor_X)).numpy()
-
-# Prune values according to constraints propagator if required
-if args.use_prop:
-    predict_val *= (1 - P)
-
-# Count of correct predictions grouped by number of assigned variables
-pred_by_num_assigned = np.zeros(shape=(DIM ** 2))
-# Count of feasible solutions grouped by number of assigned variables
-feas_by_num_assigned = np.zeros(shape=(DIM ** 2))
-# Count of total examples grouped by number of assigned variables
-tot_by_num_assigned = np.zeros(shape=(DIM ** 2))
-# Count of random correct predictions grouped by number of assigned variables
-rand_pred_by_num_assigned = np.zeros(shape=(DIM ** 2))
-# Count of random feasible solutions grouped by number of assigned variables
-rand_feas_by_num_assigned = np.zeros(shape=(DIM ** 2))
-
-# Compute overall accuracy on training set
-acc = 0
-count = 0
-acc_rand = 0
-
-# Compute accuracy grouped by number of assigned variables
-preds = []
-for x, pred, y, d in zip(X, predict_val, Y, P):
+# Models evaluated in the same pass over the test set, identified by their test number; the model of the current test
+# number is always the first one
+eval_models = [TEST_NUM] + [test_num for test_num in args.eval_models if test_num != TEST_NUM]
 
-    # NOTE: if the model is convolutional then get the input back to the flattened one-hot representation
-    if args.model == 'cnn':
-        x = from_2d_to_one_hot(x, dim=DIM)
-
-    if count % 1000 == 0:
-        print("Examined {} instances".format(count))
-
-    num_assigned_vars = np.sum(x.astype(np.int8))
-    pred_label = np.argmax(pred.reshape(-1))
-    correct_label = np.argmax(y.reshape(-1))
-
-    if pred_label == correct_label:
-        acc += 1
-        pred_by_num_assigned[num_assigned_vars] += 1
-
-    # Create a problem instance with current examples for net prediction
-    square = np.reshape(x, (DIM, DIM, DIM))
-    pls = PLSInstance(n=DIM)
-    pls.square = square.copy()
-    # assert pls.__check_constraints__(), "Constraints should be verified before assignment"
-
-    # Make the prediction assignment
-    assignment = np.argmax(pred)
-    assignment = np.unravel_index(assignment, shape=(DIM, DIM, DIM))
-
-    # Local consistency
-    local_feas = pls.assign(assignment[0], assignment[1], assignment[2])
-
-    '''vals_square = np.argmax(square, axis=2) + np.sum(square, axis=2)
-    solver = utility.PLSSolver(DIM, square=np.reshape(vals_square, -1))
-    res = solver.solve()
-    assert res, "Constraint solver is wrong because the input comes from a real solution"'''
-
-    # Global consistency
-    if local_feas:
-        vals_square = np.argmax(pls.square.copy(), axis=2) + np.sum(pls.square.copy(), axis=2)
-        solver = PLSSolver(DIM, square=np.reshape(vals_square, -1))
-        feas = solver.solve()
-    else:
-        feas = local_feas
 
-    if feas:
-        feas_by_num_assigned[num_assigned_vars] += 1
+def saved_input_shape(saved_model):
+    """
+    Shape of the inputs of a SavedModel, without the batch dimension, from its serving signature.
+    :param saved_model: the model; as loaded by tf.saved_model.load.
+    :return: tuple of integers.
+    """
+    input_spec, = saved_model.signatures["serving_default"].structured_input_signature[1].values()
+    return tuple(input_spec.shape[1:])
 
-    # Check random assignment performance if required
-    if args.rnd_feas:
-        if not args.use_prop:
-            d = None
-        rand_assignment = random_assigner(DIM ** 3, d)
-        if rand_assignment == correct_label:
-            acc_rand += 1
-            rand_pred_by_num_assigned[num_assigned_vars] += 1
-
-        # Create a problem instance with current training example for random prediction
-        square = np.reshape(x, (DIM, DIM, DIM))
-        pls = PLSInstance(n=DIM)
-        pls.square = square.copy()
-        # assert pls.__check_constraints__(), "Constraints should be verified before assignment"
-
-        # Make the random assignment
-        rand_assignment = np.unravel_index(rand_assignment, shape=(DIM, DIM, DIM))
-
-        local_feas = pls.assign(rand_assignment[0], rand_assignment[1], rand_assignment[2])
-
-        # Check global consistency
-        if local_feas:
-            vals_square = np.argmax(pls.square.copy(), axis=2) + np.sum(pls.square.copy(), axis=2)
-            solver = PLSSolver(DIM, square=np.reshape(vals_square, -1))
-            feas = solver.solve()
-        else:
-            feas = local_feas
 
-        if feas:
-            rand_feas_by_num_assigned[num_assigned_vars] += 1
+def load_evaluated_model(test_num):
+    """
+    Float or quantized model of a test number. All the models are given the same inputs, encoded for --model, hence
+    the float model must take inputs of the same shape (e.g. 'cnn' and 'fnn-sparse' models take the same encoding).
+    :param test_num: the test identifier; as string.
+    :return: a callable returning the logits.
+    """
+    model_dir = "models/test-{}/".format(test_num)
+    saved_model = model.model if test_num == TEST_NUM else tf.saved_model.load(model_dir)
+    input_shape = saved_input_shape(saved_model)
+    if input_shape != X.shape[1:]:
+        raise ValueError("The model of test {} takes inputs of shape {}, while the test set is encoded for --model {} "
+                         "with shape {}".format(test_num, input_shape, args.model, X.shape[1:]))
+    if args.quantized != "none":
+        return load_inference_model(quantized_filename(model_dir, args.quantized))
+    return saved_model
 
-    # Increase count of solutions with this number of assignments
-    tot_by_num_assigned[num_assigned_vars] += 1
-    count += 1
 
-    # Save results checkpoint
-    if count % 1000 == 0:
+saved_models = [load_evaluated_model(test_num) for test_num in eval_models]
 
-        feasibility = list((feas_by_num_assigned / (tot_by_num_assigned + 1e-8))[1:])
 
-        if not args.use_prop:
-            filename = "{}/feasibility_{}.csv".format(SAVE_PATH, mode)
-        else:
-            if args.leave_columns_domains:
-                filename = "{}/feasibility_{}_with_row_prop.csv".format(SAVE_PATH, mode)
-            else:
-                filename = "{}/feasibility_{}_with_full_prop.csv".format(SAVE_PATH, mode)
+def predict_labels(rows):
+    """
+    Predicted assignments of each evaluated model for a batch of test examples; the input is cast to float32 one batch
+    at a time and only the argmax of the scores is kept.
+    :param rows: the examples of the batch; as slice or numpy array of indexes.
+    :return: numpy array of shape (num_models, batch_size) with the assigned variables indexes.
+    """
+    tensor_X = X[rows].astype(np.float32)
+    labels = []
+
+    for saved_model in saved_models:
+        predict_val = tf.nn.softmax(saved_model(tensor_X)).numpy()
 
-        with open(filename, "w") as epoch_file:
-            wr = csv.writer(epoch_file)
-            wr.writerow(feasibility)
+        # Prune values according to constraints propagator if required
+        if args.use_prop:
+            predict_val *= (1 - P[rows])
+
+        labels.append(np.argmax(predict_val, axis=1))
+
+    return np.stack(labels)
+
+
+# Counters grouped by number of assigned variables of each model, restored from the last checkpoint if required
+shard_start, shard_end = shard_range(len(X), args.shard_index, args.num_shards)
+shard_suffix = "" if args.num_shards == 1 else "_shard{}of{}".format(args.shard_index, args.num_shards)
+if args.adaptive_width is not None:
+    shard_suffix = "_adaptive"
+
+if not args.use_prop:
+    feasibility_filename = "feasibility_{}{}.csv".format(mode, shard_suffix)
+else:
+    if args.leave_columns_domains:
+        feasibility_filename = "feasibility_{}_with_row_prop{}.csv".format(mode, shard_suffix)
+    else:
+        feasibility_filename = "feasibility_{}_with_full_prop{}.csv".format(mode, shard_suffix)
+
+# The curves of the quantized models are saved next to the float ones
+if args.quantized != "none":
+    feasibility_filename = feasibility_filename.replace(".csv", "_{}.csv".format(args.quantized))
+
+filenames = []
+states = []
+for test_num in eval_models:
+    model_save_path = "plots/test-{}/".format(test_num)
+    os.makedirs(model_save_path, exist_ok=True)
+    filename = "{}/{}".format(model_save_path, feasibility_filename)
+    state_filename = os.path.splitext(filename)[0] + "_state.npz"
+
+    if args.resume and os.path.exists(state_filename):
+        state = EvaluationState.load(state_filename)
+        if state.dim != DIM or (state.start, state.end) != (shard_start, shard_end):
+            raise Exception("The checkpoint {} does not match the current evaluation".format(state_filename))
+    else:
+        state = EvaluationState(DIM, shard_start, shard_end)
+
+    filenames.append(filename)
+    states.append(state)
+
+# All the models restart from the least advanced checkpoint; the examples already processed by a model are not counted
+# again, even if its checkpoint is in the middle of a batch (e.g. the batch size changed)
+watermark = min(state.watermark for state in states)
+if watermark > shard_start:
+    print("Resuming from example {} of {}".format(watermark, shard_end))
+
+checker = get_feasibility_checker(DIM, args.solver_time_limit, args.solver_workers)
+if args.tiered_feasibility:
+    checker = TieredFeasibilityChecker(DIM, checker, args.greedy_attempts, args.seed)
+
+# Batches of examples: contiguous ranges of the shard or, in the adaptive evaluation, stratified samples of the test set
+sampler = None
+if args.adaptive_width is not None:
+    sampler = AdaptiveSampler(np.count_nonzero(X.reshape(len(X), -1), axis=1), BATCH_SIZE, args.adaptive_width,
+                              args.ci_method, args.confidence, args.min_samples, args.seed)
+    next_batch = sampler.next_batch
+else:
+    ranges = iter([slice(batch_start, min(batch_start + BATCH_SIZE, shard_end))
+                   for batch_start in range(watermark, shard_end, BATCH_SIZE)])
+    next_batch = partial(next, ranges, None)
+
+# Compute accuracy grouped by number of assigned variables, one batch of examples at a time; the predictions of the
+# next batch are computed in a background thread while checking the feasibility of the current one
+executor = ThreadPoolExecutor(max_workers=1)
+rows = next_batch()
+next_preds = executor.submit(predict_labels, rows) if rows is not None else None
+num_examined = watermark - shard_start
+num_queries = 0
+num_distinct_queries = 0
+
+while rows is not None:
+    print("Examined {} instances".format(num_examined))
+
+    # Make the prediction assignments
+    pred_labels = next_preds.result()
+    next_rows = next_batch()
+    if next_rows is not None:
+        next_preds = executor.submit(predict_labels, next_rows)
+
+    # NOTE: if the model is convolutional then get the input back to the flattened one-hot representation
+    squares = to_one_hot_squares(X[rows], DIM)
+    num_assigned_vars = np.sum(squares.reshape(len(squares), -1), axis=1, dtype=np.int64)
+    correct_labels = np.argmax(Y[rows].reshape(len(squares), -1), axis=1)
+    first_row = rows.start if isinstance(rows, slice) else int(rows[0])
+
+    # Check random assignment performance if required; the random generator only depends on the seed and on the
+    # batch so that resumed and sharded evaluations draw the same assignments
+    if args.rnd_feas:
+        rand_labels = random_assigner_batch(DIM ** 3,
+                                            P[rows] if args.use_prop else None,
+                                            batch_size=len(squares),
+                                            rng=batch_rng(args.seed, first_row))
+        pred_labels = np.concatenate([pred_labels, rand_labels[None]])
+
+    # Local and global consistency of all the models (and of the random assigner) at once, gathered from the masks if
+    # required
+    if args.use_masks:
+        feas = feasibility_from_masks(masks[rows], pred_labels)
+    else:
+        _, feas, distinct_queries = feasibility_multi(squares, pred_labels, checker)
+        num_queries += pred_labels.size
+        num_distinct_queries += distinct_queries
+
+    rand_correct, rand_feas = None, None
+    if args.rnd_feas:
+        rand_correct, rand_feas = rand_labels == correct_labels, feas[-1]
+
+    batch_start = first_row if isinstance(rows, slice) else num_examined
+    batch_end = batch_start + len(squares)
+    for model_idx, (filename, state) in enumerate(zip(filenames, states)):
+        if state.watermark >= batch_end:
+            continue
+        # Only the examples after the watermark of the model are counted
+        new = slice(max(state.watermark - batch_start, 0), None)
+        state.update(batch_end, num_assigned_vars[new], (pred_labels[model_idx] == correct_labels)[new],
+                     feas[model_idx][new],
+                     None if rand_correct is None else rand_correct[new],
+                     None if rand_feas is None else rand_feas[new])
+
+        # Save results checkpoint
+        if sampler is None:
+            state.save(os.path.splitext(filename)[0] + "_state.npz")
+        write_ratio(filename, state.ratio("feas"))
+
+    # Stop sampling the numbers of assigned variables whose feasibility ratios are accurate enough
+    if sampler is not None:
+        successes = [state.counters["feas"] for state in states]
+        if args.rnd_feas:
+            successes.append(states[0].counters["rand_feas"])
+        sampler.update(successes, states[0].counters["tot"])
+
+    num_examined += len(squares)
+    rows = next_rows
+
+executor.shutdown()
+
+if (len(eval_models) > 1 or args.rnd_feas) and not args.use_masks:
+    print("Feasibility queries: {} | Distinct queries: {}".format(num_queries, num_distinct_queries))
+if args.tiered_feasibility:
+    print("Feasibility queries resolved by each tier: {}".format(checker.report()))
+if checker.num_timeouts > 0:
+    print("Warning: {} of {} solver calls reached the time limit".format(checker.num_timeouts, checker.num_queries))
+if sampler is not None:
+    print("Adaptive evaluation: {} of {} test examples sampled".format(num_examined, len(X)))
 
 # Check accuracy is correctly computed
-assert np.sum(pred_by_num_assigned) == acc and np.sum(tot_by_num_assigned) == count, \
-    "acc: {} | acc_vectorized: {} | count: {} | count_vectorized: {}".format(acc, np.sum(pred_by_num_assigned),
-                                                                             count, np.sum(tot_by_num_assigned))
+for state in states:
+    assert np.sum(state.counters["pred"]) == state.acc and np.sum(state.counters["tot"]) == state.count, \
+        "acc: {} | acc_vectorized: {} | count: {} | count_vectorized: {}".format(state.acc,
+                                                                                 np.sum(state.counters["pred"]),
+                                                                                 state.count,
+                                                                                 np.sum(state.counters["tot"]))
 
 # Make plots
 
-accuracy = list((pred_by_num_assigned / (tot_by_num_assigned + 1e-8))[1:])
-feasibility = list((feas_by_num_assigned / (tot_by_num_assigned + 1e-8))[1:])
+state = states[0]
+accuracy = state.ratio("pred")
+feasibility = state.ratio("feas")
 if args.rnd_feas:
-    random_feasibility = list((rand_feas_by_num_assigned / (tot_by_num_assigned + 1e-8))[1:])
+    random_feasibility = state.ratio("rand_feas")
+
+# Save the feasibility curves with their confidence bands in the adaptive evaluation
+if sampler is not None:
+    for filename, model_state in zip(filenames, states):
+        write_bands(os.path.splitext(filename)[0] + "_bands.csv", model_state.counters["feas"],
+                    model_state.counters["tot"], args.ci_method, args.confidence)
+
+# Save all the feasibility curves together if required
+if args.comparison_filename is not None:
+    with open(args.comparison_filename, "w") as file:
+        wr = csv.writer(file)
+        for test_num, model_state in zip(eval_models, states):
+            wr.writerow([test_num] + model_state.ratio("feas"))
+        if args.rnd_feas:
+            wr.writerow(["random"] + random_feasibility)
 
 # Save random assigner results
 if args.rnd_feas:
@@ -445,6 +633,7 @@ if args.rnd_feas:
     except:
         print("Directory {} already exists".format(RANDOM_SAVE_PATH))
 
-    with open("{}/random_feasibility.csv".format(RANDOM_SAVE_PATH, mode), "w") as epoch_file:
-        wr = csv.writer(epoch_file)
-        wr.writerow(random_feasibility)
+    write_ratio("{}/random_feasibility{}.csv".format(RANDOM_SAVE_PATH, shard_suffix), random_feasibility)
+    if sampler is not None:
+        write_bands("{}/random_feasibility{}_bands.csv".format(RANDOM_SAVE_PATH, shard_suffix),
+                    state.counters["rand_feas"], state.counters["tot"], args.ci_method, args.confidence)
@@ -13,19 +13,121 @@ from tensorflow.keras.layers import Conv2D, Flatten, Dense, BatchNormalization,
 ########################################################################################################################
 
 
+class SparseOneHotDense(tf.keras.layers.Layer):
+    """
+    Dense layer on the flattened one-hot encoding of a PLS, computed from its 2D representation: since each cell has
+    at most one assigned value, the outputs are the sum of the kernel rows of the assigned (cell, value) pairs, which
+    are gathered instead of multiplying the whole one-hot encoding. The kernel has the same shape as the kernel of the
+    equivalent Dense layer, (dim**3, units), and the outputs are the same.
+    """
+    def __init__(self, dim, units, activation=None, **kwargs):
+        """
+        :param dim: PLS dimension; as integer.
+        :param units: number of output neurons; as integer.
+        :param activation: the activation function; as string or callable.
+        """
+        super(SparseOneHotDense, self).__init__(**kwargs)
+        self.dim = dim
+        self.units = units
+        self.activation = tf.keras.activations.get(activation)
+
+    def build(self, input_shape):
+        self.kernel = self.add_weight(name="kernel", shape=(self.dim ** 3, self.units),
+                                      initializer="glorot_uniform", trainable=True)
+        self.bias = self.add_weight(name="bias", shape=(self.units,), initializer="zeros", trainable=True)
+
+    def call(self, inputs):
+        """
+        :param inputs: cell values (0 means empty) as tf.Tensor of shape (batch_size, dim, dim) or (batch_size, dim,
+                       dim, 1).
+        :return: tf.Tensor of shape (batch_size, units).
+        """
+        values = tf.reshape(tf.cast(inputs, dtype=tf.int32), [-1, self.dim ** 2])
+        # Index of the assigned (cell, value) pair in the flattened one-hot encoding
+        indexes = tf.range(self.dim ** 2) * self.dim + values - 1
+        rows = tf.gather(self.kernel, tf.maximum(indexes, 0))
+        assigned = tf.cast(values > 0, dtype=rows.dtype)
+        return self.activation(tf.reduce_sum(rows * assigned[..., None], axis=1) + self.bias)
+
+    def get_config(self):
+        config = super(SparseOneHotDense, self).get_config()
+        config.update({"dim": self.dim,
+                       "units": self.units,
+                       "activation": tf.keras.activations.serialize(self.activation)})
+        return config
+
+########################################################################################################################
+
+
+class FactorizedOutput(tf.keras.layers.Layer):
+    """
+    Output layer of the dim**3 logits of the (cell, value) pairs factorized as a cell term plus a low rank bilinear
+    term: logits[b, c, v] = a[b, c] + sum_k q[b, k] * C[c, k] * V[v, k] + value_bias[v], where a and q are linear
+    functions of the inputs and C and V are learned cell and value embeddings. The number of weights grows with
+    dim**2 instead of dim**3; the logits are flattened in the order of the one-hot encoding.
+    """
+    def __init__(self, dim, rank, **kwargs):
+        """
+        :param dim: PLS dimension; as integer.
+        :param rank: size of the cell and value embeddings; as integer.
+        """
+        super(FactorizedOutput, self).__init__(**kwargs)
+        self.dim = dim
+        self.rank = rank
+
+    def build(self, input_shape):
+        units = int(input_shape[-1])
+        self.cell_kernel = self.add_weight(name="cell_kernel", shape=(units, self.dim ** 2),
+                                           initializer="glorot_uniform", trainable=True)
+        self.cell_bias = self.add_weight(name="cell_bias", shape=(self.dim ** 2,), initializer="zeros",
+                                         trainable=True)
+        self.query_kernel = self.add_weight(name="query_kernel", shape=(units, self.rank),
+                                            initializer="glorot_uniform", trainable=True)
+        self.query_bias = self.add_weight(name="query_bias", shape=(self.rank,), initializer="zeros", trainable=True)
+        self.cell_embeddings = self.add_weight(name="cell_embeddings", shape=(self.dim ** 2, self.rank),
+                                               initializer="glorot_uniform", trainable=True)
+        self.value_embeddings = self.add_weight(name="value_embeddings", shape=(self.dim, self.rank),
+                                                initializer="glorot_uniform", trainable=True)
+        self.value_bias = self.add_weight(name="value_bias", shape=(self.dim,), initializer="zeros", trainable=True)
+
+    def call(self, inputs):
+        """
+        :param inputs: the hidden features as tf.Tensor of shape (batch_size, units).
+        :return: logits as tf.Tensor of shape (batch_size, dim**3).
+        """
+        cell_logits = tf.matmul(inputs, self.cell_kernel) + self.cell_bias
+        query = tf.matmul(inputs, self.query_kernel) + self.query_bias
+        # Bilinear term of shape (batch_size, dim**2, dim)
+        pairs = tf.matmul(query[:, None, :] * self.cell_embeddings, self.value_embeddings, transpose_b=True)
+        logits = cell_logits[:, :, None] + pairs + self.value_bias
+        return tf.reshape(logits, [-1, self.dim ** 3])
+
+    def get_config(self):
+        config = super(FactorizedOutput, self).get_config()
+        config.update({"dim": self.dim,
+                       "rank": self.rank})
+        return config
+
+########################################################################################################################
+
+
 # NOTE: here we define an abstract class for architectures that solve the PLS
 class MyModel(tf.keras.Model):
     def __init__(self,
                  hidden_layers,
                  output_dim,
                  method='agnostic',
-                 lmbd=1.0):
+                 lmbd=1.0,
+                 output_head='dense',
+                 head_rank=8):
         """
         tk.keras.Model subclassing to implement the SBR-inspired regularization.
         :param hidden_layers: list of Layer; the hidden layers of the neural architecture.
         :param output_dim: number of output neurons; as integer.
         :param method: method to be applied to the NN; as string.
         :param lmbd: lambda for SBR-inspired loss term.
+        :param output_head: 'dense' for a Dense output layer, 'factorized' for a FactorizedOutput one; as string.
+        :param head_rank: rank of the factorized output layer; as integer.
         """
 
         super(MyModel, self).__init__(name="mymodel")
@@ -41,6 +143,11 @@ class MyModel(tf.keras.Model):
         # Lambda for SBR-inspired loss term
         self.lmbd = lmbd
 
+        if output_head not in ['dense', 'factorized']:
+            raise Exception("Output head selected not valid")
+        self.output_head = output_head
+        self.head_rank = head_rank
+
         # Define the model
         self._define_model()
 
@@ -57,7 +164,11 @@ class MyModel(tf.keras.Model):
         for layer in self.hidden_layers:
             self.model.add(layer)
 
-        self.model.add(Dense(self.output_dim))
+        if self.output_head == 'factorized':
+            # The output dimension is dim**3
+            self.model.add(FactorizedOutput(dim=int(round(np.cbrt(self.output_dim))), rank=self.head_rank))
+        else:
+            self.model.add(Dense(self.output_dim))
 
     def _define_optimizer(self):
         self.optimizer = tf.keras.optimizers.Adam(learning_rate=0.001)
@@ -0,0 +1,223 @@
+# Author: Mattia Silvestri
+
+"""
+    Pure NumPy inference of the trained architectures, so that batched rollouts do not need TensorFlow.
+"""
+
+import numpy as np
+
+########################################################################################################################
+
+# Supported activation functions
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+}
+
+# Type of the layers for each supported Keras layer
+LAYER_TYPES = {
+    'Dense': 'dense',
+    'SparseOneHotDense': 'sparse_dense',
+    'Conv2D': 'conv2d',
+}
+
+# Weights of the FactorizedOutput layers, in the order of Layer.get_weights()
+FACTORIZED_WEIGHTS = ['cell_kernel', 'cell_bias', 'query_kernel', 'query_bias', 'cell_embeddings', 'value_embeddings',
+                      'value_bias']
+
+# Weight matrices quantized to int8 by NumpyModel.save
+QUANTIZED_WEIGHTS = ['kernel', 'cell_kernel', 'query_kernel', 'cell_embeddings', 'value_embeddings']
+
+########################################################################################################################
+
+
+class NumpyModel:
+    """
+    Sequential model made of Dense, SparseOneHotDense, Conv2D (stride 1, 'valid' padding), Flatten and
+    FactorizedOutput layers, evaluated with NumPy.
+    Each layer is a dictionary with the layer type, the activation and the float32 weights. The weight matrices can
+    be saved as int8 (e.g. 'kernel_q') with one float32 scale for each output channel (e.g. 'kernel_scale'); this only
+    reduces the size of the saved file, since the int8 weights are dequantized when the model is built.
+    """
+    def __init__(self, layers):
+        """
+        :param layers: the layers of the model, whose int8 weights (if any) are dequantized; as list of dictionaries.
+        """
+        self.layers = [self._dequantize(layer) for layer in layers]
+
+    @staticmethod
+    def from_keras(model):
+        """
+        Copy the weights of a Keras Sequential model.
+        :param model: the Keras model; as tf.keras.Model.
+        :return: NumpyModel.
+        """
+        layers = []
+        for layer in model.layers:
+            layer_type = type(layer).__name__
+            if layer_type == 'Flatten':
+                layers.append({'type': 'flatten'})
+                continue
+            if layer_type == 'FactorizedOutput':
+                layer_weights = {name: weights.astype(np.float32)
+                                 for name, weights in zip(FACTORIZED_WEIGHTS, layer.get_weights())}
+                layers.append(dict(type='factorized', **layer_weights))
+                continue
+            if layer_type not in LAYER_TYPES:
+                raise ValueError("Layer {} is not supported".format(layer_type))
+
+            activation = layer.get_config()['activation']
+            if activation not in ACTIVATIONS:
+                raise ValueError("Activation {} is not supported".format(activation))
+            if layer_type == 'Conv2D' and (tuple(layer.strides) != (1, 1) or layer.padding != 'valid'):
+                raise ValueError("Only Conv2D layers with stride 1 and 'valid' padding are supported")
+
+            kernel, bias = layer.get_weights()
+            layers.append({'type': LAYER_TYPES[layer_type],
+                           'activation': activation,
+                           'kernel': kernel.astype(np.float32),
+                           'bias': bias.astype(np.float32)})
+        return NumpyModel(layers)
+
+    def save(self, filename, quantize=False):
+        """
+        Save the layers to a .npz file.
+        :param filename: path of the file; as string.
+        :param quantize: if True, the weight matrices are saved as int8 (see _quantize); as boolean.
+        :return:
+        """
+        layers = [self._quantize(layer) for layer in self.layers] if quantize else self.layers
+        arrays = {'types': np.array([layer['type'] for layer in layers]),
+                  'activations': np.array([layer.get('activation', '') for layer in layers])}
+        for idx, layer in enumerate(layers):
+            for name, value in layer.items():
+                if isinstance(value, np.ndarray):
+                    arrays['layer{}_{}'.format(idx, name)] = value
+        np.savez(filename, **arrays)
+
+    @staticmethod
+    def load(filename):
+        """
+        Load the layers from a .npz file.
+        :param filename: path of the file; as string.
+        :return: NumpyModel.
+        """
+        layers = []
+        with np.load(filename) as data:
+            for idx, (layer_type, activation) in enumerate(zip(data['types'], data['activations'])):
+                layer = {'type': str(layer_type)}
+                if layer_type != 'flatten':
+                    layer['activation'] = str(activation)
+                prefix = 'layer{}_'.format(idx)
+                for key in data.files:
+                    if key.startswith(prefix):
+                        layer[key[len(prefix):]] = data[key]
+                layers.append(layer)
+        return NumpyModel(layers)
+
+    @staticmethod
+    def _quantize(layer):
+        """
+        Post-training symmetric int8 quantization of the kernels and of the factor matrices of the FactorizedOutput
+        layers, with one scale for each output channel; the biases are kept in float32.
+        :param layer: the layer; as dictionary.
+        :return: dictionary.
+        """
+        quantized = {}
+        for name, value in layer.items():
+            if name not in QUANTIZED_WEIGHTS:
+                quantized[name] = value
+                continue
+            # The output channels are on the last axis of all the quantized weights
+            max_abs = np.max(np.abs(value.reshape(-1, value.shape[-1])), axis=0)
+            scale = np.where(max_abs > 0, max_abs / 127, 1).astype(np.float32)
+            quantized[name + '_q'] = np.clip(np.round(value / scale), -127, 127).astype(np.int8)
+            quantized[name + '_scale'] = scale
+        return quantized
+
+    @staticmethod
+    def _dequantize(layer):
+        """
+        Float32 weights of a layer, replacing each int8 weight matrix and its scales with their product.
+        :param layer: the layer; as dictionary.
+        :return: dictionary.
+        """
+        dequantized = {}
+        for name, value in layer.items():
+            if name.endswith('_scale'):
+                continue
+            if name.endswith('_q'):
+                dequantized[name[:-2]] = value.astype(np.float32) * layer[name[:-2] + '_scale']
+            else:
+                dequantized[name] = value
+        return dequantized
+
+    @staticmethod
+    def _gather_sum(x, kernel):
+        """
+        Dense layer on the flattened one-hot encoding of a batch of squares, as sum of the kernel rows of the assigned
+        (cell, value) pairs.
+        :param x: the cell values (0 means empty); as numpy array of shape (batch_size, dim, dim) or (batch_size, dim,
+                  dim, 1).
+        :param kernel: the kernel; as numpy array of shape (dim**3, units).
+        :return: numpy array of float32 of shape (batch_size, units).
+        """
+        values = x.reshape(x.shape[0], -1).astype(np.int64)
+        dim = int(round(np.sqrt(values.shape[1])))
+        indexes = np.arange(dim ** 2) * dim + values - 1
+        rows = np.where(values[..., None] > 0, kernel[np.maximum(indexes, 0)], 0)
+        return np.sum(rows, axis=1, dtype=np.float32)
+
+    @staticmethod
+    def _factorized(x, layer):
+        """
+        Logits of the (cell, value) pairs of a FactorizedOutput layer.
+        :param x: the hidden features; as numpy array of shape (batch_size, units).
+        :param layer: the layer; as dictionary.
+        :return: numpy array of float32 of shape (batch_size, dim**3).
+        """
+        cell_logits = x @ layer['cell_kernel'] + layer['cell_bias']
+        query = x @ layer['query_kernel'] + layer['query_bias']
+        pairs = (query[:, None, :] * layer['cell_embeddings']) @ layer['value_embeddings'].T
+        return (cell_logits[:, :, None] + pairs + layer['value_bias']).reshape(x.shape[0], -1)
+
+    @staticmethod
+    def _conv2d(x, kernel):
+        """
+        2D convolution with stride 1 and 'valid' padding.
+        :param x: the inputs; as numpy array of shape (batch_size, height, width, in_channels).
+        :param kernel: the kernel; as numpy array of shape (kernel_height, kernel_width, in_channels, out_channels).
+        :return: numpy array of shape (batch_size, height - kernel_height + 1, width - kernel_width + 1,
+                 out_channels).
+        """
+        kernel_height, kernel_width = kernel.shape[:2]
+        out_height, out_width = x.shape[1] - kernel_height + 1, x.shape[2] - kernel_width + 1
+        # Sum of the contributions of each kernel offset (sliding_window_view requires NumPy 1.20)
+        out = 0
+        for i in range(kernel_height):
+            for j in range(kernel_width):
+                out = out + x[:, i:i + out_height, j:j + out_width, :] @ kernel[i, j]
+        return out
+
+    def __call__(self, x):
+        """
+        Compute the logits of a batch of inputs.
+        :param x: the inputs; as numpy array.
+        :return: numpy array of float32 of shape (batch_size, output_dim).
+        """
+        x = np.asarray(x, dtype=np.float32)
+        for layer in self.layers:
+            if layer['type'] == 'flatten':
+                x = x.reshape(x.shape[0], -1)
+                continue
+            if layer['type'] == 'factorized':
+                x = self._factorized(x, layer)
+                continue
+            if layer['type'] == 'dense':
+                x = x @ layer['kernel']
+            elif layer['type'] == 'sparse_dense':
+                x = self._gather_sum(x, layer['kernel'])
+            else:
+                x = self._conv2d(x, layer['kernel'])
+            x = ACTIVATIONS[layer['activation']](x + layer['bias'])
+        return x
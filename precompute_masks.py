@@ -0,0 +1,138 @@
+# Author: Mattia Silvestri
+
+"""
+    Precompute, for each partial solution of a dataset, the mask of the globally feasible next assignments.
+"""
+
+from utility import feasible_assignments_mask, get_feasibility_checker
+from functools import partial
+import numpy as np
+import pandas as pd
+import argparse
+import multiprocessing
+import os
+import time
+
+########################################################################################################################
+
+
+def masks_filename(dim, num_sol, mode):
+    """
+    Name of the file where the masks of a dataset are saved to; it is placed next to the dataset.
+    :param dim: problem dimension; as integer.
+    :param num_sol: number of solutions from which the dataset has been generated; as string.
+    :param mode: 'train' or 'test'; as string.
+    :return: string; the masks filename.
+    """
+    return "datasets/pls{}/feasible_masks_{}_{}.npy".format(dim, num_sol, mode)
+
+
+def unknown_filename(masks_file):
+    """
+    Name of the file where the number of assignments of unknown feasibility of each mask is saved to; it is placed
+    next to the masks.
+    :param masks_file: the masks filename; as string.
+    :return: string; the unknown counts filename.
+    """
+    return os.path.splitext(masks_file)[0] + "_unknown.npy"
+
+
+def load_unknown_counts(masks_file, num):
+    """
+    Number of assignments of unknown feasibility of the first masks of a file, because a solver call hit the time
+    limit. The files saved before the counts were introduced have no unknown assignment.
+    :param masks_file: the masks filename; as string.
+    :param num: number of masks; as integer.
+    :return: numpy array of integers of shape (num, ).
+    """
+    if not os.path.exists(unknown_filename(masks_file)):
+        return np.zeros(num, dtype=np.int64)
+    return np.load(unknown_filename(masks_file))[:num]
+
+########################################################################################################################
+
+
+def compute_packed_mask(square, time_limit=30.0, num_search_workers=1):
+    """
+    Bit-packed mask of the globally feasible next assignments of a partial solution.
+    :param square: partial solution; as numpy array of shape (dim, dim, dim).
+    :param time_limit: time limit of each solver call in seconds; as float.
+    :param num_search_workers: number of parallel search workers of the solver; as integer.
+    :return: tuple; numpy array of uint8 of shape (ceil(dim**3 / 8), ) and integer, the number of assignments whose
+             feasibility is unknown because a solver call hit the time limit.
+    """
+    checker = get_feasibility_checker(square.shape[0], time_limit, num_search_workers)
+    mask, unknown = feasible_assignments_mask(square, checker)
+    return np.packbits(mask), int(np.sum(unknown))
+
+########################################################################################################################
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--dim", type=int, required=True,
+                        help="Problem dimension")
+    parser.add_argument("--num-sol", type=str, default="10k",
+                        help="Number of solutions from which the dataset has been generated")
+    parser.add_argument("--mode", choices=["train", "test"], default="test",
+                        help="Dataset whose masks are computed")
+    parser.add_argument("--max-size", default=1000000, type=int,
+                        help="Maximum number of partial solutions to be loaded")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes")
+    parser.add_argument("--solver-time-limit", default=30.0, type=float,
+                        help="Time limit in seconds of each solver call")
+    parser.add_argument("--solver-workers", default=1, type=int,
+                        help="Number of parallel search workers of the solver")
+    parser.add_argument("--outfile", type=str, default=None,
+                        help="Path where the masks are saved to; by default they are saved next to the dataset")
+    parser.add_argument("--recompute-unknown", action="store_true", default=False,
+                        help="Only recompute the saved masks of the instances whose solver calls hit the time limit")
+
+    args = parser.parse_args()
+
+    features_filepath = "datasets/pls{}/partial_solutions_{}_{}.csv".format(args.dim, args.num_sol, args.mode)
+    print("Loading partial solutions from {}...".format(features_filepath))
+    X = pd.read_csv(features_filepath, sep=',', header=None, nrows=args.max_size, dtype=np.int8).values
+    squares = X.reshape(-1, args.dim, args.dim, args.dim)
+
+    outfile = args.outfile if args.outfile is not None else masks_filename(args.dim, args.num_sol, args.mode)
+    if not outfile.endswith(".npy"):
+        outfile += ".npy"
+
+    # Only the masks of the instances with unknown assignments are recomputed, if required
+    if args.recompute_unknown:
+        masks = np.load(outfile)
+        unknown = load_unknown_counts(outfile, len(masks))
+        if len(masks) != len(squares):
+            raise Exception("The masks do not match the dataset")
+        indexes = np.nonzero(unknown)[0]
+    else:
+        masks = np.zeros((len(squares), (args.dim ** 3 + 7) // 8), dtype=np.uint8)
+        unknown = np.zeros(len(squares), dtype=np.int64)
+        indexes = np.arange(len(squares))
+    print("Computing the masks of {} instances...".format(len(indexes)))
+
+    start = time.time()
+    compute_fn = partial(compute_packed_mask,
+                         time_limit=args.solver_time_limit,
+                         num_search_workers=args.solver_workers)
+    with multiprocessing.Pool(args.workers) as pool:
+        results = pool.imap(compute_fn, squares[indexes], chunksize=64)
+        for count, (idx, (packed_mask, num_unknown)) in enumerate(zip(indexes, results), 1):
+            masks[idx] = packed_mask
+            unknown[idx] = num_unknown
+            if count % 1000 == 0:
+                print("Examined {} instances in {} seconds".format(count, time.time() - start))
+
+    # The masks are saved with the number of unknown assignments of each instance, since they are used as ground
+    # truth: main.py refuses the masks with unknown assignments, which can be recomputed with --recompute-unknown
+    np.save(outfile, masks)
+    np.save(unknown_filename(outfile), unknown)
+    print("Saved {} masks to {} in {} seconds".format(len(masks), outfile, time.time() - start))
+    if np.any(unknown > 0):
+        print("{} assignments of {} instances (first: {}) hit the solver time limit; increase --solver-time-limit "
+              "and add --recompute-unknown".format(np.sum(unknown), np.count_nonzero(unknown),
+                                                   np.nonzero(unknown)[0][:10]))
+        exit(1)
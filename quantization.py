@@ -0,0 +1,134 @@
+# Author: Mattia Silvestri
+
+"""
+    Post-training quantization of the models saved by MyModel.train, to int8 NumPy weights or to TFLite, and a common
+    loader of the float and quantized models for the search heuristics and the evaluation.
+"""
+
+from numpy_models import NumpyModel
+import numpy as np
+import argparse
+import os
+
+########################################################################################################################
+
+# Supported quantization modes and the suffix of the exported files
+QUANTIZED_SUFFIXES = {
+    'int8': '_int8.npz',
+    'tflite': '.tflite',
+}
+
+########################################################################################################################
+
+
+def quantized_filename(model_dir, mode):
+    """
+    Name of the file where a quantized model is saved to; it is placed next to the SavedModel directory.
+    :param model_dir: the SavedModel directory; as string.
+    :param mode: 'int8' or 'tflite'; as string.
+    :return: string.
+    """
+    if mode not in QUANTIZED_SUFFIXES:
+        raise ValueError("Unknown quantization mode: {}".format(mode))
+    return model_dir.rstrip('/') + QUANTIZED_SUFFIXES[mode]
+
+########################################################################################################################
+
+
+def export_int8(model_dir, filename):
+    """
+    Quantize the kernels of a SavedModel to int8 with per-channel scales and save them as NumPy weights.
+    :param model_dir: the SavedModel directory; as string.
+    :param filename: path of the .npz file; as string.
+    :return: NumpyModel; the quantized model, as loaded from the saved file.
+    """
+    NumpyModel.from_keras(load_inference_model(model_dir)).save(filename, quantize=True)
+    return NumpyModel.load(filename)
+
+########################################################################################################################
+
+
+def export_tflite(model_dir, filename):
+    """
+    Convert a SavedModel to TFLite with dynamic range quantization, i.e. int8 weights and float32 activations.
+    :param model_dir: the SavedModel directory; as string.
+    :param filename: path of the .tflite file; as string.
+    :return:
+    """
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_saved_model(model_dir)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    with open(filename, 'wb') as file:
+        file.write(converter.convert())
+
+########################################################################################################################
+
+
+class TFLiteModel:
+    """
+    Callable wrapper of a TFLite interpreter; the input tensor is resized to the batch size of each call.
+    """
+    def __init__(self, filename):
+        """
+        :param filename: path of the .tflite file; as string.
+        """
+        import tensorflow as tf
+        self.interpreter = tf.lite.Interpreter(model_path=filename)
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.input_shape = None
+
+    def __call__(self, x):
+        """
+        Compute the logits of a batch of inputs.
+        :param x: the inputs; as numpy array.
+        :return: numpy array of float32 of shape (batch_size, output_dim).
+        """
+        x = np.asarray(x, dtype=np.float32)
+        if x.shape != self.input_shape:
+            self.interpreter.resize_tensor_input(self.input_index, x.shape)
+            self.interpreter.allocate_tensors()
+            self.input_shape = x.shape
+        self.interpreter.set_tensor(self.input_index, x)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index)
+
+########################################################################################################################
+
+
+def load_inference_model(path):
+    """
+    Load a model for inference according to its path: int8 NumPy weights (.npz), a TFLite model (.tflite) or else a
+    Keras SavedModel. All of them are callables returning the logits.
+    :param path: path of the model; as string.
+    :return: NumpyModel, TFLiteModel or tf.keras.Model.
+    """
+    if path.endswith('.npz'):
+        return NumpyModel.load(path)
+    if path.endswith('.tflite'):
+        return TFLiteModel(path)
+    import tensorflow as tf
+    from models import SparseOneHotDense, FactorizedOutput
+    return tf.keras.models.load_model(path, custom_objects={'SparseOneHotDense': SparseOneHotDense,
+                                                            'FactorizedOutput': FactorizedOutput})
+
+########################################################################################################################
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--test-num", type=str, nargs='+', required=True,
+                        help="Test identifiers of the saved models to be quantized.")
+    parser.add_argument("--modes", type=str, nargs='+', default=["int8", "tflite"], choices=list(QUANTIZED_SUFFIXES),
+                        help="Quantized formats to be exported.")
+    args = parser.parse_args()
+
+    for test_num in args.test_num:
+        model_dir = "models/test-{}/".format(test_num)
+        for mode in args.modes:
+            filename = quantized_filename(model_dir, mode)
+            if mode == "int8":
+                export_int8(model_dir, filename)
+            else:
+                export_tflite(model_dir, filename)
+            print("Saved {} ({:.1f} KB)".format(filename, os.path.getsize(filename) / 1024))
@@ -0,0 +1,150 @@
+# Author: Mattia Silvestri
+
+"""
+    Accuracy, feasibility and latency drift of the quantized models with respect to the float SavedModel they were
+    exported from.
+"""
+
+from utility import feasibility_multi, get_feasibility_checker, to_one_hot_squares, from_one_hot_to_2d
+from quantization import quantized_filename, load_inference_model
+import numpy as np
+import pandas as pd
+import argparse
+import csv
+import os
+import time
+
+########################################################################################################################
+
+
+def model_size(path):
+    """
+    Size on disk of a model file or of a SavedModel directory.
+    :param path: path of the model; as string.
+    :return: integer; the size in bytes.
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+########################################################################################################################
+
+
+def latency(model, x, repeats):
+    """
+    Mean time of a call of a model.
+    :param model: the model; as callable.
+    :param x: the inputs; as numpy array.
+    :param repeats: number of timed calls; as integer.
+    :return: float; milliseconds per call.
+    """
+    # The first call is not timed, since it may build or allocate the model
+    model(x)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model(x)
+    return 1000 * (time.perf_counter() - start) / repeats
+
+########################################################################################################################
+
+
+def drift_report(models, inputs, squares, correct_labels, checker, batch_size):
+    """
+    Compare the predictions of the models on the same examples; the first model is the reference float model.
+    :param models: the models; as list of callables returning the logits.
+    :param inputs: the inputs of the models; as numpy array.
+    :param squares: the partial assignments; as numpy array of shape (num_examples, dim, dim, dim).
+    :param correct_labels: the assigned variables indexes of the solutions; as numpy array of shape (num_examples, ).
+    :param checker: the solver of the feasibility checks; as PLSFeasibilityChecker.
+    :param batch_size: number of examples of each batch; as integer.
+    :return: dictionary of numpy arrays with one value for each model: 'accuracy', 'feasibility', 'agreement' (with
+             the reference model predictions) and 'max_logit_diff' (maximum absolute difference of the logits from the
+             reference model).
+    """
+    num_models = len(models)
+    correct = np.zeros(num_models, dtype=np.int64)
+    feasible = np.zeros(num_models, dtype=np.int64)
+    agreement = np.zeros(num_models, dtype=np.int64)
+    max_logit_diff = np.zeros(num_models)
+
+    for start in range(0, len(inputs), batch_size):
+        rows = slice(start, start + batch_size)
+        logits = np.stack([np.asarray(model(inputs[rows].astype(np.float32))).reshape(len(squares[rows]), -1)
+                           for model in models])
+        labels = np.argmax(logits, axis=2)
+        _, feas, _ = feasibility_multi(squares[rows], labels, checker)
+
+        correct += np.sum(labels == correct_labels[rows], axis=1)
+        feasible += np.sum(feas, axis=1)
+        agreement += np.sum(labels == labels[0], axis=1)
+        max_logit_diff = np.maximum(max_logit_diff, np.max(np.abs(logits - logits[0]), axis=(1, 2)))
+
+    return {'accuracy': correct / len(inputs),
+            'feasibility': feasible / len(inputs),
+            'agreement': agreement / len(inputs),
+            'max_logit_diff': max_logit_diff}
+
+########################################################################################################################
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dim", type=int, default=10,
+                        help="Problem dimension")
+    parser.add_argument("--test-num", type=str, required=True,
+                        help="Test identifier of the float model; the quantized models must have been exported with "
+                             + "quantization.py.")
+    parser.add_argument("--model", choices=["fnn", "cnn"], required=True,
+                        help="The model architecture, which determines the input encoding.")
+    parser.add_argument("--modes", type=str, nargs='+', default=["int8", "tflite"], choices=["int8", "tflite"],
+                        help="Quantized models to be compared with the float model.")
+    parser.add_argument("--num-sol", type=str, default="10k",
+                        help="Number of solutions from which the test set has been generated.")
+    parser.add_argument("--max-size", default=10000, type=int,
+                        help="Maximum number of test instances to be loaded.")
+    parser.add_argument("--batch-size", default=1024, type=int,
+                        help="Mini-batch size.")
+    parser.add_argument("--latency-repeats", default=200, type=int,
+                        help="Number of timed calls of the latency measures.")
+    parser.add_argument("--solver-time-limit", default=30.0, type=float,
+                        help="Time limit in seconds of each feasibility check.")
+    parser.add_argument("--solver-workers", default=1, type=int,
+                        help="Number of parallel search workers of the solver.")
+    parser.add_argument("--report-filename", type=str, default=None,
+                        help="Path of a CSV file where the report is saved to, one row for each model.")
+    args = parser.parse_args()
+
+    X = pd.read_csv("datasets/pls{}/partial_solutions_{}_test.csv".format(args.dim, args.num_sol), sep=',',
+                    header=None, nrows=args.max_size, dtype=np.int8).values
+    Y = pd.read_csv("datasets/pls{}/assignments_{}_test.csv".format(args.dim, args.num_sol), sep=',',
+                    header=None, nrows=args.max_size, dtype=np.int32).values
+    squares = to_one_hot_squares(X, args.dim)
+    correct_labels = np.argmax(Y.reshape(len(Y), -1), axis=1)
+    if args.model == 'cnn':
+        X = np.expand_dims(from_one_hot_to_2d(flattened_array=X), axis=-1)
+
+    model_dir = "models/test-{}/".format(args.test_num)
+    names = ["float"] + args.modes
+    paths = [model_dir] + [quantized_filename(model_dir, mode) for mode in args.modes]
+    models = [load_inference_model(path) for path in paths]
+
+    report = drift_report(models, X, squares, correct_labels,
+                          get_feasibility_checker(args.dim, args.solver_time_limit, args.solver_workers),
+                          args.batch_size)
+    report['ms_per_call_single'] = [latency(model, X[:1].astype(np.float32), args.latency_repeats)
+                                    for model in models]
+    report['ms_per_call_batch'] = [latency(model, X[:args.batch_size].astype(np.float32),
+                                           max(1, args.latency_repeats // 10))
+                                   for model in models]
+    report['size_kb'] = [model_size(path) / 1024 for path in paths]
+
+    columns = list(report)
+    for idx, name in enumerate(names):
+        print("{}: {}".format(name, " | ".join("{}: {:.4g}".format(col, report[col][idx]) for col in columns)))
+
+    if args.report_filename is not None:
+        with open(args.report_filename, "w") as file:
+            wr = csv.writer(file)
+            wr.writerow(["model"] + columns)
+            for idx, name in enumerate(names):
+                wr.writerow([name] + [report[col][idx] for col in columns])
@@ -0,0 +1,92 @@
+# Author: Mattia Silvestri
+
+"""
+    Tests of the checkpointed evaluation state.
+"""
+
+from evaluation import COUNTERS, EvaluationState, shard_range
+import numpy as np
+
+########################################################################################################################
+
+
+def random_results(num, dim, rng):
+    """
+    Random results of the evaluation of some examples.
+    :param num: number of examples; as integer.
+    :param dim: PLS dimension; as integer.
+    :param rng: numpy.random.Generator.
+    :return: tuple of numpy arrays; number of assigned variables, correct and feasible predictions, correct and
+             feasible random assignments.
+    """
+    return (rng.integers(0, dim ** 2, size=num),) + tuple(rng.random((4, num)) < 0.5)
+
+
+def evaluate(state, results, batch_size):
+    """
+    Update a state with the results of its range of examples, one batch at a time.
+    :param state: the state; as EvaluationState.
+    :param results: the results of all the examples; as returned by random_results.
+    :param batch_size: number of examples of each batch; as integer.
+    :return:
+    """
+    for start in range(state.watermark, state.end, batch_size):
+        end = min(start + batch_size, state.end)
+        state.update(end, *(values[start:end] for values in results))
+
+########################################################################################################################
+
+
+def assert_same_state(state, expected):
+    assert (state.dim, state.start, state.end, state.watermark) == \
+           (expected.dim, expected.start, expected.end, expected.watermark)
+    assert (state.acc, state.acc_rand) == (expected.acc, expected.acc_rand)
+    for name in COUNTERS:
+        assert state.counters[name].tolist() == expected.counters[name].tolist()
+
+
+def test_update():
+    dim, num = 5, 200
+    results = random_results(num, dim, np.random.default_rng(0))
+    state = EvaluationState(dim, 0, num)
+    evaluate(state, results, 32)
+
+    num_assigned_vars, correct, feas, rand_correct, rand_feas = results
+    assert state.count == num
+    assert state.acc == correct.sum() and state.acc_rand == rand_correct.sum()
+    for name, selected in (("pred", correct), ("feas", feas), ("rand_pred", rand_correct), ("rand_feas", rand_feas),
+                           ("tot", np.ones(num, dtype=bool))):
+        expected = [np.sum(selected & (num_assigned_vars == count)) for count in range(dim ** 2)]
+        assert state.counters[name].tolist() == expected
+
+
+def test_save_load_resume(tmp_path):
+    dim, num = 5, 200
+    results = random_results(num, dim, np.random.default_rng(1))
+    expected = EvaluationState(dim, 0, num)
+    evaluate(expected, results, 32)
+
+    # Interrupt the evaluation after some batches and resume it from the saved state
+    filename = str(tmp_path / "state.npz")
+    state = EvaluationState(dim, 0, num)
+    state.update(64, *(values[:64] for values in results))
+    state.save(filename)
+    loaded = EvaluationState.load(filename)
+    assert_same_state(loaded, state)
+
+    evaluate(loaded, results, 32)
+    assert_same_state(loaded, expected)
+
+
+def test_merge():
+    dim, num, num_shards = 5, 203, 3
+    results = random_results(num, dim, np.random.default_rng(2))
+    expected = EvaluationState(dim, 0, num)
+    evaluate(expected, results, 32)
+
+    states = []
+    for shard_index in range(num_shards):
+        state = EvaluationState(dim, *shard_range(num, shard_index, num_shards))
+        evaluate(state, results, 32)
+        states.append(state)
+    assert_same_state(EvaluationState.merge(states), expected)
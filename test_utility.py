@@ -0,0 +1,180 @@
+# Author: Mattia Silvestri
+
+"""
+    Tests of the feasibility checks, against brute force on small PLS instances.
+"""
+
+from utility import TieredFeasibilityChecker, _perfect_matching, feasible_assignments_mask, local_feasibility_batch
+import itertools
+import numpy as np
+import pytest
+
+########################################################################################################################
+
+
+def brute_force_completion(square):
+    """
+    Complete a partial assignment by exhaustive search.
+    :param square: numpy array of shape (dim, dim) with decimal assigned values (0 means empty).
+    :return: numpy array of shape (dim, dim) with a completion, or None if there is none.
+    """
+    square = np.array(square)
+    dim = square.shape[0]
+    for row in range(dim):
+        for col in range(dim):
+            values = square[row][square[row] > 0]
+            if len(set(values)) != len(values):
+                return None
+            values = square[:, col][square[:, col] > 0]
+            if len(set(values)) != len(values):
+                return None
+
+    empty = np.argwhere(square == 0)
+    if len(empty) == 0:
+        return square
+    row, col = empty[0]
+    for val in range(1, dim + 1):
+        if val not in square[row] and val not in square[:, col]:
+            square[row, col] = val
+            completion = brute_force_completion(square)
+            if completion is not None:
+                return completion
+    square[row, col] = 0
+    return None
+
+########################################################################################################################
+
+
+class BruteForceChecker:
+    """
+    Exact checker with the interface of PLSFeasibilityChecker; if timeout is True, each call hits the time limit.
+    """
+    def __init__(self, dim, timeout=False):
+        self.dim = dim
+        self.timeout = timeout
+        self.num_timeouts = 0
+
+    def find_solution(self, square):
+        if self.timeout:
+            self.num_timeouts += 1
+            return None
+        completion = brute_force_completion(np.asarray(square).reshape(self.dim, self.dim))
+        return None if completion is None else completion.reshape(-1).tolist()
+
+    def solve(self, square):
+        return self.find_solution(square) is not None
+
+    def solve_batch(self, squares):
+        return np.array([self.solve(square) for square in squares], dtype=bool)
+
+########################################################################################################################
+
+
+def random_partial_squares(dim, num, rng):
+    """
+    Random partial assignments which are consistent by rows and columns; some of them cannot be completed.
+    :param dim: PLS dimension; as integer.
+    :param num: number of partial assignments; as integer.
+    :param rng: numpy.random.Generator.
+    :return: numpy array of shape (num, dim, dim) with decimal assigned values (0 means empty).
+    """
+    squares = np.zeros((num, dim, dim), dtype=np.int64)
+    for square in squares:
+        for _ in range(rng.integers(0, dim ** 2)):
+            row, col, val = rng.integers(0, dim, size=3)
+            if square[row, col] == 0 and val + 1 not in square[row] and val + 1 not in square[:, col]:
+                square[row, col] = val + 1
+    return squares
+
+
+def to_one_hot(squares, dim):
+    """
+    One-hot encoding of decimal partial assignments.
+    :param squares: numpy array of shape (batch_size, dim, dim) with decimal assigned values (0 means empty).
+    :param dim: PLS dimension; as integer.
+    :return: numpy array of int8 of shape (batch_size, dim, dim, dim).
+    """
+    return (squares[..., None] == np.arange(1, dim + 1)).astype(np.int8)
+
+########################################################################################################################
+
+
+def test_perfect_matching():
+    rng = np.random.default_rng(0)
+    for _ in range(300):
+        num_left, num_right = int(rng.integers(1, 6)), int(rng.integers(1, 6))
+        adj = rng.random((num_left, num_right)) < rng.random()
+        expected = any(all(adj[left, right] for left, right in enumerate(rights))
+                       for rights in itertools.permutations(range(num_right), num_left))
+        for matching in (_perfect_matching(adj), _perfect_matching(adj, rng)):
+            assert (matching is not None) == expected
+            if matching is not None:
+                assert len(set(matching)) == num_left
+                assert all(adj[left, right] for left, right in enumerate(matching))
+
+########################################################################################################################
+
+
+def test_local_feasibility_batch():
+    dim = 4
+    rng = np.random.default_rng(1)
+    squares = to_one_hot(random_partial_squares(dim, 300, rng), dim)
+    # Some partial assignments are not consistent
+    squares[::10, 0, 0, :2] = 1
+    assignments = rng.integers(0, dim ** 3, size=len(squares))
+
+    expected = []
+    for square, assignment in zip(squares, assignments):
+        row, col, val = np.unravel_index(assignment, (dim, dim, dim))
+        consistent = square.sum(axis=2).max() <= 1 and square.sum(axis=1).max() <= 1 and \
+            square.sum(axis=0).max() <= 1
+        expected.append(consistent and square[row, col].sum() == 0 and square[row, :, val].sum() == 0 and
+                        square[:, col, val].sum() == 0)
+
+    assert local_feasibility_batch(squares, assignments).tolist() == expected
+
+########################################################################################################################
+
+
+@pytest.mark.parametrize("dim", [3, 4, 5])
+def test_tiered_feasibility_checker(dim):
+    rng = np.random.default_rng(dim)
+    squares = random_partial_squares(dim, 200, rng)
+    checker = TieredFeasibilityChecker(dim, checker=BruteForceChecker(dim), seed=dim)
+
+    expected = [brute_force_completion(square) is not None for square in squares]
+    assert checker.solve_batch(squares.reshape(len(squares), -1)).tolist() == expected
+    assert checker.num_queries == len(squares)
+    assert [checker.solve(square) for square in squares] == expected
+
+########################################################################################################################
+
+
+@pytest.mark.parametrize("dim", [3, 4])
+def test_feasible_assignments_mask(dim):
+    rng = np.random.default_rng(dim)
+    for square in random_partial_squares(dim, 30, rng):
+        mask, unknown = feasible_assignments_mask(to_one_hot(square[None], dim)[0], BruteForceChecker(dim))
+
+        expected = np.zeros(dim ** 3, dtype=bool)
+        for row, col, val in itertools.product(range(dim), repeat=3):
+            if square[row, col] == 0:
+                assigned = square.copy()
+                assigned[row, col] = val + 1
+                expected[(row * dim + col) * dim + val] = brute_force_completion(assigned) is not None
+        assert mask.tolist() == expected.tolist()
+        assert not unknown.any()
+
+
+def test_feasible_assignments_mask_timeouts():
+    dim = 4
+    square = np.zeros((dim, dim), dtype=np.int64)
+    square[0, 0] = 1
+    mask, unknown = feasible_assignments_mask(to_one_hot(square[None], dim)[0], BruteForceChecker(dim, timeout=True))
+
+    # The assignments allowed by the forward checking are unknown, none of them is marked as feasible
+    one_hot = to_one_hot(square[None], dim)[0]
+    allowed = (square[..., None] == 0) & (one_hot.sum(axis=1, keepdims=True) == 0) & \
+        (one_hot.sum(axis=0, keepdims=True) == 0)
+    assert not mask.any()
+    assert unknown.tolist() == allowed.reshape(-1).tolist()
@@ -126,21 +126,30 @@ class PLSInstance:
         :return:
         """
 
-        for i in range(self.n):
-            for j in range(self.n):
-                # Find assigned value to current variable
-                assigned_val = np.argwhere(self.square[i, j] == 1)
-                assigned_val = assigned_val.reshape(-1)
-                # Check if a variable is assigned
-                if len(assigned_val) != 0:
-                    # Current variable is already assigned -> domain is empty
-                    self.domains[i, j] = np.ones(shape=(self.n,))
-                    # Remove assigned value to same row and column variables domains
-                    for id_cols in range(self.n):
-                        self.domains[i, id_cols, assigned_val] = 1
-                    if self.remove_columns_domains:
-                        for id_row in range(self.n):
-                            self.domains[id_row, j, assigned_val] = 1
+        domains = self.propagation_domains()
+        if self.remove_columns_domains:
+            self.domains = domains['full']
+        else:
+            self.domains = domains['rows']
+
+    def propagation_domains(self):
+        """
+        Compute the variables domains with forward checking both when only the rows constraints are propagated and
+        when all the constraints are propagated. The rows-only domains are a by-product of the full propagation.
+        :return: dictionary with 'rows' and 'full' keys; each value is a numpy array of shape (n, n, n) where 1 means
+                 removed from the domain.
+        """
+
+        # Assigned variables have an empty domain
+        assigned_vars = np.sum(self.square, axis=2, keepdims=True) > 0
+        # Values already assigned in each row (shape (n, 1, n)) and in each column (shape (1, n, n))
+        rows_values = np.sum(self.square, axis=1, keepdims=True) > 0
+        cols_values = np.sum(self.square, axis=0, keepdims=True) > 0
+
+        rows_domains = assigned_vars | rows_values
+        full_domains = rows_domains | cols_values
+
+        return {'rows': rows_domains.astype(np.int8), 'full': full_domains.astype(np.int8)}
 
     def assign(self, cell_x, cell_y, num):
         """
@@ -238,7 +247,367 @@ class PLSSolver:
         # solve the model
         status = solver.Solve(self.model)
 
-        return status == cp_model.FEASIBLE
+        return status in (cp_model.FEASIBLE, cp_model.OPTIMAL)
+
+    def find_solution(self):
+        """
+        Find a feasible solution and return it.
+        :return: list of integers with the decimal values of the solution (by rows) if a feasible solution was found,
+                 None otherwise.
+        """
+        # create the solver
+        solver = cp_model.CpSolver()
+        # set time limit to 30 seconds
+        solver.parameters.max_time_in_seconds = 30.0
+
+        # solve the model
+        status = solver.Solve(self.model)
+
+        if status not in (cp_model.FEASIBLE, cp_model.OPTIMAL):
+            return None
+
+        return [solver.Value(var) for var in self.vars]
+
+########################################################################################################################
+
+
+def _clear_repeated(field):
+    """
+    Remove all the elements of a repeated field of an or-tools proto: the python protobuf containers of older or-tools
+    versions support slice deletion, the C++ wrappers of the newer versions have a clear method.
+    :param field: the repeated field.
+    :return:
+    """
+    if hasattr(field, 'clear'):
+        field.clear()
+    else:
+        del field[:]
+
+########################################################################################################################
+
+
+class PLSFeasibilityChecker:
+    """
+    Persistent PLS solver: the model with the variables and the all different constraints is built once, and each
+    query only updates the domains of the variables (fixing the pre-assigned ones) in the model proto. The last found
+    solution can be given to the solver as hint, with the versions of or-tools that support solution hints.
+    """
+    def __init__(self, board_size, time_limit=30.0, num_search_workers=1, use_hints=False):
+        """
+        :param board_size: PLS dimension; as integer.
+        :param time_limit: time limit of each query in seconds; queries over the limit are counted as infeasible;
+                           as float.
+        :param num_search_workers: number of parallel search workers of the solver; as integer.
+        :param use_hints: True if the last found solution is given to the solver as hint; ignored if the or-tools
+                          version does not support solution hints. Disabled by default, since or-tools 9.15 crashes
+                          on hinted models with presolve and a single search worker; as boolean.
+        """
+        self.board_size = board_size
+
+        # Create the model skeleton
+        self.model = cp_model.CpModel()
+        # The hints are written directly in the model proto: older or-tools versions (e.g. 6.10) have neither the
+        # solution_hint field nor the AddHint method
+        self.use_hints = use_hints and hasattr(self.model.Proto(), 'solution_hint')
+        self.vars = [self.model.NewIntVar(1, board_size, 'x%i' % i) for i in range(board_size ** 2)]
+
+        # All numbers in the same row must be different.
+        for i in range(0, board_size ** 2, board_size):
+            self.model.AddAllDifferent(self.vars[i:i+board_size])
+
+        # all numbers in the same column must be different
+        for j in range(0, board_size):
+            self.model.AddAllDifferent(self.vars[j::board_size])
+
+        self._var_protos = [self.model.Proto().variables[var.Index()] for var in self.vars]
+        self._domains = np.zeros(board_size ** 2, dtype=np.int64)
+        self._hint = None
+
+        # Create the solver
+        self.solver = cp_model.CpSolver()
+        self.solver.parameters.max_time_in_seconds = time_limit
+        self.solver.parameters.num_search_workers = num_search_workers
+
+        # Count of queries and of queries over the time limit
+        self.num_queries = 0
+        self.num_timeouts = 0
+
+    def _set_square(self, square):
+        """
+        Fix the pre-assigned variables and free the others; only the changed domains are updated.
+        :param square: numpy array with decimal assigned values (0 means empty).
+        :return:
+        """
+        square = np.asarray(square, dtype=np.int64)
+        for i in np.nonzero(square != self._domains)[0]:
+            domain = self._var_protos[i].domain
+            _clear_repeated(domain)
+            if square[i] > 0:
+                domain.extend([square[i], square[i]])
+            else:
+                domain.extend([1, self.board_size])
+        self._domains = square.copy()
+
+        if self.use_hints and self._hint is not None:
+            hint = self.model.Proto().solution_hint
+            _clear_repeated(hint.vars)
+            _clear_repeated(hint.values)
+            # The hint must be consistent with the pre-assigned variables (an inconsistent hint can crash some
+            # or-tools versions): the last solution is a Latin Square, so only the free variables whose hinted value
+            # is not pre-assigned in their row or column are hinted
+            square_2d = square.reshape(self.board_size, self.board_size)
+            values = np.asarray(self._hint).reshape(self.board_size, self.board_size)
+            in_rows = (square_2d[:, :, None] == values[:, None, :]).any(axis=1)
+            in_columns = (square_2d[:, None, :] == values[None, :, :]).any(axis=0)
+            hinted = np.nonzero((square == 0) & ~(in_rows | in_columns).reshape(-1))[0]
+            hint.vars.extend(self.vars[i].Index() for i in hinted)
+            hint.values.extend(int(self._hint[i]) for i in hinted)
+
+    def find_solution(self, square):
+        """
+        Find a feasible solution of a partial assignment.
+        :param square: numpy array with decimal assigned values (0 means empty).
+        :return: list of integers with the decimal values of the solution (by rows) if a feasible solution was found,
+                 None otherwise.
+        """
+        self._set_square(square)
+        status = self.solver.Solve(self.model)
+        self.num_queries += 1
+
+        if status == cp_model.UNKNOWN:
+            self.num_timeouts += 1
+        if status not in (cp_model.FEASIBLE, cp_model.OPTIMAL):
+            return None
+
+        solution = [self.solver.Value(var) for var in self.vars]
+        self._hint = solution
+        return solution
+
+    def solve(self, square):
+        """
+        Check if a partial assignment can be completed to a solution.
+        :param square: numpy array with decimal assigned values (0 means empty).
+        :return: True if a feasible solution was found, False otherwise.
+        """
+        return self.find_solution(square) is not None
+
+    def solve_batch(self, squares):
+        """
+        Check if each partial assignment of a batch can be completed to a solution.
+        :param squares: numpy array of shape (batch_size, board_size**2) with decimal assigned values (0 means empty).
+        :return: numpy array of booleans of shape (batch_size, ).
+        """
+        return np.array([self.solve(square) for square in squares], dtype=bool)
+
+########################################################################################################################
+
+# Persistent feasibility checkers of this process, by problem dimension and solver parameters
+_checkers = dict()
+
+
+def get_feasibility_checker(board_size, time_limit=30.0, num_search_workers=1):
+    """
+    Return the persistent feasibility checker of this process for the given dimension and solver parameters; it is
+    created at the first call.
+    :param board_size: PLS dimension; as integer.
+    :param time_limit: time limit of each query in seconds; as float.
+    :param num_search_workers: number of parallel search workers of the solver; as integer.
+    :return: PLSFeasibilityChecker.
+    """
+    key = (board_size, time_limit, num_search_workers)
+    if key not in _checkers:
+        _checkers[key] = PLSFeasibilityChecker(board_size, time_limit, num_search_workers)
+    return _checkers[key]
+
+########################################################################################################################
+
+
+def _perfect_matching(adj, rng=None):
+    """
+    Find a matching of a bipartite graph which covers all the left nodes, with augmenting paths.
+    :param adj: adjacency matrix, left nodes by rows; as numpy array of booleans of shape (num_left, num_right).
+    :param rng: if not None, the nodes and the edges are visited in random order; as numpy.random.Generator.
+    :return: list with the right node matched to each left node, or None if there is no such matching.
+    """
+    num_left, num_right = adj.shape
+    neighbours = [np.nonzero(adj[left])[0].tolist() for left in range(num_left)]
+    left_order = list(range(num_left))
+    if rng is not None:
+        for nbrs in neighbours:
+            rng.shuffle(nbrs)
+        rng.shuffle(left_order)
+    match_right = [-1] * num_right
+
+    def augment(left, seen):
+        for right in neighbours[left]:
+            if not seen[right]:
+                seen[right] = True
+                if match_right[right] < 0 or augment(match_right[right], seen):
+                    match_right[right] = left
+                    return True
+        return False
+
+    for left in left_order:
+        if not augment(left, [False] * num_right):
+            return None
+
+    match_left = [-1] * num_left
+    for right, left in enumerate(match_right):
+        if left >= 0:
+            match_left[left] = right
+    return match_left
+
+########################################################################################################################
+
+
+class TieredFeasibilityChecker:
+    """
+    Feasibility checks in tiers of increasing cost: only the partial assignments which are not decided by a tier are
+    passed to the next one.
+    1. Vectorized necessary conditions on the whole batch: no repeated values, no empty domain of an empty cell and
+       each missing value of a row (column) has an allowed cell in the row (column).
+    2. Necessary matching conditions: the empty cells and the missing values of each row (column) have a perfect
+       matching (Hall's condition).
+    3. A bounded number of randomized greedy completions, filling one row at a time with a random perfect matching;
+       a completion proves feasibility.
+    4. The exact solver.
+    """
+    TIERS = ['necessary', 'matching', 'greedy', 'solver']
+
+    def __init__(self, board_size, checker=None, greedy_attempts=4, seed=0):
+        """
+        :param board_size: PLS dimension; as integer.
+        :param checker: the exact solver; if None, the persistent checker with the default parameters is used; as
+                        PLSFeasibilityChecker.
+        :param greedy_attempts: number of randomized greedy completions attempted before calling the solver; as
+                                integer.
+        :param seed: seed of the randomized greedy completions; as integer.
+        """
+        self.board_size = board_size
+        self.checker = checker if checker is not None else get_feasibility_checker(board_size)
+        self.greedy_attempts = greedy_attempts
+        self.rng = np.random.default_rng(seed)
+        # Count of queries resolved by each tier
+        self.resolved = {tier: 0 for tier in self.TIERS}
+
+    @property
+    def num_queries(self):
+        return sum(self.resolved.values())
+
+    @property
+    def num_timeouts(self):
+        return self.checker.num_timeouts
+
+    def _necessary_conditions(self, squares):
+        """
+        Vectorized necessary conditions.
+        :param squares: numpy array of shape (batch_size, board_size, board_size) with decimal assigned values.
+        :return: tuple of two numpy arrays of booleans of shape (batch_size, ), infeasible and complete (i.e. feasible)
+                 partial assignments, and a numpy array of booleans of shape (batch_size, board_size, board_size,
+                 board_size) with the allowed values of each cell.
+        """
+        one_hot = squares[..., None] == np.arange(1, self.board_size + 1)
+        rows_count = one_hot.sum(axis=2)
+        cols_count = one_hot.sum(axis=1)
+        empty = squares == 0
+
+        consistent = (rows_count <= 1).all(axis=(1, 2)) & (cols_count <= 1).all(axis=(1, 2))
+        # Values allowed in each empty cell by the forward checking
+        allowed = empty[..., None] & (rows_count == 0)[:, :, None, :] & (cols_count == 0)[:, None, :, :]
+
+        cells_ok = (~empty | allowed.any(axis=3)).all(axis=(1, 2))
+        rows_ok = ((rows_count > 0) | allowed.any(axis=2)).all(axis=(1, 2))
+        cols_ok = ((cols_count > 0) | allowed.any(axis=1)).all(axis=(1, 2))
+
+        infeasible = ~(consistent & cells_ok & rows_ok & cols_ok)
+        complete = ~infeasible & ~empty.any(axis=(1, 2))
+        return infeasible, complete, allowed
+
+    def _matching_conditions(self, square, allowed):
+        """
+        Necessary matching conditions for each row and column.
+        :param square: numpy array of shape (board_size, board_size) with decimal assigned values.
+        :param allowed: allowed values of each cell; as numpy array of booleans of shape (board_size, board_size,
+                        board_size).
+        :return: True if the conditions are satisfied, False otherwise.
+        """
+        empty = square == 0
+        for idx in range(self.board_size):
+            # Empty cells of the row and of the column and their allowed values
+            for line_empty, line_allowed in ((empty[idx], allowed[idx]), (empty[:, idx], allowed[:, idx])):
+                cells = np.nonzero(line_empty)[0]
+                if len(cells) == 0:
+                    continue
+                adj = line_allowed[cells]
+                values = np.nonzero(adj.any(axis=0))[0]
+                if len(values) < len(cells) or _perfect_matching(adj[:, values]) is None:
+                    return False
+        return True
+
+    def _greedy_completion(self, square):
+        """
+        Randomized greedy completion, one row at a time.
+        :param square: numpy array of shape (board_size, board_size) with decimal assigned values.
+        :return: True if a completion was found, False otherwise.
+        """
+        n = self.board_size
+        for _ in range(self.greedy_attempts):
+            cols_values = np.zeros((n, n), dtype=bool)
+            assigned = np.nonzero(square)
+            cols_values[assigned[1], square[assigned] - 1] = True
+            completed = True
+
+            for row in self.rng.permutation(n):
+                cells = np.nonzero(square[row] == 0)[0]
+                if len(cells) == 0:
+                    continue
+                values = np.setdiff1d(np.arange(n), square[row][square[row] > 0] - 1)
+                matching = _perfect_matching(~cols_values[cells][:, values], self.rng)
+                if matching is None:
+                    completed = False
+                    break
+                cols_values[cells, values[matching]] = True
+
+            if completed:
+                return True
+        return False
+
+    def solve_batch(self, squares):
+        """
+        Check if each partial assignment of a batch can be completed to a solution.
+        :param squares: numpy array of shape (batch_size, board_size**2) with decimal assigned values (0 means empty).
+        :return: numpy array of booleans of shape (batch_size, ).
+        """
+        squares = np.asarray(squares, dtype=np.int64).reshape(-1, self.board_size, self.board_size)
+        infeasible, feas, allowed = self._necessary_conditions(squares)
+        self.resolved['necessary'] += int(np.sum(infeasible | feas))
+
+        for idx in np.nonzero(~infeasible & ~feas)[0]:
+            if not self._matching_conditions(squares[idx], allowed[idx]):
+                self.resolved['matching'] += 1
+            elif self._greedy_completion(squares[idx]):
+                self.resolved['greedy'] += 1
+                feas[idx] = True
+            else:
+                self.resolved['solver'] += 1
+                feas[idx] = self.checker.solve(squares[idx].reshape(-1))
+
+        return feas
+
+    def solve(self, square):
+        """
+        Check if a partial assignment can be completed to a solution.
+        :param square: numpy array with decimal assigned values (0 means empty).
+        :return: True if a feasible solution was found, False otherwise.
+        """
+        return bool(self.solve_batch(np.asarray(square).reshape(1, -1))[0])
+
+    def report(self):
+        """
+        Number of queries resolved by each tier.
+        :return: string.
+        """
+        return " | ".join("{}: {}".format(tier, self.resolved[tier]) for tier in self.TIERS)
 
 
 ########################################################################################################################
@@ -263,7 +632,10 @@ def load_dataset(filename,
                  domains_filename=None,
                  save_partial_solutions=False,
                  partial_sols_filename=None,
-                 assignments_filename=None):
+                 assignments_filename=None,
+                 start_offset=0,
+                 end_offset=None,
+                 domains_filenames=None):
     """
     Load solutions from a txt file in the PLS instance. It converts the legacy file format to the simpler CSV one,
     if save partial solution is specified.
@@ -277,20 +649,36 @@ def load_dataset(filename,
     :param save_partial_solutions: True if you want to save partial solutions in a CSV file; as boolean.
     :param partial_sols_filename: filename for partial solutions; as string.
     :param assignments_filename: filename for the assignments file; as string.
+    :param start_offset: byte offset of the first line to be loaded; as integer.
+    :param end_offset: lines starting at or after this byte offset are not loaded; None to read until the end of file;
+                       as integer.
+    :param domains_filenames: filenames for the variables domains of several propagation types ('rows' and/or 'full')
+                              computed in a single pass; as dictionary. If specified, save_domains and
+                              domains_filename are ignored.
     :return: input instances and labels; as numpy array.
     """
 
     assert mode in ["onehot", "string"], "Unsupported mode"
 
+    # The legacy single domains file is saved with the propagation type of the problem instance
+    if domains_filenames is None:
+        domains_filenames = {}
+        if save_domains:
+            domains_type = 'full' if problem.remove_columns_domains else 'rows'
+            domains_filenames[domains_type] = domains_filename
+    assert all(t in ['rows', 'full'] for t in domains_filenames.keys()), "Unsupported domains type"
+    save_domains = len(domains_filenames) > 0
+
     X = []
     Y = []
 
-    with open(filename, mode="r") as file:
-        domains_file = None
+    # NOTE: the file is read in binary mode so that byte offsets (see split_file_by_lines) can be used to seek
+    with open(filename, mode="rb") as file:
+        file.seek(start_offset)
 
-        if save_domains:
-            domains_file = open(domains_filename, "w", newline='')
-            csv_writer = csv.writer(domains_file, delimiter=',')
+        # One domains file for each propagation type
+        domains_files = {t: open(f, "w", newline='') for t, f in domains_filenames.items()}
+        csv_writers = {t: csv.writer(f, delimiter=',') for t, f in domains_files.items()}
 
         if save_partial_solutions:
             partial_sols_file = open(partial_sols_filename, "w")
@@ -306,8 +694,11 @@ def load_dataset(filename,
         # Each line is the partial assignment and the successive assignment separated by "-" character
         while True and count < max_size:
 
-            line = file.readline()
-            if line is None or line is "":
+            if end_offset is not None and file.tell() >= end_offset:
+                break
+
+            line = file.readline().decode()
+            if line is None or line == "":
                 break
 
             solutions = line.split("-")
@@ -334,7 +725,7 @@ def load_dataset(filename,
                     # Check feasibility of loaded solutions
                     reshaped_assign = np.reshape(assignment, (dim, dim, dim))
                     if not label:
-                        feasible = tmp_problem.set_square(reshaped_assign.copy(), not label and save_domains)
+                        feasible = tmp_problem.set_square(reshaped_assign.copy())
                         assert feasible, "Solution is not feasible"
 
                 if not label:
@@ -342,7 +733,9 @@ def load_dataset(filename,
                         X.append(assignment.copy())
 
                         if save_domains:
-                            csv_writer.writerow(tmp_problem.domains.reshape(-1))
+                            domains = tmp_problem.propagation_domains()
+                            for domains_type, csv_writer in csv_writers.items():
+                                csv_writer.writerow(domains[domains_type].reshape(-1))
                         if save_partial_solutions:
                             csv_writer_sols.writerow(assignment.reshape(-1))
                     else:
@@ -367,10 +760,11 @@ def load_dataset(filename,
 
         file.close()
 
-        if save_domains:
+        for domains_file in domains_files.values():
             domains_file.close()
         if save_partial_solutions:
             partial_sols_file.close()
+            assignments_file.close()
 
         # Check assignment is feasible
         if mode == "onehot":
@@ -394,6 +788,32 @@ def load_dataset(filename,
 ########################################################################################################################
 
 
+def split_file_by_lines(filename, num_chunks):
+    """
+    Split a text file in byte ranges of approximately the same size whose boundaries fall at the beginning of a line.
+    :param filename: name of the file; as string.
+    :param num_chunks: number of byte ranges; as integer.
+    :return: list of (start, end) byte offsets; as list of tuples of integers.
+    """
+
+    with open(filename, mode="rb") as file:
+        file.seek(0, 2)
+        file_size = file.tell()
+
+        # Move each approximate boundary forward to the beginning of the next line
+        boundaries = [0]
+        for i in range(1, num_chunks):
+            file.seek(max(file_size * i // num_chunks - 1, boundaries[-1]))
+            file.readline()
+            boundaries.append(min(file.tell(), file_size))
+        boundaries.append(file_size)
+
+    # Empty ranges are discarded
+    return [(start, end) for start, end in zip(boundaries[:-1], boundaries[1:]) if end > start]
+
+########################################################################################################################
+
+
 def random_assigner(dim, domains):
     """
     Return a random assignment
@@ -411,6 +831,241 @@ def random_assigner(dim, domains):
 ########################################################################################################################
 
 
+def random_assigner_batch(dim, domains=None, batch_size=None, rng=None):
+    """
+    Return a random assignment for each example of a batch, sampled uniformly among the allowed ones with the
+    Gumbel-max trick over masked uniform noise.
+    :param dim: one-hot encoding dimension of the assignment problem; as integer.
+    :param domains: variables' domains coming from forward checking, where 1 means removed from the domain; as numpy
+                    array of shape (batch_size, dim). If None, all the assignments are allowed.
+    :param batch_size: number of examples; required only if domains is None; as integer.
+    :param rng: random numbers generator; as numpy.random.Generator. If None, a generator with seed 0 is used.
+    :return: numpy array of shape (batch_size, ) with the assigned variables indexes.
+    """
+    if rng is None:
+        rng = np.random.default_rng(0)
+
+    if domains is None:
+        return rng.integers(0, dim, size=batch_size)
+
+    domains = np.asarray(domains).reshape(-1, dim)
+    allowed = domains == 0
+    # Examples with no allowed assignment fall back to a uniform choice among all the assignments
+    allowed[~allowed.any(axis=1)] = True
+    noise = np.where(allowed, rng.gumbel(size=allowed.shape), -np.inf)
+
+    return np.argmax(noise, axis=1)
+
+########################################################################################################################
+
+
+def to_one_hot_squares(X, dim):
+    """
+    Convert a batch of partial assignments to one-hot squares.
+    :param X: partial assignments as flattened one-hot encodings of shape (batch_size, dim**3) or as 2D
+              representations of shape (batch_size, dim, dim) (an additional channel dimension is allowed); as numpy
+              array.
+    :param dim: PLS dimension; as integer.
+    :return: numpy array of shape (batch_size, dim, dim, dim).
+    """
+    X = np.asarray(X)
+
+    # If it is a flattened representation...
+    if X.ndim == 2 and X.shape[1] == dim ** 3:
+        return X.reshape(-1, dim, dim, dim)
+    # ...if it is a 2D representation
+    elif X.ndim in (3, 4):
+        values = X.reshape(X.shape[0], dim, dim)
+        return (values[..., None] == np.arange(1, dim + 1)).astype(np.int8)
+    else:
+        raise Exception("Illegal input dimension")
+
+########################################################################################################################
+
+
+def local_feasibility_batch(squares, assignments):
+    """
+    Check if the assignments are consistent with the PLS constraints, for a batch of partial assignments. Same result
+    of PLSInstance.assign for each example.
+    :param squares: partial assignments; as numpy array of shape (batch_size, dim, dim, dim).
+    :param assignments: assigned variables indexes in the flattened one-hot encoding; as numpy array of shape
+                        (batch_size, ).
+    :return: numpy array of booleans of shape (batch_size, ).
+    """
+    batch_size, dim = squares.shape[0], squares.shape[1]
+    squares = squares.astype(np.int32)
+    rows, cols, vals = np.unravel_index(np.asarray(assignments), shape=(dim, dim, dim))
+    batch = np.arange(batch_size)
+
+    # The partial assignments must be consistent
+    consistent = (squares.sum(axis=3) <= 1).all(axis=(1, 2)) & \
+                 (squares.sum(axis=2) <= 1).all(axis=(1, 2)) & \
+                 (squares.sum(axis=1) <= 1).all(axis=(1, 2))
+
+    # The cell must be empty and the value must not appear in the same row and column
+    empty_cell = squares[batch, rows, cols].sum(axis=1) == 0
+    free_row = squares[batch, rows, :, vals].sum(axis=1) == 0
+    free_col = squares[batch, :, cols, vals].sum(axis=1) == 0
+
+    return consistent & empty_cell & free_row & free_col
+
+########################################################################################################################
+
+
+def global_feasibility_batch(squares, assignments, local_feas=None, checker=None):
+    """
+    Check if the partial assignments extended with the assignments can be completed to a solution; the solver is
+    called only for the locally consistent ones.
+    :param squares: partial assignments; as numpy array of shape (batch_size, dim, dim, dim).
+    :param assignments: assigned variables indexes in the flattened one-hot encoding; as numpy array of shape
+                        (batch_size, ).
+    :param local_feas: result of local_feasibility_batch, computed if None; as numpy array of booleans.
+    :param checker: the solver; if None, the persistent checker with the default parameters is used; as
+                    PLSFeasibilityChecker.
+    :return: numpy array of booleans of shape (batch_size, ).
+    """
+    dim = squares.shape[1]
+    if local_feas is None:
+        local_feas = local_feasibility_batch(squares, assignments)
+    if checker is None:
+        checker = get_feasibility_checker(dim)
+
+    # Decimal values of the partial assignments (0 means empty) extended with the assignments
+    vals_squares = (np.argmax(squares, axis=3) + np.sum(squares, axis=3)).reshape(len(squares), -1)
+    cells, vals = np.divmod(np.asarray(assignments), dim)
+
+    # Only the locally consistent partial assignments are checked
+    idxs = np.nonzero(local_feas)[0]
+    vals_squares = vals_squares[idxs]
+    vals_squares[np.arange(len(idxs)), cells[idxs]] = vals[idxs] + 1
+
+    feas = np.zeros(len(squares), dtype=bool)
+    feas[idxs] = checker.solve_batch(vals_squares)
+
+    return feas
+
+########################################################################################################################
+
+
+def feasibility_batch(squares, assignments, checker=None):
+    """
+    Local and global feasibility of the assignments for a batch of partial assignments.
+    :param squares: partial assignments; as numpy array of shape (batch_size, dim, dim, dim).
+    :param assignments: assigned variables indexes in the flattened one-hot encoding; as numpy array of shape
+                        (batch_size, ).
+    :param checker: the solver; if None, the persistent checker with the default parameters is used; as
+                    PLSFeasibilityChecker.
+    :return: tuple of two numpy arrays of booleans of shape (batch_size, ); local and global feasibility.
+    """
+    local_feas = local_feasibility_batch(squares, assignments)
+    return local_feas, global_feasibility_batch(squares, assignments, local_feas, checker)
+
+########################################################################################################################
+
+
+def feasibility_multi(squares, assignments, checker=None):
+    """
+    Local and global feasibility of the assignments of several estimators for the same batch of partial assignments;
+    identical (partial assignment, assignment) queries are checked only once.
+    :param squares: partial assignments; as numpy array of shape (batch_size, dim, dim, dim).
+    :param assignments: assigned variables indexes in the flattened one-hot encoding, one row for each estimator; as
+                        numpy array of shape (num_estimators, batch_size).
+    :param checker: the solver; if None, the persistent checker with the default parameters is used; as
+                    PLSFeasibilityChecker.
+    :return: tuple of two numpy arrays of booleans of shape (num_estimators, batch_size) and an integer; local and
+             global feasibility and number of distinct queries.
+    """
+    assignments = np.asarray(assignments)
+    batch_size = len(squares)
+
+    # Each query is identified by the assignment and the example index
+    keys = assignments.astype(np.int64) * batch_size + np.arange(batch_size)
+    unique_keys, inverse = np.unique(keys.reshape(-1), return_inverse=True)
+    unique_assignments, examples = np.divmod(unique_keys, batch_size)
+
+    local_feas, feas = feasibility_batch(squares[examples], unique_assignments, checker)
+    inverse = inverse.reshape(assignments.shape)
+
+    return local_feas[inverse], feas[inverse], len(unique_keys)
+
+########################################################################################################################
+
+
+def feasible_assignments_mask(square, checker=None):
+    """
+    Compute the mask of the globally feasible next assignments of a partial assignment, i.e. the assignments after
+    which the partial assignment can still be completed to a solution. Each solution found by the solver marks as
+    feasible all the assignments it makes to the empty cells, so that far fewer than dim**3 solver calls are needed.
+    :param square: partial assignment; as numpy array of shape (dim, dim, dim).
+    :param checker: the solver; if None, the persistent checker with the default parameters is used; as
+                    PLSFeasibilityChecker.
+    :return: tuple of two numpy arrays of booleans of shape (dim**3, ); the mask, and the assignments whose
+             feasibility is unknown because a solver call hit the time limit (they are not marked as feasible).
+    """
+    dim = square.shape[0]
+    if checker is None:
+        checker = get_feasibility_checker(dim)
+    vals_square = (np.argmax(square, axis=2) + np.sum(square, axis=2)).reshape(-1)
+    empty_cells = np.nonzero(vals_square == 0)[0]
+    mask = np.zeros(dim ** 3, dtype=bool)
+    unknown = np.zeros(dim ** 3, dtype=bool)
+
+    pls = PLSInstance(n=dim)
+    pls.square = square.copy()
+    # Only the assignments allowed by the forward checking can be feasible
+    unresolved = pls.propagation_domains()['full'].reshape(-1) == 0
+
+    # Partial assignments which cannot be completed have no feasible next assignment; if the solver hit the time
+    # limit, all the assignments allowed by the forward checking are unknown
+    num_timeouts = checker.num_timeouts
+    solution = checker.find_solution(vals_square)
+    if solution is None:
+        if checker.num_timeouts > num_timeouts:
+            unknown = unresolved
+        return mask, unknown
+
+    while True:
+        if solution is not None:
+            mask[empty_cells * dim + np.asarray(solution)[empty_cells] - 1] = True
+            unresolved &= ~mask
+        candidates = np.nonzero(unresolved)[0]
+        if len(candidates) == 0:
+            break
+
+        # Check the first unresolved assignment
+        cell, val = divmod(candidates[0], dim)
+        assigned_square = vals_square.copy()
+        assigned_square[cell] = val + 1
+        num_timeouts = checker.num_timeouts
+        solution = checker.find_solution(assigned_square)
+        if checker.num_timeouts > num_timeouts:
+            unknown[candidates[0]] = True
+        unresolved[candidates[0]] = False
+
+    # The assignments of later solutions are feasible even if their own check timed out
+    return mask, unknown & ~mask
+
+########################################################################################################################
+
+
+def feasibility_from_masks(packed_masks, assignments):
+    """
+    Global feasibility of the assignments, gathered from precomputed bit-packed masks of the feasible next assignments
+    (see feasible_assignments_mask).
+    :param packed_masks: masks packed along the last axis with numpy.packbits; as numpy array of shape
+                         (batch_size, ceil(dim**3 / 8)).
+    :param assignments: assigned variables indexes in the flattened one-hot encoding; as numpy array of shape
+                        (batch_size, ) or (num_estimators, batch_size).
+    :return: numpy array of booleans with the same shape of assignments.
+    """
+    assignments = np.asarray(assignments)
+    batch = np.arange(packed_masks.shape[0])
+    bytes_ = packed_masks[batch, assignments // 8]
+    return ((bytes_ >> (7 - assignments % 8)) & 1).astype(bool)
+
+########################################################################################################################
+
+
 class VarArraySolutionPrinterWithLimit(cp_model.CpSolverSolutionCallback):
     """Print and save  solutions."""
 
@@ -529,46 +1184,15 @@ def compute_feasibility_from_predictions(X, preds, dim):
     :return: float; feasibility value.
     """
 
-    feas_count = 0
-
-    for x, pred in zip(X, preds):
-
-        # NOTE: the input can be a flattened one-hot encoding or a 2D representation
-
-        # If it is a flattened representation...
-        if len(x.shape) == 1:
-            # Create a problem instance with current training example for net prediction
-            square = np.reshape(x, (dim, dim, dim))
-        # ...if it is a 2D representation
-        elif len(x.shape) == 3:
-            square = from_2d_to_one_hot(array_to_reshape=x, dim=dim)
+    # NOTE: the input can be a flattened one-hot encoding or a 2D representation
+    squares = to_one_hot_squares(np.asarray(X), dim)
 
-        else:
-            raise Exception("Illegal input dimension")
-
-        pls = PLSInstance(n=dim)
-        pls.square = square.copy()
-        # assert pls.__check_constraints__(), "Constraints should be verified before assignment"
-
-        # Make the prediction assignment
-        assignment = np.argmax(pred)
-        assignment = np.unravel_index(assignment, shape=(dim, dim, dim))
-
-        # Local consistency
-        local_feas = pls.assign(assignment[0], assignment[1], assignment[2])
-
-        # Global consistency
-        if local_feas:
-            vals_square = np.argmax(pls.square.copy(), axis=2) + np.sum(pls.square.copy(), axis=2)
-            solver = PLSSolver(dim, square=np.reshape(vals_square, -1))
-            feas = solver.solve()
-        else:
-            feas = local_feas
+    # Make the prediction assignments
+    assignments = np.argmax(np.asarray(preds).reshape(len(squares), -1), axis=1)
 
-        if feas:
-            feas_count += 1
+    _, feas = feasibility_batch(squares, assignments)
 
-    return feas_count / X.shape[0]
+    return np.sum(feas) / X.shape[0]
 
 ########################################################################################################################
 